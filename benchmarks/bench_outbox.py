@@ -0,0 +1,73 @@
+"""burst of replies through the Outbox against a stub sendMessage with 429s
+
+    python -m benchmarks.bench_outbox --chats 200 --messages 5
+
+each chat gets `messages` replies at once, so after the first send per chat the
+rest wait on that chat's bucket and coalesce into one follow-up.
+"""
+import argparse
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+from bot.outbox import Outbox
+from benchmarks.replay_setup import percentiles
+
+
+class StubSend:
+    def __init__(self, throttle_every: int, latency: float):
+        self.throttle_every = throttle_every
+        self.latency = latency
+        self.calls = 0
+        self.throttled = 0
+
+    async def __call__(self, chat_id: int, text: str, **options) -> str:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.throttle_every and self.calls % self.throttle_every == 0:
+            self.throttled += 1
+            raise RetryAfter(1)
+        return text
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    send = StubSend(args.throttle_every, args.latency)
+    outbox = Outbox(send, rate=args.rate, chat_rate=args.chat_rate, chat_burst=1, workers=args.workers)
+    await outbox.start()
+
+    waits = []
+    futures = []
+    start = time.perf_counter()
+    for chat_id in range(args.chats):
+        for i in range(args.messages):
+            queued = time.perf_counter()
+            future = outbox.send(chat_id, f"reply {i}")
+            future.add_done_callback(lambda f, queued=queued: waits.append(time.perf_counter() - queued))
+            futures.append(future)
+    enqueue = time.perf_counter() - start
+    await asyncio.gather(*futures)
+    elapsed = time.perf_counter() - start
+    await outbox.stop()
+
+    p = percentiles(waits)
+    print(f"messages     {len(futures):,} queued in {enqueue * 1000:.1f}ms")
+    print(f"sends        {send.calls:,} ({outbox.coalesced:,} coalesced, {send.throttled} 429s)")
+    print(f"drained in   {elapsed:.2f}s")
+    print(f"delivery     p50 {p['p50_ms']:.0f}ms  p99 {p['p99_ms']:.0f}ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=5, help="replies per chat")
+    parser.add_argument("--rate", type=float, default=25.0)
+    parser.add_argument("--chat-rate", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.05, help="stub bot api round trip")
+    parser.add_argument("--throttle-every", type=int, default=100)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""ns per value for the old DataParser dispatch vs compiled field parsers
+
+    python -m benchmarks.bench_parser --values 200000
+"""
+import argparse
+import re
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bot.models import DataParser, ModelManager, SetupData, SetupManager
+
+# (field, raw input) pairs as they arrive from setup replies and imports
+CASES: List[Tuple[str, Any]] = [
+    ("strength", "6mg"),
+    ("tokes", "200 puffs"),
+    ("tokes", "200"),
+    ("reduce_percent", "12.5%"),
+    ("reduce_percent", "1,234.5"),
+    ("reduce_amount", 20),
+    ("method", " Number "),
+]
+
+FIELD_TYPES = {
+    "tokes": Optional[int],
+    "strength": Optional[int],
+    "method": Optional[str],
+    "reduce_amount": Optional[int],
+    "reduce_percent": Optional[float],
+}
+
+
+def legacy_to_int(value: Any) -> int:
+    """what to_int used to do, the pattern is looked up in re's cache every call"""
+    if isinstance(value, int):
+        return value
+    match = re.search(DataParser.INT_PATTERN, value)
+    return int(match.group())
+
+
+def legacy_to_float(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.search(DataParser.FLOAT_PATTERN, value.replace(',', ''))
+    return float(match.group())
+
+
+def legacy_enforce_type(field_type: type, value: Any) -> Any:
+    """the old chain of tuple comparisons"""
+    if field_type in (int, Optional[int]):
+        return legacy_to_int(value)
+    if field_type in (float, Optional[float]):
+        return legacy_to_float(value)
+    if field_type in (str, Optional[str]):
+        return str(value).strip()
+    if field_type in (datetime, Optional[datetime]):
+        return value
+    return value
+
+
+def legacy_update(setup: SetupData, field: str, value: Any, parsers: Dict[str, Callable[[Any], Any]]) -> None:
+    """the old update_model_field lookup, a fresh default lambda per call"""
+    parser = parsers.get(field, lambda x: x)
+    setattr(setup, field, parser(value))
+    setup.updated_at = datetime.now()
+
+
+def per_value(fn: Callable[[str, Any], Any], n: int) -> float:
+    cases = (CASES * (n // len(CASES) + 1))[:n]
+    start = time.perf_counter()
+    for field, value in cases:
+        fn(field, value)
+    return (time.perf_counter() - start) / n * 1e9
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--values", type=int, default=200_000)
+    args = parser.parse_args()
+    n = args.values
+
+    compiled = DataParser(SetupData)
+    manager = SetupManager()
+    legacy_parsers = {f: (lambda v, t=t: legacy_enforce_type(t, v)) for f, t in FIELD_TYPES.items()}
+    setup = SetupData(user_id=1)
+
+    rows = [
+        ("legacy enforce_type", per_value(lambda f, v: legacy_enforce_type(FIELD_TYPES[f], v), n)),
+        ("enforce_type", per_value(lambda f, v: DataParser.enforce_type(FIELD_TYPES[f], v, f), n)),
+        ("compiled parse", per_value(compiled.parse, n)),
+        ("legacy update_model_field", per_value(lambda f, v: legacy_update(setup, f, v, legacy_parsers), n)),
+        ("update_model_field", per_value(
+            lambda f, v: ModelManager.update_model_field(setup, f, v, manager.field_parsers), n
+        )),
+    ]
+    print(f"{'path':<28} {'ns/value':>10}")
+    for name, ns in rows:
+        print(f"{name:<28} {ns:>10,.0f}")
+
+    print()
+    print(f"{'input':<14} {'legacy ns':>10} {'compiled ns':>12}")
+    for field, value in CASES:
+        field_type = FIELD_TYPES[field]
+        legacy = per_value(lambda f, v: legacy_enforce_type(field_type, value), n // 10)
+        fast = per_value(lambda f, v: compiled.parse(field, value), n // 10)
+        print(f"{value!r:<14} {legacy:>10,.0f} {fast:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""whole-user-base plan build in duckdb vs a per-user python loop
+
+    python -m benchmarks.bench_plans --users 1000 100000 1000000
+"""
+import argparse
+import math
+import time
+from datetime import timedelta
+from typing import List
+
+from bot.data_transfer import MAX_PLAN_DAYS, DuckDBManager
+from bot.models import SetupData
+from benchmarks.bench_setups import make_setups
+
+
+def python_plans(setups: List[SetupData], max_days: int = MAX_PLAN_DAYS) -> int:
+    """the same taper as DuckDBManager.build_plans, one user and one day at a time"""
+    rows = 0
+    for s in setups:
+        start = s.updated_at.date()
+        for day in range(max_days):
+            # the first day already has one day of reduction applied
+            if s.method == "number":
+                target = max(s.tokes - (day + 1) * s.reduce_amount, 0)
+            else:
+                target = round(s.tokes * math.pow(1 - s.reduce_percent / 100, day + 1))
+            _ = (s.user_id, start + timedelta(days=day), target)
+            rows += 1
+            if target <= 0:
+                break
+    return rows
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, nargs="+", default=[1000, 100_000, 1_000_000])
+    args = parser.parse_args()
+
+    print(f"{'users':>9} {'plan rows':>12} {'python s':>10} {'duckdb s':>10} {'speedup':>8}")
+    for n in args.users:
+        setups = make_setups(n)
+
+        start = time.perf_counter()
+        python_plans(setups)
+        loop = time.perf_counter() - start
+
+        db = DuckDBManager(db_path=":memory:", archive_dir=None)
+        db.upsert_setups(setups)
+        start = time.perf_counter()
+        rows = db.build_plans()
+        vectorised = time.perf_counter() - start
+        db.close()
+
+        print(f"{n:>9} {rows:>12,} {loop:>10.2f} {vectorised:>10.2f} {loop / vectorised:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
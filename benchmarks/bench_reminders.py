@@ -0,0 +1,104 @@
+"""daily reminder fan-out against a stub bot api, with 429s and a restart halfway
+
+    python -m benchmarks.bench_reminders --users 100000 --rate 5000
+
+every user is due before the (frozen) clock, so the whole fan-out happens at
+once. reminders go through an Outbox on the stub, like in the app, so 429s are
+retried by the outbox alone. the first scheduler is stopped after half the users got their message and
+a fresh one picks up from the reminders table, any user messaged twice is
+reported as a duplicate.
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import Counter
+from datetime import date, datetime, time as clock, timedelta, timezone
+
+from telegram.error import RetryAfter
+
+from bot.data_transfer import DuckDBManager
+from bot.outbox import Outbox
+from bot.reminders import ReminderScheduler
+
+
+class StubSend:
+    """records every delivered message, answers 429 to one call in `throttle_every`"""
+
+    def __init__(self, throttle_every: int, retry_after: int, latency: float):
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.latency = latency
+        self.delivered: Counter = Counter()
+        self.calls = 0
+        self.throttled = 0
+
+    async def __call__(self, chat_id: int, text: str, **options) -> None:
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if self.throttle_every and self.calls % self.throttle_every == 0:
+            self.throttled += 1
+            raise RetryAfter(self.retry_after)
+        self.delivered[chat_id] += 1
+
+
+def seed(db: DuckDBManager, users: int) -> None:
+    ids = list(range(1, users + 1))
+    minutes = [random.randrange(0, 24 * 60) for _ in ids]
+    db.writer.call(lambda conn: conn.execute(
+        "INSERT INTO reminders SELECT UNNEST(?::BIGINT[]), UNNEST(?::SMALLINT[]), NULL", [ids, minutes]
+    )).result()
+
+
+async def run(scheduler: ReminderScheduler, send: StubSend, until: int) -> float:
+    start = time.perf_counter()
+    await scheduler.start()
+    while sum(send.delivered.values()) < until:
+        await asyncio.sleep(0.05)
+    await scheduler.stop()
+    return time.perf_counter() - start
+
+
+async def main_async(args: argparse.Namespace) -> None:
+    db = DuckDBManager(db_path=":memory:", archive_dir=None)
+    seed(db, args.users)
+    # the last second of the server-local day, every reminder of the day is due by then
+    tomorrow = date.today() + timedelta(days=1)
+    now = datetime.combine(tomorrow, clock()).astimezone(timezone.utc) - timedelta(seconds=1)
+    send = StubSend(args.throttle_every, args.retry_after, args.latency)
+    outbox = Outbox(send, rate=args.rate, workers=args.workers)
+    await outbox.start()
+
+    def scheduler() -> ReminderScheduler:
+        return ReminderScheduler(db, outbox.send, rate=args.rate, workers=args.workers, now=lambda: now)
+
+    first = await run(scheduler(), send, args.users // 2)
+    sent_first = sum(send.delivered.values())
+    second = await run(scheduler(), send, args.users)
+    await outbox.stop()
+    db.close()
+
+    delivered = sum(send.delivered.values())
+    duplicates = sum(1 for n in send.delivered.values() if n > 1)
+    print(f"users        {args.users:,}")
+    print(f"first run    {sent_first:,} sent in {first:.2f}s")
+    print(f"second run   {delivered - sent_first:,} sent in {second:.2f}s")
+    print(f"throughput   {delivered / (first + second):,.0f}/s (limit {args.rate:,.0f}/s)")
+    print(f"429s         {send.throttled}")
+    print(f"missing      {args.users - len(send.delivered)}")
+    print(f"duplicates   {duplicates}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--rate", type=float, default=5000.0, help="send budget, messages a second")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--latency", type=float, default=0.005, help="stub bot api round trip")
+    parser.add_argument("--throttle-every", type=int, default=10_000)
+    parser.add_argument("--retry-after", type=int, default=1)
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""per-update cost of TelegramExtractor.session, eager build vs the lazy session
+
+    python -m benchmarks.bench_session --updates 100000
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Any, Callable, List
+
+from telegram import Update
+
+from benchmarks.stub_telegram import callback_update, message_update
+from bot.extractors import TelegramExtractor
+
+
+def eager_session(up: Update) -> Any:
+    """what session() used to do, every view built up front"""
+    return (
+        TelegramExtractor.extract_user(up),
+        TelegramExtractor.extract_chat(up),
+        TelegramExtractor.extract_message(up),
+    )
+
+
+def eager_handler(up: Update) -> None:
+    user, _, message = eager_session(up)
+    _ = (user.user_id, user.username or user.first_name, message.reply)
+
+
+def lazy_handler(up: Update) -> None:
+    session = TelegramExtractor.session(up)
+    _ = (session.uid, session.uname, session.message.reply)
+
+
+def make_updates(n: int) -> List[Update]:
+    raw = [
+        callback_update(i, 1000 + i % 500, "number") if i % 5 == 4 else message_update(i, 1000 + i % 500, "12")
+        for i in range(n)
+    ]
+    return [Update.de_json(r, None) for r in raw]
+
+
+def per_update_ns(handler: Callable[[Update], None], updates: List[Update]) -> float:
+    start = time.perf_counter_ns()
+    for up in updates:
+        handler(up)
+    return (time.perf_counter_ns() - start) / len(updates)
+
+
+def retained_bytes(build: Callable[[Update], Any], updates: List[Update]) -> float:
+    """bytes allocated per update by the session objects while they are alive"""
+    tracemalloc.start()
+    kept = [build(up) for up in updates]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del kept
+    return size / len(updates)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=100_000)
+    args = parser.parse_args()
+
+    updates = make_updates(args.updates)
+    # warm effective_user/effective_chat caches the same way for both runs
+    for up in updates:
+        _ = (up.effective_user, up.effective_chat)
+
+    eager = per_update_ns(eager_handler, updates)
+    lazy = per_update_ns(lazy_handler, updates)
+    eager_mem = retained_bytes(eager_session, updates)
+    lazy_mem = retained_bytes(lambda up: TelegramExtractor.session(up), updates)
+
+    print(f"{'':>6} {'ns/update':>10} {'bytes/update':>13}")
+    print(f"{'eager':>6} {eager:>10,.0f} {eager_mem:>13,.0f}")
+    print(f"{'lazy':>6} {lazy:>10,.0f} {lazy_mem:>13,.0f}")
+    print(f"speedup {eager / lazy:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
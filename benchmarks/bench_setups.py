@@ -0,0 +1,67 @@
+"""rows/sec for the legacy per-row pandas insert vs DuckDBManager.upsert_setups
+
+    python -m benchmarks.bench_setups --sizes 1 100 100000
+"""
+import argparse
+import time
+from dataclasses import asdict
+from typing import List
+
+import duckdb
+
+from bot.data_transfer import DuckDBManager
+from bot.models import SetupData
+
+
+def make_setups(n: int) -> List[SetupData]:
+    return [
+        SetupData(
+            user_id=i,
+            tokes=200 + i % 50,
+            strength=6,
+            method="number" if i % 2 else "percent",
+            reduce_amount=10,
+            reduce_percent=5.0,
+        )
+        for i in range(n)
+    ]
+
+
+def legacy_insert(conn: duckdb.DuckDBPyConnection, setups: List[SetupData]) -> None:
+    """the old insert_setup path, one DataFrame and one commit per row"""
+    import pandas as pd
+
+    for setup in setups:
+        df = pd.DataFrame([asdict(setup)])
+        conn.execute("INSERT OR REPLACE INTO user_setups SELECT * FROM df")
+        conn.commit()
+
+
+def timed(fn, *args) -> float:
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 100_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'legacy rows/s':>15} {'upsert rows/s':>15} {'speedup':>8}")
+    for n in args.sizes:
+        setups = make_setups(n)
+
+        db = DuckDBManager(db_path=":memory:")
+        legacy = timed(legacy_insert, db.conn, setups)
+        db.close()
+
+        db = DuckDBManager(db_path=":memory:")
+        bulk = timed(db.upsert_setups, setups)
+        db.close()
+
+        print(f"{n:>8} {n / legacy:>15,.0f} {n / bulk:>15,.0f} {legacy / bulk:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""replay full /setup conversations through register_handlers with no network
+
+every simulated user sends /setup -> tokes -> strength -> method button -> goal,
+users run concurrently and each user's updates run in order. replies go
+through an Outbox on the stub transport with its rate limits lifted, and an
+update is timed until every reply it queued has been sent. results are
+printed (or written with --out) as json so runs can be diffed:
+
+    python -m benchmarks.replay_setup --users 2000 --out results.json
+"""
+import argparse
+import asyncio
+import json
+import platform
+import resource
+import sys
+import time
+from typing import Any, Dict, List, Tuple
+
+from telegram import Update
+
+from benchmarks.stub_telegram import StubRequest, build_application, callback_update, message_update
+from bot.data_transfer import DuckDBManager
+from bot.handlers import register_handlers
+from bot.outbox import Outbox
+
+# (handler the update should land in, update builder)
+SCRIPT: List[Tuple[str, Any]] = [
+    ("ask_tokes", lambda uid, n: message_update(n, uid, "/setup")),
+    ("ask_strength", lambda uid, n: message_update(n, uid, "200")),
+    ("ask_method", lambda uid, n: message_update(n, uid, "6mg")),
+    ("ask_goal", lambda uid, n: callback_update(n, uid, "number" if uid % 2 else "percent")),
+    ("setup_finish", lambda uid, n: message_update(n, uid, "20")),
+]
+
+
+class TimedOutbox(Outbox):
+    """an Outbox that keeps each chat's reply futures until the replay awaits them"""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.replies: Dict[int, List["asyncio.Future[Any]"]] = {}
+
+    def send(self, chat_id: int, text: str, **options: Any) -> "asyncio.Future[Any]":
+        future = super().send(chat_id, text, **options)
+        self.replies.setdefault(chat_id, []).append(future)
+        return future
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+    at = lambda p: samples[min(len(samples) - 1, int(p / 100 * len(samples)))] * 1000
+    return {
+        "count": len(samples),
+        "p50_ms": round(at(50), 4),
+        "p95_ms": round(at(95), 4),
+        "p99_ms": round(at(99), 4),
+        "mean_ms": round(sum(samples) / len(samples) * 1000, 4),
+    }
+
+
+async def replay(users: int, rounds: int, latency: float) -> Dict[str, Any]:
+    request = StubRequest(latency=latency)
+    app = build_application(request)
+    db = DuckDBManager(db_path=":memory:", archive_dir=None)
+    # no throttling, the stub latency is the only cost of a send
+    outbox = TimedOutbox(
+        send=lambda chat_id, text, **options: app.bot.send_message(chat_id, text, **options),
+        rate=1e9,
+        chat_rate=1e9,
+        chat_burst=1e9,
+        workers=64,
+    )
+    register_handlers(app, db, outbox=outbox)
+
+    timings: Dict[str, List[float]] = {name: [] for name, _ in SCRIPT}
+    # pre-built so json decoding is not part of the measurement
+    conversations = [
+        [(name, Update.de_json(build(1000 + u, (r * users + u) * len(SCRIPT) + i), app.bot))
+         for r in range(rounds) for i, (name, build) in enumerate(SCRIPT)]
+        for u in range(users)
+    ]
+
+    async def user(conversation: List[Tuple[str, Update]]) -> None:
+        for name, update in conversation:
+            start = time.perf_counter()
+            await app.process_update(update)
+            await asyncio.gather(*outbox.replies.pop(update.effective_chat.id, []))
+            timings[name].append(time.perf_counter() - start)
+
+    await app.initialize()
+    await outbox.start()
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(user(c) for c in conversations))
+        elapsed = time.perf_counter() - start
+    finally:
+        await outbox.stop()
+        await app.shutdown()
+        db.close()
+
+    total = users * rounds * len(SCRIPT)
+    return {
+        "config": {"users": users, "rounds": rounds, "stub_latency_s": latency},
+        "env": {"python": sys.version.split()[0], "platform": platform.platform()},
+        "updates": total,
+        "elapsed_s": round(elapsed, 4),
+        "updates_per_sec": round(total / elapsed, 1),
+        # linux reports ru_maxrss in KiB
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "handlers": {name: percentiles(samples) for name, samples in timings.items()},
+        "api_calls": request.calls,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000, help="concurrent simulated users")
+    parser.add_argument("--rounds", type=int, default=1, help="setup conversations per user")
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated bot api latency in seconds")
+    parser.add_argument("--out", help="write the json here instead of stdout")
+    args = parser.parse_args()
+
+    result = json.dumps(asyncio.run(replay(args.users, args.rounds, args.latency)), indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(result + "\n")
+    else:
+        print(result)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""offline telegram transport and synthetic update payloads for benchmarks
+
+StubRequest answers every bot api call locally, so an Application built with it
+can be initialised, process updates and "reply" without any network access.
+"""
+import asyncio
+import itertools
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram.ext import Application, ApplicationBuilder
+from telegram.request import BaseRequest, RequestData
+
+BOT_TOKEN = "123456:STUB"
+
+_BOT_USER = {"id": 123456, "is_bot": True, "first_name": "stub", "username": "stub_bot"}
+
+
+class StubRequest(BaseRequest):
+    """answers bot api methods with canned results, counts the calls and keeps the sends in order"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls: Dict[str, int] = {}
+        # (api method, chat_id) of every send* call as it arrived
+        self.sent: List[Tuple[str, int]] = []
+        self._message_ids = itertools.count(1)
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout: Any = None,
+        write_timeout: Any = None,
+        connect_timeout: Any = None,
+        pool_timeout: Any = None,
+    ) -> Tuple[int, bytes]:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        api_method = url.rsplit("/", 1)[-1]
+        self.calls[api_method] = self.calls.get(api_method, 0) + 1
+        params = request_data.parameters if request_data else {}
+        return 200, json.dumps({"ok": True, "result": self._result(api_method, params)}).encode()
+
+    def _result(self, api_method: str, params: Dict[str, Any]) -> Any:
+        if api_method == "getMe":
+            return _BOT_USER
+        if api_method == "getUpdates":
+            return []
+        if api_method.startswith("send"):
+            chat_id = int(params.get("chat_id", 0))
+            self.sent.append((api_method, chat_id))
+            return {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "from": _BOT_USER,
+                "text": params.get("text") or params.get("caption") or "",
+            }
+        return True
+
+
+def build_application(request: Optional[StubRequest] = None, **builder_options: Any) -> Application:
+    """an Application wired to the stub transport"""
+    request = request or StubRequest()
+    builder = ApplicationBuilder().token(BOT_TOKEN).request(request).get_updates_request(StubRequest())
+    for name, value in builder_options.items():
+        builder = getattr(builder, name)(value)
+    return builder.build()
+
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}", "username": f"user{user_id}"}
+
+
+def message_update(update_id: int, user_id: int, text: str) -> Dict[str, Any]:
+    """raw json for a private text message, commands get their bot_command entity"""
+    message: Dict[str, Any] = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+        "from": _user(user_id),
+        "text": text,
+    }
+    if text.startswith("/"):
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return {"update_id": update_id, "message": message}
+
+
+def callback_update(update_id: int, user_id: int, data: str) -> Dict[str, Any]:
+    """raw json for an inline keyboard press"""
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": _user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private", "first_name": f"user{user_id}"},
+                "from": _BOT_USER,
+                "text": "How do you want to reduce vaping?",
+            },
+        },
+    }
@@ -0,0 +1,130 @@
+"""POST recorded update json at a webhook and report throughput and latency
+
+with no --url the bot is started in-process on the stub transport and an
+in-memory db, so the whole webhook path is load tested without network:
+
+    python -m benchmarks.webhook_replay --updates recorded.jsonl --concurrency 50
+    python -m benchmarks.webhook_replay --synthetic 20000
+    python -m benchmarks.webhook_replay --url http://127.0.0.1:8443/webhook --secret s3cret --updates recorded.jsonl
+
+--updates takes one update object per line, or a single json array.
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+from benchmarks.stub_telegram import build_application, message_update
+from bot.data_transfer import DuckDBManager
+from bot.handlers import register_handlers
+from bot.ordering import PerUserUpdateProcessor
+from bot.webhook import SECRET_HEADER, WebhookServer
+
+
+def load_updates(path: str) -> List[Dict[str, Any]]:
+    with open(path) as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def synthetic_updates(n: int, users: int) -> List[Dict[str, Any]]:
+    return [message_update(i + 1, 1000 + i % users, "/puff") for i in range(n)]
+
+
+async def post_all(url: str, bodies: List[bytes], concurrency: int, secret: Optional[str]) -> Tuple[List[float], Dict[int, int]]:
+    """each worker keeps one connection alive and posts its share of the bodies"""
+    parts = urlsplit(url)
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    pending = iter(bodies)
+
+    async def worker() -> None:
+        reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+        try:
+            for body in pending:
+                head = (
+                    f"POST {parts.path or '/'} HTTP/1.1\r\n"
+                    f"Host: {parts.hostname}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                )
+                if secret:
+                    head += f"{SECRET_HEADER}: {secret}\r\n"
+                start = time.perf_counter()
+                writer.write(head.encode() + b"\r\n" + body)
+                await writer.drain()
+                status = int((await reader.readline()).split()[1])
+                while (await reader.readline()) not in (b"\r\n", b""):
+                    pass
+                latencies.append(time.perf_counter() - start)
+                statuses[status] = statuses.get(status, 0) + 1
+        finally:
+            writer.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, statuses
+
+
+async def run(args: argparse.Namespace) -> None:
+    updates = load_updates(args.updates) if args.updates else synthetic_updates(args.synthetic, args.users)
+    bodies = [json.dumps(u).encode() for u in updates]
+
+    app = db = server = None
+    url = args.url
+    if url is None:
+        db = DuckDBManager(db_path=":memory:", archive_dir=None)
+        app = build_application(concurrent_updates=PerUserUpdateProcessor(args.app_concurrency))
+        register_handlers(app, db)
+        server = WebhookServer(app, listen="127.0.0.1", port=0, secret_token=args.secret)
+        await app.initialize()
+        await app.start()
+        await server.start()
+        url = f"http://127.0.0.1:{server.bound_port}/webhook"
+
+    try:
+        start = time.perf_counter()
+        latencies, statuses = await post_all(url, bodies, args.concurrency, args.secret)
+        elapsed = time.perf_counter() - start
+        if app is not None:
+            # stop() drains the update queue, so this times the handlers and not just the acks
+            await server.stop()
+            await app.stop()
+        processed = time.perf_counter() - start
+    finally:
+        if app is not None:
+            await server.stop()
+            if app.running:
+                await app.stop()
+            await app.shutdown()
+            db.close()
+
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))] * 1000
+    print(f"posted     {len(bodies):,} updates over {args.concurrency} connections")
+    print(f"statuses   {statuses}")
+    print(f"ack rate   {len(bodies) / elapsed:,.0f} req/s")
+    if app is not None:
+        print(f"processed  {len(bodies) / processed:,.0f} updates/s")
+    print(f"latency ms p50 {pct(50):.2f}  p95 {pct(95):.2f}  p99 {pct(99):.2f}  "
+          f"mean {statistics.fmean(latencies) * 1000:.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", help="recorded updates, jsonl or a json array")
+    parser.add_argument("--synthetic", type=int, default=10_000, help="number of /puff updates when no file is given")
+    parser.add_argument("--users", type=int, default=500, help="distinct users in synthetic traffic")
+    parser.add_argument("--url", help="post to an already running webhook instead of an in-process bot")
+    parser.add_argument("--secret", help="secret token header to send (and require in-process)")
+    parser.add_argument("--concurrency", type=int, default=20, help="client connections")
+    parser.add_argument("--app-concurrency", type=int, default=32, help="in-process concurrent update workers")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,283 @@
+import time
+_LOAD_START = time.perf_counter()
+
+import asyncio
 import os
+import signal
+from typing import Any, Optional
 from dotenv import load_dotenv
+from telegram import Update
 from telegram.ext import Application
 from .handlers import register_handlers
 from .data_transfer import DuckDBManager
+from .logs import setup_logging, stop_logging
+from .maintenance import MaintenanceService
+from .metrics import METRICS, InstrumentedRequest, MetricsServer
+from .ordering import PerUserUpdateProcessor
+from .outbox import DEFAULT_CHAT_RATE, DEFAULT_RATE, Outbox
+from .charts import ProgressCharts
+from .cluster import shard_for
+from .dbserver import RemoteDuckDB
+from .persistence import DuckDBPersistence
+from .reminders import DEFAULT_SEND_RATE, ReminderScheduler
 import logging
 
-# Configure logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
+def logging_from_env() -> None:
+    """all logging goes through one queue, written out on a background thread"""
+    setup_logging(
+        level=os.getenv("LOG_LEVEL", "INFO"),
+        fmt=os.getenv("LOG_FORMAT", "json"),
+        file_path=os.getenv("LOG_FILE"),
+        max_bytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+        backup_count=int(os.getenv("LOG_BACKUPS", "5")),
+        debug_sample_rate=float(os.getenv("LOG_DEBUG_SAMPLE", "1.0")),
+    )
+
+
+def db_from_env() -> DuckDBManager:
+    return DuckDBManager(
+        db_path="vape_tracking.db",
+        flush_interval=float(os.getenv("WRITE_FLUSH_INTERVAL", "0.25")),
+        batch_size=int(os.getenv("WRITE_BATCH_SIZE", "500")),
+        max_queue=int(os.getenv("WRITE_QUEUE_SIZE", "10000")),
+        archive_dir=os.getenv("PUFF_ARCHIVE_DIR", "puff_archive"),
+        archive_after_days=int(os.getenv("PUFF_ARCHIVE_AFTER_DAYS", "7")),
+        archive_interval=float(os.getenv("PUFF_ARCHIVE_INTERVAL", "3600")),
+        read_pool_size=int(os.getenv("READ_POOL_SIZE", "4")),
+        # parquet copy /stats reports run on, unset to report on the live tables
+        report_dir=os.getenv("REPORT_SNAPSHOT_DIR", "report_snapshot") or None,
+        report_interval=float(os.getenv("REPORT_SNAPSHOT_INTERVAL", "300")),
+        result_cache_size=int(os.getenv("RESULT_CACHE_SIZE", "10000")),
+    )
+
+
+def maintenance_from_env(db: DuckDBManager, family: str = "handler") -> Optional[MaintenanceService]:
+    """background snapshots/retention/checkpoints, None when MAINTENANCE_INTERVAL is 0"""
+    interval = float(os.getenv("MAINTENANCE_INTERVAL", str(6 * 3600)))
+    if interval <= 0:
+        return None
+    retain_days = os.getenv("PUFF_RETAIN_DAYS")
+    return MaintenanceService(
+        db,
+        snapshot_dir=os.getenv("SNAPSHOT_DIR", "snapshots") or None,
+        keep_snapshots=int(os.getenv("SNAPSHOT_KEEP", "3")),
+        # unset keeps raw puff events forever
+        retain_days=int(retain_days) if retain_days else None,
+        interval=interval,
+        p99_budget=float(os.getenv("MAINTENANCE_P99_BUDGET", "0.5")),
+        family=family,
+    )
+
+
 class VapeBot:
-    def __init__(self):
+    def __init__(self, db: Optional[RemoteDuckDB] = None, shard: int = 0, shards: int = 1):
+        """`db`, `shard` and `shards` are only given to the workers of a sharded deployment (bot.cluster)"""
         load_dotenv()
+        logging_from_env()
         token = os.getenv("TOKEN")
+        # a shard worker gets its updates from the launcher and its db from the db process
+        self.sharded = db is not None
+        self.shard = shard
+        self.shards = shards
+        # "polling" (default) or "webhook"
+        self.mode = os.getenv("BOT_MODE", "polling").lower()
+        
+        # seconds from import to ready-to-poll before a warning is logged
+        self.startup_budget = float(os.getenv("STARTUP_BUDGET", "2.0"))
+
+        # prometheus text on METRICS_PORT, off when unset
+        metrics_port = os.getenv("METRICS_PORT")
+        # shard workers take consecutive ports from there
+        self.metrics_server = MetricsServer(port=int(metrics_port) + shard) if metrics_port else None
         
         # initialise app and db
-        self.app = Application.builder().token(token).build()
-        self.db = DuckDBManager(db_path="vape_tracking.db")
+        self.db = db if self.sharded else db_from_env()
+        # conversation state and user/chat data survive restarts. persistence needs
+        # the connection itself, so shard workers keep them in memory only
+        persistence = None if self.sharded else DuckDBPersistence(
+            self.db,
+            flush_interval=float(os.getenv("PERSIST_FLUSH_INTERVAL", "5")),
+        )
+        # the db process runs maintenance for a sharded deployment
+        self.maintenance = None if self.sharded else maintenance_from_env(self.db)
+        # users are served concurrently, each user's updates still run in order
+        processor = PerUserUpdateProcessor(
+            max_concurrent_updates=int(os.getenv("UPDATE_CONCURRENCY", "32")),
+            max_pending_per_user=int(os.getenv("USER_QUEUE_DEPTH", "20")),
+        )
+        builder = (
+            Application.builder()
+            .token(token)
+            .concurrent_updates(processor)
+            # times every outbound bot api call
+            .request(InstrumentedRequest())
+            .post_init(self._on_ready)
+            .post_stop(self._on_stop)
+            .post_shutdown(self._on_shutdown)
+        )
+        if persistence is not None:
+            builder = builder.persistence(persistence)
+        if self.sharded:
+            builder = builder.updater(None)
+        self.app = builder.build()
+        METRICS.gauge("queue_depth", "updates_pending", lambda: processor.pending)
+        METRICS.gauge("queue_depth", "updates_dropped", lambda: processor.dropped)
+
+        # every text reply goes through one queue, OUTBOX_RATE a second overall, OUTBOX_CHAT_RATE per chat
+        self.outbox = Outbox(
+            send=lambda chat_id, text, **options: self.app.bot.send_message(chat_id, text, **options),
+            # the bot-wide limit is split evenly between shard workers
+            rate=float(os.getenv("OUTBOX_RATE", str(DEFAULT_RATE))) / shards,
+            chat_rate=float(os.getenv("OUTBOX_CHAT_RATE", str(DEFAULT_CHAT_RATE))),
+            workers=int(os.getenv("OUTBOX_WORKERS", "8")),
+        )
+
+        # reminders go out through the outbox too, REMINDER_RATE caps their share of it
+        self.reminders = ReminderScheduler(
+            self.db,
+            send=self.outbox.send,
+            rate=float(os.getenv("REMINDER_RATE", str(DEFAULT_SEND_RATE))) / shards,
+            workers=int(os.getenv("REMINDER_WORKERS", "8")),
+            # each shard reminds only its own users
+            owns=(lambda user_id: shard_for(user_id, shards) == shard) if self.sharded else None,
+        )
+
+        # /progress pngs render in worker processes, cached in memory and on disk
+        self.charts = ProgressCharts(
+            self.db,
+            cache_dir=os.path.join(os.getenv("CHART_CACHE_DIR", "chart_cache"), f"shard{shard}")
+            if self.sharded else os.getenv("CHART_CACHE_DIR", "chart_cache"),
+            max_entries=int(os.getenv("CHART_CACHE_SIZE", "256")),
+            workers=int(os.getenv("CHART_WORKERS", "2")),
+        )
         
-        register_handlers(self.app, self.db)
+        register_handlers(
+            self.app,
+            self.db,
+            # each shard only ever caches its own users
+            setup_cache_size=max(int(os.getenv("SETUP_CACHE_SIZE", "10000")) // shards, 1),
+            setup_cache_ttl=float(os.getenv("SETUP_CACHE_TTL", "3600")),
+            max_concurrent_exports=int(os.getenv("EXPORT_CONCURRENCY", "2")),
+            admin_ids=[int(i) for i in os.getenv("ADMIN_IDS", "").split(",") if i.strip()],
+            reminders=self.reminders,
+            charts=self.charts,
+            outbox=self.outbox,
+        )
 
     def run(self):
         """Start the bot and ensure proper cleanup"""
         try:
-            logger.info("Starting VapeBot...")
-            self.app.run_polling()
-        except Exception as e:
-            logger.error(f"Bot error: {e}")
+            logger.info("Starting VapeBot in %s mode...", self.mode)
+            if self.mode == "webhook":
+                asyncio.run(self._run_webhook())
+            else:
+                self.app.run_polling()
+        except Exception:
+            logger.exception("Bot error")
             raise
         finally:
-            logger.info("Shutting down...")
-            self.db.conn.close()
\ No newline at end of file
+            self._close()
+
+    def run_shard(self, updates: Any) -> None:
+        """serve the updates the launcher routes to this shard until it sends None"""
+        try:
+            logger.info("Starting VapeBot shard %d of %d...", self.shard, self.shards)
+            asyncio.run(self._run_shard(updates))
+        except Exception:
+            logger.exception("Bot error")
+            raise
+        finally:
+            self._close()
+
+    def _close(self) -> None:
+        logger.info("Shutting down...")
+        # flushes anything still sitting in the write queue
+        self.db.close()
+        stop_logging()
+
+    async def _on_ready(self, app: Application) -> None:
+        """post_init hook, runs right before the first poll"""
+        await self._start_metrics(app)
+        await self.outbox.start()
+        await self.reminders.start()
+        if self.maintenance is not None:
+            self.maintenance.start()
+        elapsed = time.perf_counter() - _LOAD_START
+        log = logger.warning if elapsed > self.startup_budget else logger.info
+        log("Ready in %.2fs (budget %.2fs)", elapsed, self.startup_budget)
+
+    async def _on_stop(self, app: Application) -> None:
+        """post_stop hook, the bot can still send until this returns"""
+        await self.reminders.stop()
+        await self.outbox.stop()
+
+    async def _on_shutdown(self, app: Application) -> None:
+        """post_shutdown hook, runs before the db is closed"""
+        self.charts.close()
+        if self.maintenance is not None:
+            # waits out a snapshot in progress
+            await asyncio.to_thread(self.maintenance.close)
+        await self._stop_metrics(app)
+
+    async def _start_metrics(self, app: Application) -> None:
+        if self.metrics_server is not None:
+            await self.metrics_server.start()
+
+    async def _stop_metrics(self, app: Application) -> None:
+        if self.metrics_server is not None:
+            await self.metrics_server.stop()
+
+    async def _run_webhook(self) -> None:
+        """serve telegram webhook posts until SIGINT/SIGTERM"""
+        # only webhook deployments pay for importing the server
+        from .webhook import WebhookServer
+
+        secret = os.getenv("WEBHOOK_SECRET")
+        max_connections = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+        server = WebhookServer(
+            self.app,
+            listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", "8443")),
+            url_path=os.getenv("WEBHOOK_PATH", "/webhook"),
+            secret_token=secret,
+            max_connections=max_connections,
+        )
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        async with self.app:
+            # behind a proxy WEBHOOK_URL is the public address telegram should post to
+            url = os.getenv("WEBHOOK_URL")
+            if url:
+                await self.app.bot.set_webhook(url, secret_token=secret, max_connections=max_connections)
+            await self.app.start()
+            await server.start()
+            # the post_* hooks only fire under run_polling, so call them here
+            await self._on_ready(self.app)
+            try:
+                await stop.wait()
+            finally:
+                await server.stop()
+                await self.app.stop()
+                await self._on_stop(self.app)
+                await self._on_shutdown(self.app)
+
+    async def _run_shard(self, updates: Any) -> None:
+        async with self.app:
+            await self.app.start()
+            await self._on_ready(self.app)
+            try:
+                while True:
+                    data = await asyncio.to_thread(updates.get)
+                    if data is None:
+                        break
+                    await self.app.update_queue.put(Update.de_json(data, self.app.bot))
+            finally:
+                await self.app.stop()
+                await self._on_stop(self.app)
+                await self._on_shutdown(self.app)
@@ -0,0 +1,206 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Generic, Hashable, Iterable, Optional, Set, Tuple, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+# stored in place of None, so a key known to have no value is a hit too
+_NONE = object()
+
+
+class LRUCache(Generic[K, V]):
+    """bounded LRU with idle TTL.
+
+    entries are kept in access order so both the size bound and the idle TTL
+    only ever have to look at the head. None is cached like any other value,
+    so a key known to have nothing behind it is a hit too.
+    """
+
+    def __init__(self, max_entries: int = 10_000, ttl: Optional[float] = 3600.0):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[K, V]" = OrderedDict()
+        self._touched: Dict[K, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: K) -> Optional[V]:
+        """cached value, None on a miss or when None was stored"""
+        return self.lookup(key)[1]
+
+    def lookup(self, key: K) -> Tuple[bool, Optional[V]]:
+        """(found, value), so a cached None can be told apart from a miss"""
+        now = time.monotonic()
+        self._expire(now)
+        if key not in self._entries:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        self._entries.move_to_end(key)
+        self._touched[key] = now
+        value = self._entries[key]
+        return True, None if value is _NONE else value
+
+    def put(self, key: K, value: Optional[V]) -> None:
+        now = time.monotonic()
+        self._expire(now)
+        self._entries[key] = _NONE if value is None else value
+        self._entries.move_to_end(key)
+        self._touched[key] = now
+        while len(self._entries) > self.max_entries:
+            self._evict_oldest()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _expire(self, now: float) -> None:
+        if self.ttl is None:
+            return
+        while self._entries:
+            oldest = next(iter(self._entries))
+            if now - self._touched[oldest] < self.ttl:
+                break
+            self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        key, _ = self._entries.popitem(last=False)
+        del self._touched[key]
+        self.evictions += 1
+
+
+class ResultCache:
+    """per-user query results, dropped as soon as that user's data changes.
+
+    entries are keyed by (user_id, shape, args) where shape names the query,
+    and kept in LRU order up to `max_entries`. there is no TTL, `invalidate`
+    is called when a user's writes commit and drops exactly their entries.
+    an invalidation also moves the user's generation on, so a query that
+    started before the change never stores its result after it. generations
+    are only kept while the user has a query running, nothing else reads
+    them, so they do not pile up for every user ever seen. concurrent
+    misses on the same key wait for the first one's query. thread-safe, the
+    queries themselves run outside the lock.
+    """
+
+    def __init__(self, max_entries: int = 10_000):
+        if max_entries < 1:
+            raise ValueError("max_entries must be at least 1")
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, Any]" = OrderedDict()
+        self._by_user: Dict[int, Set[Tuple]] = {}
+        self._generations: Dict[int, int] = {}
+        # user -> their queries running, the generation is dropped with the last one
+        self._loading: Dict[int, int] = {}
+        # bumped by clear(), so it invalidates queries in flight for every user
+        self._epoch = 0
+        self._inflight: Dict[Tuple, Future] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, user_id: int, shape: str, args: Tuple, load: Callable[[], Any]) -> Any:
+        """cached result of `load()` for this user and query, None results included"""
+        key = (user_id, shape, args)
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            generation = (self._epoch, self._generations.get(user_id, 0))
+            flight = (key, generation)
+            pending = self._inflight.get(flight)
+            if pending is None:
+                self.misses += 1
+                future = self._inflight[flight] = Future()
+                self._loading[user_id] = self._loading.get(user_id, 0) + 1
+            else:
+                self.coalesced += 1
+        if pending is not None:
+            return pending.result()
+
+        try:
+            value = load()
+        except BaseException as e:
+            with self._lock:
+                self._landed(flight)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            if generation == (self._epoch, self._generations.get(user_id, 0)):
+                self._store(key, value)
+            self._landed(flight)
+        future.set_result(value)
+        return value
+
+    def invalidate(self, user_ids: Iterable[int]) -> None:
+        """drop the users' results, called once their writes have committed"""
+        with self._lock:
+            for user_id in user_ids:
+                if user_id in self._loading:
+                    self._generations[user_id] = self._generations.get(user_id, 0) + 1
+                for key in self._by_user.pop(user_id, ()):
+                    del self._entries[key]
+                    self.invalidations += 1
+
+    def clear(self) -> None:
+        """drop every result, for writes that touch users we cannot name"""
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._epoch += 1
+            self._entries.clear()
+            self._by_user.clear()
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    def _landed(self, flight: Tuple) -> None:
+        del self._inflight[flight]
+        user_id = flight[0][0]
+        self._loading[user_id] -= 1
+        if not self._loading[user_id]:
+            del self._loading[user_id]
+            self._generations.pop(user_id, None)
+
+    def _store(self, key: Tuple, value: Any) -> None:
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        self._by_user.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest, _ = self._entries.popitem(last=False)
+            keys = self._by_user[oldest[0]]
+            keys.discard(oldest)
+            if not keys:
+                del self._by_user[oldest[0]]
+            self.evictions += 1
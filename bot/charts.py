@@ -0,0 +1,174 @@
+import asyncio
+import glob
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+
+from .cache import LRUCache
+from .data_transfer import DuckDBManager
+from .metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# days shown by /progress when no range is given, and the most it will draw
+DEFAULT_CHART_DAYS = 30
+MAX_CHART_DAYS = 365
+
+ChartKey = Tuple[int, date, date, int]
+
+
+def render_progress(days: List[date], puffs: List[int], targets: List[Optional[int]]) -> bytes:
+    """png of daily puffs against the planned target line, runs in a worker process"""
+    import io
+
+    # imported here so only the pool workers pay for matplotlib
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 4), dpi=100)
+    try:
+        ax.bar(days, puffs, color="#4c72b0", label="puffs")
+        if targets and targets[-1] is not None:
+            ax.step(days, targets, where="mid", color="#dd8452", linestyle="--", label=f"target ({targets[-1]})")
+        ax.set_ylabel("puffs")
+        ax.set_title(f"{days[0]:%d %b} - {days[-1]:%d %b %Y}")
+        ax.legend(loc="upper right")
+        fig.autofmt_xdate()
+        fig.tight_layout()
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png")
+        return buf.getvalue()
+    finally:
+        plt.close(fig)
+
+
+class ProgressCharts:
+    """renders /progress charts off the event loop and caches the pngs.
+
+    a chart is keyed by (user_id, start, end, data version). the version comes
+    from DuckDBManager.data_version and moves whenever a write for the user
+    commits, so new puffs or a new setup simply stop matching the old key.
+    pngs live in a memory LRU backed by `cache_dir`, the user's older files are
+    deleted when a newer version is written. versions restart at zero with the
+    process, so the directory is emptied at startup. concurrent requests for
+    the same key share one render.
+    """
+
+    def __init__(
+        self,
+        db: DuckDBManager,
+        cache_dir: Optional[str] = "chart_cache",
+        max_entries: int = 256,
+        workers: int = 2,
+    ):
+        self.db = db
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.memory: LRUCache[ChartKey, bytes] = LRUCache(max_entries=max_entries, ttl=None)
+        self._inflight: Dict[ChartKey, "asyncio.Future[bytes]"] = {}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._files: Dict[int, Set[str]] = {}
+        self.renders = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            for stale in glob.glob(os.path.join(cache_dir, "*.png")):
+                os.remove(stale)
+        for stat in ("size", "hits", "misses", "evictions"):
+            METRICS.gauge("chart_cache", stat, lambda stat=stat: self.memory.stats[stat])
+        METRICS.gauge("chart_cache", "renders", lambda: self.renders)
+
+    async def chart(self, user_id: int, days: int = DEFAULT_CHART_DAYS, end: Optional[date] = None) -> bytes:
+        """png for the last `days` days up to `end` (today by default)"""
+        end = end or date.today()
+        # a round trip to the db process in a sharded deployment, so never on the loop
+        version = await asyncio.to_thread(self.db.data_version, user_id)
+        key = (user_id, end - timedelta(days=days - 1), end, version)
+        cached = self.memory.get(key)
+        if cached is not None:
+            return cached
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            png = await self._load_or_render(key)
+            self.memory.put(key, png)
+            future.set_result(png)
+            return png
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # nobody else may be waiting, keep asyncio from warning about it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def _load_or_render(self, key: ChartKey) -> bytes:
+        path = self._path(key)
+        if path is not None:
+            png = await asyncio.to_thread(self._read, path)
+            if png is not None:
+                return png
+
+        user_id, start, end, _ = key
+        series = await asyncio.to_thread(self.db.progress_series, user_id, start, end)
+        if self._pool is None:
+            # started on first use, spawned rather than forked since the parent runs threads
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        self.renders += 1
+        png = await asyncio.get_running_loop().run_in_executor(
+            self._pool,
+            render_progress,
+            [p.period for p in series],
+            [p.puffs for p in series],
+            [p.target for p in series],
+        )
+        if path is not None:
+            await asyncio.to_thread(self._write, key, path, png)
+        return png
+
+    def _path(self, key: ChartKey) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        user_id, start, end, version = key
+        return os.path.join(self.cache_dir, f"{user_id}_{start:%Y%m%d}_{end:%Y%m%d}_v{version}.png")
+
+    @staticmethod
+    def _read(path: str) -> Optional[bytes]:
+        try:
+            with open(path, "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key: ChartKey, path: str, png: bytes) -> None:
+        files = self._files.setdefault(key[0], set())
+        # older versions of this user's charts can never be hit again
+        for stale in [f for f in files if not f.endswith(f"_v{key[3]}.png")]:
+            files.discard(stale)
+            try:
+                os.remove(stale)
+            except FileNotFoundError:
+                pass
+        files.add(path)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(png)
+        os.replace(tmp, path)
@@ -0,0 +1,243 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+import time
+from typing import Any, List, Optional
+
+from dotenv import load_dotenv
+from telegram import Bot, Update
+from telegram.error import NetworkError, RetryAfter
+
+from .dbserver import STOP, DBServer, RemoteDuckDB
+from .logs import stop_logging
+from .ordering import PerUserUpdateProcessor
+from .ratelimit import retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# how often the launcher checks on its children
+SUPERVISE_INTERVAL = 1.0
+
+# a worker that dies this often within the window is not restarted again
+MAX_RESTARTS = 5
+RESTART_WINDOW = 60.0
+
+# seconds a worker gets to drain on shutdown before it is terminated
+STOP_TIMEOUT = 30.0
+
+# long polling timeout for getUpdates
+POLL_TIMEOUT = 30
+
+
+def shard_for(user_id: int, shards: int) -> int:
+    """shard owning a user, the 32-bit fibonacci hash of the id cut into equal ranges"""
+    return ((user_id * 0x9E3779B1) & 0xFFFFFFFF) * shards >> 32
+
+
+def _serve_db(requests: Any, responses: List[Any]) -> None:
+    """db process, the only one that opens vape_tracking.db"""
+    from .app import db_from_env, logging_from_env, maintenance_from_env
+
+    # ctrl-c reaches the whole process group, the launcher decides when we stop
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    load_dotenv()
+    logging_from_env()
+    db = db_from_env()
+    # handler latency is measured in the workers, here db call latency is what maintenance can hurt
+    maintenance = maintenance_from_env(db, family="db")
+    if maintenance is not None:
+        maintenance.start()
+    try:
+        DBServer(db, requests, responses).run()
+    finally:
+        if maintenance is not None:
+            maintenance.close()
+        db.close()
+        stop_logging()
+
+
+def _run_worker(shard: int, shards: int, updates: Any, requests: Any, responses: Any) -> None:
+    from .app import VapeBot
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    VapeBot(db=RemoteDuckDB(shard, requests, responses), shard=shard, shards=shards).run_shard(updates)
+
+
+class Cluster:
+    """launches and supervises a sharded deployment on this machine.
+
+    one db process owns vape_tracking.db and batches every write, `shards`
+    worker processes each run a VapeBot for the users whose id hashes into
+    their range, and this process takes updates from telegram (BOT_MODE
+    polling or webhook) and hands each one to its user's worker. a worker that
+    dies is restarted on the same queues, so its users' updates wait for it.
+    if the db process dies, or a worker keeps dying, everything is stopped.
+    """
+
+    def __init__(self, shards: int, queue_size: int = 1000):
+        if shards < 1:
+            raise ValueError("shards must be at least 1")
+        self.shards = shards
+        # spawned, the launcher already runs the logging thread
+        self.ctx = multiprocessing.get_context("spawn")
+        self.requests = self.ctx.Queue()
+        self.responses = [self.ctx.Queue() for _ in range(shards)]
+        self.updates = [self.ctx.Queue(maxsize=queue_size) for _ in range(shards)]
+        self.db_process: Optional[Any] = None
+        self.workers: List[Optional[Any]] = [None] * shards
+        self._restarts: List[List[float]] = [[] for _ in range(shards)]
+        self.bot: Optional[Bot] = None
+
+    # the two attributes WebhookServer uses, so it can feed the router directly
+
+    @property
+    def update_queue(self) -> "Cluster":
+        return self
+
+    def put_nowait(self, update: Update) -> None:
+        """route an update to its user's shard, raises QueueFull when that shard is backed up"""
+        key = PerUserUpdateProcessor._key(update)
+        shard = shard_for(key, self.shards) if key is not None else 0
+        try:
+            self.updates[shard].put_nowait(update.to_dict())
+        except queue.Full:
+            raise asyncio.QueueFull from None
+
+    def run(self) -> None:
+        from .app import logging_from_env
+
+        load_dotenv()
+        logging_from_env()
+        logger.info("Starting %d shards...", self.shards)
+        self.db_process = self.ctx.Process(
+            target=_serve_db, args=(self.requests, self.responses), name="vapebot-db"
+        )
+        self.db_process.start()
+        for shard in range(self.shards):
+            self._start_worker(shard)
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self._stop()
+            stop_logging()
+
+    def _start_worker(self, shard: int) -> None:
+        process = self.ctx.Process(
+            target=_run_worker,
+            args=(shard, self.shards, self.updates[shard], self.requests, self.responses[shard]),
+            name=f"vapebot-shard{shard}",
+        )
+        process.start()
+        self.workers[shard] = process
+
+    async def _serve(self) -> None:
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+
+        self.bot = Bot(os.getenv("TOKEN"))
+        async with self.bot:
+            tasks = [asyncio.create_task(self._supervise(stop))]
+            server = None
+            if os.getenv("BOT_MODE", "polling").lower() == "webhook":
+                server = await self._start_webhook()
+            else:
+                tasks.append(asyncio.create_task(self._poll()))
+            try:
+                await stop.wait()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                if server is not None:
+                    await server.stop()
+
+    async def _start_webhook(self) -> Any:
+        from .webhook import WebhookServer
+
+        secret = os.getenv("WEBHOOK_SECRET")
+        max_connections = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+        server = WebhookServer(
+            self,
+            listen=os.getenv("WEBHOOK_LISTEN", "0.0.0.0"),
+            port=int(os.getenv("WEBHOOK_PORT", "8443")),
+            url_path=os.getenv("WEBHOOK_PATH", "/webhook"),
+            secret_token=secret,
+            max_connections=max_connections,
+        )
+        url = os.getenv("WEBHOOK_URL")
+        if url:
+            await self.bot.set_webhook(url, secret_token=secret, max_connections=max_connections)
+        await server.start()
+        return server
+
+    async def _poll(self) -> None:
+        await self.bot.delete_webhook()
+        offset = None
+        while True:
+            try:
+                updates = await self.bot.get_updates(offset=offset, timeout=POLL_TIMEOUT)
+            except RetryAfter as e:
+                await asyncio.sleep(retry_after_seconds(e))
+                continue
+            except NetworkError:
+                logger.warning("getUpdates failed, retrying", exc_info=True)
+                await asyncio.sleep(1.0)
+                continue
+
+            for update in updates:
+                while True:
+                    try:
+                        self.put_nowait(update)
+                        break
+                    except asyncio.QueueFull:
+                        # hold the offset back rather than drop, telegram keeps the rest for us
+                        await asyncio.sleep(0.1)
+                offset = update.update_id + 1
+
+    async def _supervise(self, stop: asyncio.Event) -> None:
+        while True:
+            await asyncio.sleep(SUPERVISE_INTERVAL)
+            if not self.db_process.is_alive():
+                logger.error("DB process exited with %s, stopping", self.db_process.exitcode)
+                stop.set()
+                return
+
+            for shard, process in enumerate(self.workers):
+                if process.is_alive():
+                    continue
+                now = time.monotonic()
+                recent = [t for t in self._restarts[shard] if now - t < RESTART_WINDOW] + [now]
+                self._restarts[shard] = recent
+                if len(recent) > MAX_RESTARTS:
+                    logger.error("Shard %d keeps exiting, stopping", shard)
+                    stop.set()
+                    return
+                logger.warning("Shard %d exited with %s, restarting", shard, process.exitcode)
+                self._start_worker(shard)
+
+    def _stop(self) -> None:
+        """drain the workers, then let the db process flush and exit"""
+        for shard, updates in enumerate(self.updates):
+            try:
+                updates.put(None, timeout=STOP_TIMEOUT)
+            except queue.Full:
+                logger.warning("Shard %d is not draining its queue", shard)
+        for shard, process in enumerate(self.workers):
+            if process is None:
+                continue
+            process.join(STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning("Shard %d did not stop in time, terminating", shard)
+                process.terminate()
+
+        if self.db_process is not None:
+            self.requests.put((STOP, None, None, None, None))
+            self.db_process.join(STOP_TIMEOUT)
+            if self.db_process.is_alive():
+                logger.warning("DB process did not stop in time, terminating")
+                self.db_process.terminate()
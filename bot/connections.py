@@ -0,0 +1,211 @@
+import asyncio
+import logging
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Iterator, List, Optional, Sequence
+
+import duckdb
+
+from bot.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+
+class ReadPool:
+    """bounded read access to one duckdb database, one reusable cursor per thread.
+
+    a thread keeps its cursor between reads so the setup cost is paid once per
+    thread, not per query. at most `size` reads run at a time and the rest wait
+    for a slot, which keeps a burst of reads from taking every core away from
+    the writer thread. a read nested inside another on the same thread gets a
+    throwaway cursor and no slot, so it can never wait on itself. whatever a
+    block left unfetched is drained when it ends, an open result keeps its
+    read transaction alive and that blocks CHECKPOINT.
+
+    slots are for short reads. long jobs (exports, imports, snapshots) use
+    `detached()` so they never hold one, and a read made on an event loop
+    thread never waits for a slot: when none is free it runs on a throwaway
+    cursor instead of blocking the loop.
+    """
+
+    def __init__(self, conn: Any, size: int = 4, name: str = "reads"):
+        if size < 1:
+            raise ValueError("size must be at least 1")
+        self._conn = conn
+        self.size = size
+        self._slots = threading.BoundedSemaphore(size)
+        self._local = threading.local()
+        self._cursors: List[Any] = []
+        self._cursors_lock = threading.Lock()
+        self.active = 0
+        self.waits = 0
+        self.overflow = 0
+        METRICS.gauge("read_pool", f"{name}_active", lambda: self.active)
+        METRICS.gauge("read_pool", f"{name}_waits", lambda: self.waits)
+        METRICS.gauge("read_pool", f"{name}_overflow", lambda: self.overflow)
+
+    @contextmanager
+    def cursor(self) -> Iterator[Any]:
+        """a cursor for this thread, results must be fetched before the block ends"""
+        if getattr(self._local, "busy", False):
+            with self.detached() as cursor:
+                yield cursor
+            return
+
+        if not self._slots.acquire(blocking=False):
+            if _on_event_loop():
+                self.overflow += 1
+                with self.detached() as cursor:
+                    yield cursor
+                return
+            self.waits += 1
+            self._slots.acquire()
+        self._local.busy = True
+        self.active += 1
+        cursor = self._thread_cursor()
+        try:
+            yield cursor
+        finally:
+            _finish(cursor)
+            self.active -= 1
+            self._local.busy = False
+            self._slots.release()
+
+    @contextmanager
+    def detached(self) -> Iterator[Any]:
+        """a cursor of its own outside the pool, for reads that run for a long time"""
+        cursor = self._conn.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+    def _thread_cursor(self) -> Any:
+        cursor = getattr(self._local, "cursor", None)
+        if cursor is None:
+            cursor = self._local.cursor = self._conn.cursor()
+            with self._cursors_lock:
+                self._cursors.append(cursor)
+        return cursor
+
+    def close(self) -> None:
+        with self._cursors_lock:
+            cursors, self._cursors = self._cursors, []
+        for cursor in cursors:
+            cursor.close()
+
+
+def _finish(cursor: Any) -> None:
+    """end the cursor's read transaction, a fetchone() leaves the rest of its result open"""
+    try:
+        cursor.fetchall()
+    except duckdb.InvalidInputException:
+        # nothing was run, or the last statement had no result
+        pass
+
+
+def _on_event_loop() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+class ReportSnapshot:
+    """periodically refreshed read-only copy of the tables reports run on.
+
+    every `interval` seconds a background thread copies `tables` to parquet in
+    a fresh directory, inside one read transaction so the copies agree with
+    each other. a private in-memory duckdb is then pointed at the new files.
+    report queries only ever touch that copy, so a slow report holds neither
+    the live database's read pool nor the writer. the previous copy is kept
+    one more round for queries still reading it.
+    """
+
+    def __init__(
+        self,
+        reads: ReadPool,
+        directory: str,
+        tables: Sequence[str],
+        interval: float = 300.0,
+        size: int = 2,
+    ):
+        self.reads = reads
+        self.directory = directory
+        self.tables = tuple(tables)
+        self.interval = interval
+        self._db = duckdb.connect(":memory:")
+        self._pool = ReadPool(self._db, size, name="reports")
+        self._swap = threading.Lock()
+        self._refreshing = threading.Lock()
+        self._generation = 0
+        self.taken_at: Optional[datetime] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        os.makedirs(directory, exist_ok=True)
+        # copies from a previous run are stale and would collide with our numbering
+        for entry in os.listdir(directory):
+            if entry.isdigit():
+                shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="report-snapshot", daemon=True)
+            self._thread.start()
+
+    def refresh(self) -> datetime:
+        """take a new copy now, returns when it was taken"""
+        with self._refreshing:
+            return self._refresh()
+
+    def _refresh(self) -> datetime:
+        generation = self._generation + 1
+        target = os.path.join(self.directory, str(generation))
+        os.makedirs(target, exist_ok=True)
+
+        taken_at = datetime.now()
+        with self.reads.detached() as cursor:
+            cursor.begin()
+            try:
+                for table in self.tables:
+                    path = os.path.join(target, f"{table}.parquet").replace("'", "''")
+                    cursor.execute(f"COPY {table} TO '{path}' (FORMAT PARQUET)")
+            finally:
+                cursor.rollback()
+
+        with self._swap:
+            for table in self.tables:
+                path = os.path.join(target, f"{table}.parquet").replace("'", "''")
+                self._db.execute(f"CREATE OR REPLACE VIEW {table} AS SELECT * FROM read_parquet('{path}')")
+            self._generation = generation
+            self.taken_at = taken_at
+        shutil.rmtree(os.path.join(self.directory, str(generation - 2)), ignore_errors=True)
+        return taken_at
+
+    def query(self, sql: str, params: Optional[list] = None) -> List[tuple]:
+        """run a report against the latest copy, taking one first if there is none yet"""
+        if self.taken_at is None:
+            self.refresh()
+        with self._pool.cursor() as cursor:
+            return cursor.execute(sql, params or []).fetchall()
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self._pool.close()
+        self._db.close()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception("Report snapshot failed")
+            if self._stop.wait(self.interval):
+                return
@@ -1,3 +1,9 @@
+import asyncio
+import logging
+import os
+import re
+import tempfile
+from typing import Any, Awaitable, Callable, Iterable, List, Optional, Set
 from telegram import (
     InlineKeyboardButton,
     InlineKeyboardMarkup,
@@ -14,22 +20,118 @@ from telegram.ext import (
 )
 from .extractors import TelegramExtractor
 from .states import BotStates
-from .models import SetupManager
+from .models import SetupData, SetupManager
 from .data_transfer import DuckDBManager
+from .importer import MAX_PUFFS_PER_UPLOAD
+from .charts import DEFAULT_CHART_DAYS, MAX_CHART_DAYS, ProgressCharts
+from .metrics import METRICS
+from .outbox import Outbox
+from .reminders import ReminderScheduler
+
+logger = logging.getLogger(__name__)
+
+# keeps one command from flooding the write queue
+MAX_PUFFS_PER_COMMAND = 1000
+
+# telegram will not hand bots files bigger than this
+MAX_IMPORT_BYTES = 20 * 1024 * 1024
+
+EXPORT_SUFFIXES = {"parquet": ".parquet", "csv": ".csv.gz"}
+
+# ctx.user_data key for the /setup answers given so far, persisted with the conversation state
+SETUP_DRAFT = "setup_draft"
+
+# a /setup step that fails ends the conversation, the user is told rather than left waiting
+SETUP_FAILED = "Something went wrong with your setup, send /setup to try again."
+
+# /remind 08:30 or /remind 08:30 +2 (hours, or hours:minutes, ahead of utc)
+REMIND_TIME = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)$")
+REMIND_OFFSET = re.compile(r"^(?:utc)?([+-])(\d{1,2})(?::([0-5]\d))?$", re.IGNORECASE)
+
+
+def parse_reminder(args: List[str]) -> int:
+    """minute of the utc day for `HH:MM [+-HH[:MM]]`, raises ValueError otherwise"""
+    if not 1 <= len(args) <= 2:
+        raise ValueError(args)
+    clock = REMIND_TIME.match(args[0])
+    if clock is None:
+        raise ValueError(args[0])
+    offset = 0
+    if len(args) == 2:
+        match = REMIND_OFFSET.match(args[1])
+        if match is None or int(match.group(2)) > 14:
+            raise ValueError(args[1])
+        offset = int(match.group(2)) * 60 + int(match.group(3) or 0)
+        offset = -offset if match.group(1) == "-" else offset
+    return (int(clock.group(1)) * 60 + int(clock.group(2)) - offset) % (24 * 60)
 
 
 class ConversationFlow:
-    def __init__(self, db: DuckDBManager) -> None:
+    def __init__(
+        self,
+        db: DuckDBManager,
+        setup_cache_size: int = 10_000,
+        setup_cache_ttl: Optional[float] = 3600.0,
+        max_concurrent_exports: int = 2,
+        admin_ids: Iterable[int] = (),
+        reminders: Optional[ReminderScheduler] = None,
+        charts: Optional[ProgressCharts] = None,
+        outbox: Optional[Outbox] = None,
+    ) -> None:
         """Initialise the conversation flow with session management"""
         self.extractor = TelegramExtractor()
-        self.setup = SetupManager()
+        self.setup = SetupManager(
+            load=db.load_setup,
+            max_entries=setup_cache_size,
+            ttl=setup_cache_ttl,
+        )
         self.db = db
+        # exports run in threads, the cap keeps them from crowding out live traffic
+        self.export_slots = asyncio.Semaphore(max_concurrent_exports)
+        self.admin_ids = frozenset(admin_ids)
+        self.reminders = reminders
+        # memory-only unless the app hands in one with a disk cache
+        self.charts = charts or ProgressCharts(db, cache_dir=None)
+        self.outbox = outbox
+        # direct replies still in flight when there is no outbox, kept so none is dropped unobserved
+        self._replies: Set["asyncio.Future"] = set()
+
+        for stat in ("size", "hits", "misses", "evictions"):
+            METRICS.gauge("setup_cache", stat, lambda stat=stat: self.setup.cache_stats[stat])
+
+    def reply(self, up: Update, text: str, **options) -> "asyncio.Future":
+        """queue a text reply in the update's chat, await the result or leave it to go out"""
+        if self.outbox is None:
+            return self._direct(up.effective_message.reply_text(text, **options))
+        return self.outbox.send(up.effective_chat.id, text, **options)
+
+    def reply_with(self, up: Update, call: Callable[[], Awaitable[Any]]) -> "asyncio.Future":
+        """queue a photo or document reply behind the chat's pending text, `call` may run more than once"""
+        if self.outbox is None:
+            return self._direct(call())
+        return self.outbox.submit(up.effective_chat.id, call)
 
+    def _direct(self, send: Awaitable[Any]) -> "asyncio.Future":
+        task = asyncio.ensure_future(send)
+        self._replies.add(task)
+        task.add_done_callback(self._reply_done)
+        return task
+
+    def _reply_done(self, task: "asyncio.Future") -> None:
+        """log a direct reply that failed, nobody else may be awaiting it"""
+        self._replies.discard(task)
+        if task.cancelled() or task.exception() is None:
+            return
+        logger.error("Reply failed", exc_info=task.exception())
+        METRICS.count_error("handler", "reply")
+
+    @METRICS.timed("handler")
     async def start_command(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
         """simply saying hello and intro"""
         try:
             session = self.extractor.session(up)
-            await up.message.reply_text(
+            self.reply(
+                up,
                 f"Hello {session.uname}\\!\n\n"  # Escape special characters
                 "This is an open\\-source messaging service designed to help manage addictive habits, "
                 "such as vaping, through tracking, analytics, and accountability\\.\n\n"
@@ -40,31 +142,237 @@ class ConversationFlow:
                 reply_markup=ReplyKeyboardRemove(),
                 parse_mode='MarkdownV2'  # Add parse mode
             )
-        except Exception as e:
-            print(f"Error in start command: {e}")
-            await up.message.reply_text("An error occurred during the start command.")
+        except Exception:
+            logger.exception("Error in start command", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "start_command")
+            self.reply(up, "An error occurred during the start command.")
     
+    @METRICS.timed("handler")
     async def help_command(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
         """simple command to list available commands"""
         try:
             session = self.extractor.session(up)
-            await up.message.reply_text(
+            self.reply(
+                up,
                 f"Hello {session.uname}! Here are the commands you can use:\n"
                 "/setup - Start or modify the setup for tracking and goals\n"
+                "/puff - Log a puff, or /puff N to log several at once\n"
+                "/export - Download your puff history, /export csv for a spreadsheet\n"
+                "/summary - Your setup with today's and this week's puffs against your target\n"
+                "/progress - Chart of your daily puffs against your target, /progress N for the last N days\n"
+                "/remind HH:MM [+HH] - Daily progress reminder, with your offset from UTC. /remind off to stop\n"
+                "Send a .csv or .json file to import your history from another tracker\n"
                 "/cancel - This is available in conversations.Such as when you are in the setup\n",
                 reply_markup=ReplyKeyboardRemove()
             )
-        except Exception as e:
-            print(f"Error in help command: {e}")
-            await up.message.reply_text("An error occurred during the help command.")
+        except Exception:
+            logger.exception("Error in help command", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "help_command")
+            self.reply(up, "An error occurred during the help command.")
+
+    @METRICS.timed("handler")
+    async def puff_command(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
+        """log one puff, or N with /puff N"""
+        try:
+            session = self.extractor.session(up)
+            count = self.setup.parser.to_int(ctx.args[0]) if ctx.args else 1
+            if not 1 <= count <= MAX_PUFFS_PER_COMMAND:
+                self.reply(up, f"Send a number of puffs between 1 and {MAX_PUFFS_PER_COMMAND}.")
+                return
+
+            # strength comes from the user's setup when they have one
+            setup = await self.setup.get_setup(session.uid)
+            await self.db.enqueue_puffs(session.uid, count, setup.strength if setup else None)
+
+            self.reply(up, f"Logged {count} puff{'s' if count > 1 else ''}.")
+        except ValueError:
+            self.reply(up, "Usage: /puff or /puff N, e.g. /puff 5")
+        except Exception:
+            logger.exception("Error in puff command", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "puff_command")
+            self.reply(up, "An error occurred while logging your puff.")
+
+    @METRICS.timed("handler")
+    async def import_document(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
+        """import an uploaded csv/json history file for the sender"""
+        try:
+            session = self.extractor.session(up)
+            document = up.message.document
+            if document.file_size and document.file_size > MAX_IMPORT_BYTES:
+                self.reply(up, "That file is too big, the limit is 20MB.")
+                return
+
+            self.reply(up, "Importing your history, this can take a moment...")
+            with tempfile.TemporaryDirectory() as tmp:
+                path = os.path.join(tmp, os.path.basename(document.file_name or "upload.csv"))
+                file = await document.get_file()
+                await file.download_to_drive(path)
+                # parsing runs off the event loop, rows are pinned to the sender
+                result = await asyncio.to_thread(
+                    self.db.import_file, path, user_id=session.uid, max_puffs=MAX_PUFFS_PER_UPLOAD
+                )
+
+            self.reply(up, result.summary())
+        except ValueError as e:
+            self.reply(up, f"Could not import that file: {e}")
+        except Exception:
+            logger.exception("Error in import_document", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "import_document")
+            self.reply(up, "An error occurred while importing your file.")
+
+    @METRICS.timed("handler")
+    async def export_command(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
+        """send the user their puff history as parquet (default) or gzipped csv"""
+        try:
+            session = self.extractor.session(up)
+            fmt = ctx.args[0].lower() if ctx.args else "parquet"
+            if fmt not in EXPORT_SUFFIXES:
+                self.reply(up, "Usage: /export or /export csv")
+                return
+
+            if self.export_slots.locked():
+                self.reply(up, "Exports are busy, yours will start shortly...")
+            async with self.export_slots:
+                with tempfile.TemporaryDirectory() as tmp:
+                    filename = f"vape_history_{session.uid}{EXPORT_SUFFIXES[fmt]}"
+                    path = os.path.join(tmp, filename)
+                    rows = await asyncio.to_thread(self.db.export_user, session.uid, path, fmt)
+                    if not rows:
+                        self.reply(up, "Nothing to export yet, log some puffs with /puff.")
+                        return
+
+                    async def send_file():
+                        # reopened on every attempt, a retry must not start at the end of the file
+                        with open(path, "rb") as f:
+                            return await up.message.reply_document(
+                                document=f,
+                                filename=filename,
+                                caption=f"{rows:,} puffs exported.",
+                            )
+                    # awaited so the file is still there when the outbox gets to it
+                    await self.reply_with(up, send_file)
+        except Exception:
+            logger.exception("Error in export command", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "export_command")
+            self.reply(up, "An error occurred while exporting your data.")
 
+    @METRICS.timed("handler")
+    async def progress_command(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
+        """chart of daily puffs against the target, /progress N for the last N days"""
+        try:
+            session = self.extractor.session(up)
+            days = self.setup.parser.to_int(ctx.args[0]) if ctx.args else DEFAULT_CHART_DAYS
+            if not 2 <= days <= MAX_CHART_DAYS:
+                self.reply(up, f"Send a number of days between 2 and {MAX_CHART_DAYS}.")
+                return
+
+            png = await self.charts.chart(session.uid, days)
+            await self.reply_with(up, lambda: up.message.reply_photo(photo=png, caption=f"Your last {days} days"))
+        except ValueError:
+            self.reply(up, "Usage: /progress or /progress N, e.g. /progress 14")
+        except ImportError:
+            logger.warning("matplotlib is not installed, /progress is unavailable")
+            self.reply(up, "Charts are not available right now.")
+        except Exception:
+            logger.exception("Error in progress command", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "progress_command")
+            self.reply(up, "An error occurred while drawing your chart.")
+
+    @METRICS.timed("handler")
+    async def summary_command(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
+        """the user's setup with today's and this week's puffs against their target"""
+        try:
+            session = self.extractor.session(up)
+            # both served from the result cache until the user's next puff or setup change
+            today, week = await asyncio.gather(
+                asyncio.to_thread(self.db.today_vs_target, session.uid),
+                asyncio.to_thread(self.db.week_vs_target, session.uid),
+            )
+            if today is None:
+                self.reply(up, "No setup yet, send /setup to set your target.")
+                return
+
+            setup = await self.setup.get_setup(session.uid)
+            lines = [self.setup.summary(setup), ""] if setup is not None else []
+            for label, progress in (("Today", today), ("This week", week)):
+                if progress.target is None:
+                    lines.append(f"{label}: {progress.puffs} puffs")
+                else:
+                    lines.append(f"{label}: {progress.puffs} of {progress.target} puffs "
+                                 f"({progress.percent_of_target or 0:g}%)")
+            lines.append(f"Nicotine today: {today.nicotine_mg:.1f}mg")
+            self.reply(up, "\n".join(lines))
+        except Exception:
+            logger.exception("Error in summary command", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "summary_command")
+            self.reply(up, "An error occurred while reading your summary.")
+
+    @METRICS.timed("handler")
+    async def remind_command(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
+        """set, move or turn off the daily progress reminder"""
+        try:
+            session = self.extractor.session(up)
+            if ctx.args and ctx.args[0].lower() == "off":
+                await self.db.set_reminder(session.uid, None)
+                if self.reminders is not None:
+                    self.reminders.reschedule(session.uid, None)
+                self.reply(up, "Daily reminder turned off.")
+                return
+
+            minute_utc = parse_reminder(ctx.args or [])
+            last_sent = await self.db.set_reminder(session.uid, minute_utc)
+            if self.reminders is not None:
+                self.reminders.reschedule(session.uid, minute_utc, last_sent)
+            self.reply(
+                up,
+                f"Daily reminder set for {ctx.args[0]} ({minute_utc // 60:02d}:{minute_utc % 60:02d} UTC)."
+            )
+        except ValueError:
+            self.reply(up, "Usage: /remind HH:MM [+HH], e.g. /remind 08:30 +2, or /remind off")
+        except Exception:
+            logger.exception("Error in remind command", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "remind_command")
+            self.reply(up, "An error occurred while setting your reminder.")
+
+    @METRICS.timed("handler")
+    async def stats_command(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
+        """admin only, latency and queue/cache numbers plus user-base totals from the report snapshot"""
+        try:
+            session = self.extractor.session(up)
+            if session.uid not in self.admin_ids:
+                return
+
+            snapshot = METRICS.snapshot()
+            ms = lambda v: "-" if v is None else f"{v * 1000:g}ms"
+            lines = ["name: count / errors / p50 / p99"]
+            for name, h in snapshot["latency"].items():
+                lines.append(f"{name}: {h['count']} / {h['errors']} / {ms(h['p50'])} / {ms(h['p99'])}")
+            lines.append("")
+            lines.extend(f"{name}: {value:g}" for name, value in snapshot["gauges"].items())
+
+            usage = await asyncio.to_thread(self.db.usage_report)
+            lines.append("")
+            lines.append(f"usage as of {usage['as_of']:%H:%M:%S}")
+            lines.append(f"users with a setup: {usage['users_with_setup']}")
+            lines.append(f"active today: {usage['active_today']} ({usage['puffs_today']} puffs, "
+                         f"{usage['avg_puffs_today']:.1f} avg, {usage['within_target_today']} within target)")
+            lines.append(f"active 7d: {usage['active_7d']} ({usage['puffs_7d']} puffs)")
+            self.reply(up, "\n".join(lines))
+        except Exception:
+            logger.exception("Error in stats command", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "stats_command")
+            self.reply(up, "An error occurred while reading stats.")
+
+    @METRICS.timed("handler")
     async def ask_tokes(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
         """the below is the entry point for the setup conversation"""
         try:
             session = self.extractor.session(up)
-            self.setup.get_setup(session.uid)
+            # answers are staged here and only written once the user finishes
+            ctx.user_data[SETUP_DRAFT] = await self.setup.draft(session.uid)
 
-            await up.message.reply_text(
+            self.reply(
+                up,
                 f"Hi {session.uname}\\! Let's start setup\\.\n"
                 "How many tokes do you have a day\\?\n\n"
                 "Send /cancel to stop setup\\.",
@@ -72,10 +380,13 @@ class ConversationFlow:
                 parse_mode='MarkdownV2'
             )
             return BotStates.TOKES
-        except Exception as e:
-            print(f"Error in ask_tokes: {e}")
+        except Exception:
+            logger.exception("Error in ask_tokes", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "ask_tokes")
+            self.reply(up, SETUP_FAILED)
             return ConversationHandler.END
 
+    @METRICS.timed("handler")
     async def ask_strength(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
         try:
             session = self.extractor.session(up)
@@ -87,19 +398,26 @@ class ConversationFlow:
                     f"Timestamp: {session.datetime}\n"
                     f"Err: Missing message text"
                 )
-            # store tokes into setup, repeat in following functions for other fields
-            self.setup.update_setup_field(session.uid, "tokes", user_input)
+            draft = self._draft(up, ctx)
+            if draft is None:
+                return await self.ask_tokes(up, ctx)
+            # store tokes into the draft, repeat in following functions for other fields
+            self.setup.update_setup_field(draft, "tokes", user_input)
 
-            await up.message.reply_text(
+            self.reply(
+                up,
                 "Sickna mate.\n"
                 "What strength nicotine are you chomping through? e.g. 3mg, 6mg, 12mg",
                 reply_markup=ReplyKeyboardRemove()
             )
             return BotStates.STRENGTH
-        except Exception as e:
-            print(f"Error in ask_strength: {e}")
+        except Exception:
+            logger.exception("Error in ask_strength", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "ask_strength")
+            self.reply(up, SETUP_FAILED)
             return ConversationHandler.END
 
+    @METRICS.timed("handler")
     async def ask_method(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
         try:
             session = self.extractor.session(up)
@@ -112,22 +430,29 @@ class ConversationFlow:
                     f"Err: Missing message text"
                 )
             
-            self.setup.update_setup_field(session.uid, "strength", user_input)
+            draft = self._draft(up, ctx, "tokes")
+            if draft is None:
+                return await self.ask_tokes(up, ctx)
+            self.setup.update_setup_field(draft, "strength", user_input)
 
             keyboard = [
                 [InlineKeyboardButton("By A Set Number", callback_data="number")],
                 [InlineKeyboardButton("Percent", callback_data="percent")]
             ]
 
-            await up.message.reply_text(
+            self.reply(
+                up,
                 "How do you want to reduce vaping?\nChoose a method:",
                 reply_markup=InlineKeyboardMarkup(keyboard)
             )
             return BotStates.METHOD
-        except Exception as e:
-            print(f"Error in ask_method: {e}")
+        except Exception:
+            logger.exception("Error in ask_method", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "ask_method")
+            self.reply(up, SETUP_FAILED)
             return ConversationHandler.END
 
+    @METRICS.timed("handler")
     async def ask_goal(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
         try:
             session = self.extractor.session(up)
@@ -142,20 +467,27 @@ class ConversationFlow:
             
             await up.callback_query.answer()  # still need this to acknowledge the button press
             
-            self.setup.update_setup_field(session.uid, "method", query_data)
+            draft = self._draft(up, ctx, "tokes", "strength")
+            if draft is None:
+                return await self.ask_tokes(up, ctx)
+            self.setup.update_setup_field(draft, "method", query_data)
             
             prompt = "How many tokes do you want to cut down per day?" if query_data == "number" else \
                     "What percentage of your daily tokes do you want to cut down?"
 
-            await up.callback_query.message.reply_text(
+            self.reply(
+                up,
                 prompt, 
                 reply_markup=ReplyKeyboardRemove()
             )
             return BotStates.GOAL
-        except Exception as e:
-            print(f"Error in ask_goal: {e}")
+        except Exception:
+            logger.exception("Error in ask_goal", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "ask_goal")
+            self.reply(up, SETUP_FAILED)
             return ConversationHandler.END
 
+    @METRICS.timed("handler")
     async def setup_finish(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
         try:
             session = self.extractor.session(up)
@@ -168,32 +500,56 @@ class ConversationFlow:
                     f"Err: Missing message text"
                 )
             
-            self.setup.update_setup_field(session.uid, "goal", user_input)
-            
-            summary = self.setup.summary(session.uid)
-            if not summary:
-                raise ValueError("Setup data not found, cannot finish setup.")
+            draft = self._draft(up, ctx, "tokes", "strength", "method")
+            if draft is None:
+                return await self.ask_tokes(up, ctx)
+            self.setup.update_setup_field(draft, "goal", user_input)
+            summary = self.setup.summary(draft)
 
-            #self.db.insert_setup(session.uid, self.setup)
+            # queued for the writer thread so the reply is not held up by the db
+            await self.db.enqueue_setup(draft)
+            self.setup.saved(draft)
+            ctx.user_data.pop(SETUP_DRAFT, None)
 
-            await up.message.reply_text(
+            self.reply(
+                up,
                 summary + "\nSetup complete! Send /setup to change anything.",
                 reply_markup=ReplyKeyboardRemove()
             )
             return ConversationHandler.END
-        except Exception as e:
-            print(f"Error in setup_finish: {e}")
+        except Exception:
+            logger.exception("Error in setup_finish", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "setup_finish")
+            self.reply(up, SETUP_FAILED)
             return ConversationHandler.END
     
+    def _draft(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE, *answered: str) -> Optional[SetupData]:
+        """the /setup answers so far, None when the draft or an earlier answer is missing.
+
+        the conversation state and user_data are persisted separately, so a step
+        resumed after a restart (or from a state saved before drafts lived in
+        user_data) checks for itself and sends the user back to the start.
+        """
+        draft = ctx.user_data.get(SETUP_DRAFT)
+        if draft is not None and all(getattr(draft, name) is not None for name in answered):
+            return draft
+        self.reply(up, "Some of your setup answers were lost, let's start again.")
+        return None
+
+    @METRICS.timed("handler")
     async def cancel(self, up: Update, ctx: ContextTypes.DEFAULT_TYPE):
         try:
-            await up.message.reply_text(
+            # the half-finished answers were never written, dropping the draft is enough
+            ctx.user_data.pop(SETUP_DRAFT, None)
+            self.reply(
+                up,
                 "Setup cancelled. You can start again with /setup.",
                 reply_markup=ReplyKeyboardRemove()
             )
             return ConversationHandler.END
-        except Exception as e:
-            print(f"Error in cancel: {e}")
+        except Exception:
+            logger.exception("Error in cancel", extra=self.extractor.session(up).log_context)
+            METRICS.count_error("handler", "cancel")
             return ConversationHandler.END
 
     
@@ -205,7 +561,39 @@ class ConversationFlow:
         """Constructs and returns the help command handler."""
         return CommandHandler("help", self.help_command)
     
-    def setup_build(self) -> ConversationHandler:
+    def puff(self) -> CommandHandler:
+        """Constructs and returns the puff command handler."""
+        return CommandHandler("puff", self.puff_command)
+    
+    def export(self) -> CommandHandler:
+        """Constructs and returns the export command handler."""
+        return CommandHandler("export", self.export_command)
+    
+    def progress(self) -> CommandHandler:
+        """Constructs and returns the progress chart command handler."""
+        return CommandHandler("progress", self.progress_command)
+    
+    def remind(self) -> CommandHandler:
+        """Constructs and returns the reminder command handler."""
+        return CommandHandler("remind", self.remind_command)
+    
+    def summary(self) -> CommandHandler:
+        """Constructs and returns the summary command handler."""
+        return CommandHandler("summary", self.summary_command)
+
+    def stats(self) -> CommandHandler:
+        """Constructs and returns the admin stats command handler."""
+        return CommandHandler("stats", self.stats_command)
+    
+    def import_upload(self) -> MessageHandler:
+        """Constructs and returns the history upload handler."""
+        return MessageHandler(
+            filters.Document.FileExtension("csv") | filters.Document.FileExtension("json")
+            | filters.Document.FileExtension("jsonl"),
+            self.import_document,
+        )
+    
+    def setup_build(self, persistent: bool = False) -> ConversationHandler:
         """Constructs and returns the setup conversation handler."""
         return ConversationHandler(
             entry_points=[CommandHandler("setup", self.ask_tokes)],
@@ -216,4 +604,7 @@ class ConversationFlow:
                 BotStates.GOAL: [MessageHandler(filters.TEXT & ~filters.COMMAND, self.setup_finish)],
             },
             fallbacks=[CommandHandler("cancel", self.cancel)],
+            # survives restarts when the application has a persistence backend
+            name="setup",
+            persistent=persistent,
         )
\ No newline at end of file
@@ -1,37 +1,866 @@
 import duckdb
-import pandas as pd
-from bot.models import SetupManager
+import glob
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from bot.cache import ResultCache
+from bot.models import DailyProgress, PuffEvent, SetupData
+from bot.connections import ReadPool, ReportSnapshot
+from bot.metrics import METRICS
+from bot.writer import WriteBehindQueue
+
+# rows per UNNEST statement, keeps the bound lists to a sane size
+UPSERT_CHUNK_ROWS = 50_000
+
+# longest taper the plan engine will schedule for one user
+MAX_PLAN_DAYS = 365
+
+# a read or write in flight blocks CHECKPOINT for a moment, tries and the wait between them
+CHECKPOINT_ATTEMPTS = 5
+CHECKPOINT_RETRY_WAIT = 0.2
+
+# rough liquid volume of one puff, strength is mg/ml so mg per puff = strength * this
+ML_PER_PUFF = 0.01
+
+# ordered (version, statements), append new versions, never edit applied ones.
+# v1 is written with IF NOT EXISTS so databases from before versioning adopt it
+MIGRATIONS: List[Tuple[int, List[str]]] = [
+    (1, [
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            applied_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS user_setups (
+            user_id INTEGER PRIMARY KEY,
+            tokes INTEGER,
+            strength INTEGER,
+            method VARCHAR,
+            reduce_amount INTEGER,
+            reduce_percent FLOAT,
+            created_at TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+        """,
+        # append-only, no key so appends never pay for index maintenance
+        """
+        CREATE TABLE IF NOT EXISTS puff_events (
+            user_id INTEGER,
+            ts TIMESTAMP,
+            strength INTEGER
+        )
+        """,
+        # filled in bulk by build_plans
+        """
+        CREATE TABLE IF NOT EXISTS reduction_plans (
+            user_id INTEGER,
+            day DATE,
+            target INTEGER
+        )
+        """,
+        # rollups are bumped in the same transaction as the events they count
+        """
+        CREATE TABLE IF NOT EXISTS puff_daily (
+            user_id INTEGER,
+            day DATE,
+            puffs INTEGER,
+            nicotine_mg DOUBLE,
+            PRIMARY KEY (user_id, day)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS puff_weekly (
+            user_id INTEGER,
+            week DATE,
+            puffs INTEGER,
+            nicotine_mg DOUBLE,
+            PRIMARY KEY (user_id, week)
+        )
+        """,
+    ]),
+    # python-telegram-bot persistence, values are pickled blobs
+    (2, [
+        """
+        CREATE TABLE ptb_conversations (
+            name VARCHAR,
+            key VARCHAR,
+            state BLOB,
+            PRIMARY KEY (name, key)
+        )
+        """,
+        "CREATE TABLE ptb_user_data (user_id BIGINT PRIMARY KEY, data BLOB)",
+        "CREATE TABLE ptb_chat_data (chat_id BIGINT PRIMARY KEY, data BLOB)",
+        "CREATE TABLE ptb_bot_data (id INTEGER PRIMARY KEY, data BLOB)",
+    ]),
+    # daily reminders, minute of the day in utc and the utc date last sent
+    (3, [
+        """
+        CREATE TABLE reminders (
+            user_id BIGINT PRIMARY KEY,
+            minute_utc SMALLINT,
+            last_sent DATE
+        )
+        """,
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# copied into the report snapshot, enough for usage_report
+REPORT_TABLES = ("user_setups", "puff_daily")
 
 class DuckDBManager:
-    def __init__(self, db_path: str = "vape_tracking.db"):
+    def __init__(
+        self,
+        db_path: str = "vape_tracking.db",
+        flush_interval: float = 0.25,
+        batch_size: int = 500,
+        max_queue: int = 10_000,
+        archive_dir: Optional[str] = "puff_archive",
+        archive_after_days: int = 7,
+        archive_interval: float = 3600.0,
+        read_pool_size: int = 4,
+        report_dir: Optional[str] = None,
+        report_interval: float = 300.0,
+        result_cache_size: int = 10_000,
+        tracked_versions: int = 100_000,
+    ):
         self.conn = duckdb.connect(database=db_path)
-        self._initialise_tables()
-
-    def _initialise_tables(self) -> None:
-        self.conn.execute("""
-            CREATE TABLE IF NOT EXISTS user_setups (
-                user_id INTEGER PRIMARY KEY,
-                tokes INTEGER,
-                strength INTEGER,
-                method VARCHAR,
-                reduce_amount INTEGER,
-                reduce_percent FLOAT,
-                created_at TIMESTAMP,
-                updated_at TIMESTAMP
-            )
-        """)
-        self.conn.commit()
-    
-    def insert_setup(self, user_id: int, setup: SetupManager) -> None:
-        """insert setup data into user_setups table"""
+        self.archive_dir = archive_dir
+        self.archive_after_days = archive_after_days
+        self._migrate()
+        # the view is stored in the db file, this open's archive dir may not be the last one's
+        self._refresh_puff_history(self.conn)
+        # handler reads share a bounded set of per-thread cursors
+        self.reads = ReadPool(self.conn, read_pool_size)
+        # reports run on a periodically refreshed parquet copy, never on the live tables
+        self.reports = ReportSnapshot(self.reads, report_dir, REPORT_TABLES, report_interval) if report_dir else None
+        # per-user change counters, bumped once a write for that user has committed. values come
+        # from one sequence and only the `tracked_versions` latest writers are kept, the rest
+        # read the highest value dropped so far, which is never below their own last one
+        self._versions: "OrderedDict[int, int]" = OrderedDict()
+        self._versions_seq = 0
+        self._versions_floor = 0
+        self._versions_lock = threading.Lock()
+        self.tracked_versions = tracked_versions
+        # per-user analytics results, dropped by touch() rather than on a timer
+        self.results = ResultCache(result_cache_size)
+        for stat in ("size", "hits", "misses", "coalesced", "evictions", "invalidations"):
+            METRICS.gauge("result_cache", stat, lambda stat=stat: self.results.stats[stat])
+        METRICS.gauge("queue_depth", "db_writes", lambda: self.pending_writes)
+
+        # writes from handlers go through the writer thread on its own cursor
+        self.writer = WriteBehindQueue(
+            connect=self.conn.cursor,
+            flush_interval=flush_interval,
+            batch_size=batch_size,
+            max_queue=max_queue,
+        )
+        self.writer.register("setup", self._upsert_setups, on_commit=lambda setups: self.touch(
+            {s.user_id for s in setups}
+        ))
+        self.writer.register("puffs", self._append_puff_batches, on_commit=lambda batches: self.touch(
+            {e.user_id for batch in batches for e in batch}
+        ))
+        self.writer.register("reminder_sent", self._mark_reminders_sent)
+        if archive_dir:
+            self.writer.every(archive_interval, self._archive_puffs)
+        self.writer.start()
+        if self.reports is not None:
+            self.reports.start()
+
+    def _migrate(self) -> int:
+        """bring the schema up to SCHEMA_VERSION, a single lookup when it is already current"""
+        try:
+            current = self.conn.execute("SELECT max(version) FROM schema_version").fetchone()[0] or 0
+        except duckdb.CatalogException:
+            current = 0
+        if current >= SCHEMA_VERSION:
+            return current
+
+        try:
+            self.conn.begin()
+            for version, statements in MIGRATIONS:
+                if version <= current:
+                    continue
+                for statement in statements:
+                    self.conn.execute(statement)
+                self.conn.execute("INSERT INTO schema_version VALUES (?, now())", [version])
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return SCHEMA_VERSION
+
+    def data_version(self, user_id: int) -> int:
+        """changes whenever a setup or puff write for the user commits, for cache keys"""
+        with self._versions_lock:
+            return self._versions.get(user_id, self._versions_floor)
+
+    def touch(self, user_ids: Iterable[int]) -> None:
+        """mark users' data as changed, called after writes outside the writer queue commit"""
+        user_ids = set(user_ids)
+        with self._versions_lock:
+            for user_id in user_ids:
+                self._versions_seq += 1
+                self._versions[user_id] = self._versions_seq
+                self._versions.move_to_end(user_id)
+            while len(self._versions) > self.tracked_versions:
+                # oldest write first, so the floor only ever goes up
+                _, self._versions_floor = self._versions.popitem(last=False)
+        self.results.invalidate(user_ids)
+
+    @METRICS.timed("db")
+    def upsert_setups(self, setups: Iterable[SetupData]) -> int:
+        """bulk insert or replace setups, returns the number of rows written"""
+        try:
+            self.conn.begin()
+            setups = list(setups)
+            written = self._upsert_setups(self.conn, setups)
+            self.conn.commit()
+            self.touch({s.user_id for s in setups})
+            return written
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    @METRICS.timed("db")
+    async def enqueue_setup(self, setup: SetupData) -> None:
+        """queue a snapshot of a finished setup for the writer thread"""
+        await self.writer.submit_async("setup", replace(setup))
+
+    @METRICS.timed("db")
+    def load_setup(self, user_id: int) -> Optional[SetupData]:
+        """read one stored setup, used by the setup cache on a miss"""
+        with self.reads.cursor() as cursor:
+            row = cursor.execute("""
+                SELECT user_id, tokes, strength, method, reduce_amount, reduce_percent, created_at, updated_at
+                FROM user_setups WHERE user_id = ?
+            """, [user_id]).fetchone()
+        return SetupData(*row) if row else None
+
+    @METRICS.timed("db")
+    def append_puffs(self, events: Iterable[PuffEvent]) -> int:
+        """bulk append puff events, returns the number of rows written"""
         try:
-            df = pd.DataFrame([setup.to_dict(user_id)])
-            self.conn.execute("""
-                INSERT OR REPLACE INTO user_setups 
-                SELECT * FROM df
-            """)
+            self.conn.begin()
+            events = list(events)
+            written = self._append_puffs(self.conn, events)
             self.conn.commit()
-            
-        except Exception as e:
+            self.touch({e.user_id for e in events})
+            return written
+        except Exception:
             self.conn.rollback()
-            raise ValueError(f"Failed to insert setup data: {str(e)}")
\ No newline at end of file
+            raise
+
+    @METRICS.timed("db")
+    async def enqueue_puffs(self, user_id: int, count: int = 1, strength: Optional[int] = None) -> None:
+        """queue `count` puffs for the writer thread as a single item"""
+        # events are frozen, so one instance can stand in for every puff of the command
+        events = [PuffEvent(user_id=user_id, ts=datetime.now(), strength=strength)] * count
+        await self.writer.submit_async("puffs", events)
+
+    @METRICS.timed("db")
+    def today_vs_target(self, user_id: int, day: Optional[date] = None) -> Optional[DailyProgress]:
+        """one user's puffs for a day against their setup target, None without a setup"""
+        day = day or date.today()
+        return self.results.get(user_id, "today", (day,), lambda: self._today_vs_target(user_id, day))
+
+    def _today_vs_target(self, user_id: int, day: date) -> Optional[DailyProgress]:
+        with self.reads.cursor() as cursor:
+            row = cursor.execute(f"""
+                SELECT {plan_target_on("CAST($day AS DATE)")}, coalesce(d.puffs, 0), coalesce(d.nicotine_mg, 0)
+                FROM user_setups s
+                LEFT JOIN puff_daily d ON d.user_id = s.user_id AND d.day = $day
+                WHERE s.user_id = $user_id
+            """, {"day": day, "user_id": user_id}).fetchone()
+        if row is None:
+            return None
+        target, puffs, nicotine_mg = row
+        return DailyProgress(
+            user_id=user_id,
+            period=day,
+            puffs=puffs,
+            nicotine_mg=nicotine_mg,
+            target=target,
+        )
+
+    @METRICS.timed("db")
+    def week_vs_target(self, user_id: int, day: Optional[date] = None) -> Optional[DailyProgress]:
+        """one user's puffs for the week containing `day` against the sum of its planned targets"""
+        week = week_start(day or date.today())
+        return self.results.get(user_id, "week", (week,), lambda: self._week_vs_target(user_id, week))
+
+    def _week_vs_target(self, user_id: int, week: date) -> Optional[DailyProgress]:
+        with self.reads.cursor() as cursor:
+            row = cursor.execute(f"""
+                SELECT
+                    (
+                        SELECT CAST(sum({plan_target_on("CAST(d.day AS DATE)")}) AS INTEGER)
+                        FROM range(CAST($week AS DATE), CAST($week AS DATE) + 7, INTERVAL 1 DAY) d(day)
+                    ),
+                    coalesce(w.puffs, 0),
+                    coalesce(w.nicotine_mg, 0)
+                FROM user_setups s
+                LEFT JOIN puff_weekly w ON w.user_id = s.user_id AND w.week = $week
+                WHERE s.user_id = $user_id
+            """, {"week": week, "user_id": user_id}).fetchone()
+        if row is None:
+            return None
+        target, puffs, nicotine_mg = row
+        return DailyProgress(
+            user_id=user_id,
+            period=week,
+            puffs=puffs,
+            nicotine_mg=nicotine_mg,
+            target=target,
+        )
+
+    @METRICS.timed("db")
+    def progress_series(self, user_id: int, start: date, end: date) -> List[DailyProgress]:
+        """one DailyProgress per day from `start` to `end` inclusive, each with that day's planned target"""
+        # cached as a tuple, every caller gets a list of its own
+        return list(self.results.get(
+            user_id, "series", (start, end), lambda: tuple(self._progress_series(user_id, start, end))
+        ))
+
+    def _progress_series(self, user_id: int, start: date, end: date) -> List[DailyProgress]:
+        with self.reads.cursor() as cursor:
+            rows = cursor.execute(f"""
+                SELECT
+                    CAST(d.day AS DATE),
+                    coalesce(p.puffs, 0),
+                    coalesce(p.nicotine_mg, 0),
+                    {plan_target_on("CAST(d.day AS DATE)")}
+                FROM range(CAST($start AS DATE), CAST($end AS DATE) + 1, INTERVAL 1 DAY) d(day)
+                LEFT JOIN user_setups s ON s.user_id = $user_id
+                LEFT JOIN puff_daily p ON p.user_id = $user_id AND p.day = d.day
+                ORDER BY 1
+            """, {"start": start, "end": end, "user_id": user_id}).fetchall()
+        return [
+            DailyProgress(user_id=user_id, period=day, puffs=puffs, nicotine_mg=mg, target=target)
+            for day, puffs, mg, target in rows
+        ]
+
+    @METRICS.timed("db")
+    def rebuild_rollups(self, user_id: Optional[int] = None) -> int:
+        """recompute rollups from raw events (live and archived), returns daily rows written"""
+        written = self.writer.call(lambda conn: self._rebuild_rollups(conn, user_id)).result()
+        if user_id is not None:
+            self.touch([user_id])
+        else:
+            self.results.clear()
+        return written
+
+    @METRICS.timed("db")
+    async def set_reminder(self, user_id: int, minute_utc: Optional[int]) -> Optional[date]:
+        """set the daily reminder time (minute of the utc day), None turns it off.
+
+        returns the day the reminder was last sent, so callers can tell whether
+        today's has already gone out.
+        """
+        def job(conn: Any) -> Optional[date]:
+            if minute_utc is None:
+                conn.execute("DELETE FROM reminders WHERE user_id = ?", [user_id])
+                return None
+            # keeps last_sent so moving the time never re-sends today's reminder
+            row = conn.execute("""
+                INSERT INTO reminders VALUES (?, ?, NULL)
+                ON CONFLICT (user_id) DO UPDATE SET minute_utc = EXCLUDED.minute_utc
+                RETURNING last_sent
+            """, [user_id, minute_utc]).fetchone()
+            return row[0] if row else None
+        return await self.writer.call_async(job)
+
+    @METRICS.timed("db")
+    def reminders_due(self, day: date) -> List[Tuple[int, int]]:
+        """(user_id, minute_utc) of every reminder not yet sent on `day`"""
+        with self.reads.cursor() as cursor:
+            return cursor.execute("""
+                SELECT user_id, minute_utc FROM reminders
+                WHERE last_sent IS NULL OR last_sent < ?
+            """, [day]).fetchall()
+
+    @METRICS.timed("db")
+    async def mark_reminder_sent(self, user_id: int, day: date) -> None:
+        await self.writer.submit_async("reminder_sent", (user_id, day))
+
+    @staticmethod
+    def _mark_reminders_sent(conn: Any, sent: List[Tuple[int, date]]) -> None:
+        conn.execute("""
+            UPDATE reminders SET last_sent = s.day
+            FROM (SELECT UNNEST(?::BIGINT[]) AS user_id, UNNEST(?::DATE[]) AS day) s
+            WHERE reminders.user_id = s.user_id
+        """, [[u for u, _ in sent], [d for _, d in sent]])
+
+    @METRICS.timed("db")
+    def build_plans(self, max_days: int = MAX_PLAN_DAYS) -> int:
+        """rebuild the tapering schedule for every user in one pass, returns rows written"""
+        return self.writer.call(lambda conn: self._build_plans(conn, max_days)).result()
+
+    @METRICS.timed("db")
+    def plan_for(self, user_id: int) -> List[Tuple[date, int]]:
+        """(day, target tokes) for one user from the last plan build"""
+        with self.reads.cursor() as cursor:
+            return cursor.execute(
+                "SELECT day, target FROM reduction_plans WHERE user_id = ? ORDER BY day", [user_id]
+            ).fetchall()
+
+    @staticmethod
+    def _build_plans(conn: Any, max_days: int) -> int:
+        """set-based taper over user_setups, the first day is the day the setup was last changed.
+
+        each row is plan_target_sql for that day, the same target the progress
+        reads use, and a plan ends on the day its target reaches zero.
+        """
+        conn.execute(f"""
+            CREATE OR REPLACE TABLE reduction_plans AS
+            WITH spans AS (
+                SELECT
+                    *,
+                    CAST(updated_at AS DATE) AS start_day,
+                    least({int(max_days)}, CAST(CASE
+                        WHEN method = 'number' THEN ceil(tokes / reduce_amount)
+                        WHEN reduce_percent >= 100 THEN 1
+                        ELSE ceil(ln(0.5 / tokes) / ln(1 - reduce_percent / 100))
+                    END AS INTEGER)) AS n_days
+                FROM user_setups
+                WHERE tokes > 0 AND (
+                    (method = 'number' AND reduce_amount > 0)
+                    OR (method = 'percent' AND reduce_percent > 0)
+                )
+            ),
+            steps AS (
+                SELECT *, CAST(UNNEST(range(0, n_days)) AS INTEGER) AS k FROM spans
+            )
+            SELECT user_id, start_day + k AS day, {plan_target_sql("k + 1")} AS target
+            FROM steps s
+        """)
+        return conn.execute("SELECT count(*) FROM reduction_plans").fetchone()[0]
+
+    @METRICS.timed("db")
+    def export_user(self, user_id: int, path: str, fmt: str = "parquet") -> int:
+        """stream one user's puff history into a compressed file, returns rows written.
+
+        COPY writes straight from duckdb's pipeline, so the history is never held
+        in python. parquet is zstd compressed, csv is gzipped.
+        """
+        options = {
+            "parquet": "FORMAT PARQUET, COMPRESSION ZSTD",
+            "csv": "FORMAT CSV, HEADER, COMPRESSION GZIP",
+        }
+        if fmt not in options:
+            raise ValueError(f"Unsupported export format '{fmt}'")
+        quoted = path.replace("'", "''")
+
+        # runs as long as the history is big, so it never holds a pool slot
+        with self.reads.detached() as cursor:
+            row = cursor.execute(f"""
+                COPY (
+                    SELECT ts, strength FROM puff_history
+                    WHERE user_id = {int(user_id)}
+                    ORDER BY ts
+                ) TO '{quoted}' ({options[fmt]})
+            """).fetchone()
+        return row[0] if row else 0
+
+    @METRICS.timed("db")
+    def usage_report(self, day: Optional[date] = None) -> Dict[str, Any]:
+        """user-base totals for today and the last 7 days.
+
+        runs on the report snapshot when one is configured, so the numbers can
+        be up to one refresh interval old, `as_of` says when they were taken.
+        """
+        day = day or date.today()
+        sql = f"""
+            WITH targets AS (
+                SELECT user_id, {plan_target_on("CAST($1 AS DATE)")} AS target
+                FROM user_setups s WHERE tokes IS NOT NULL
+            ),
+            recent AS (
+                SELECT user_id,
+                       sum(puffs) FILTER (WHERE day = $1) AS today,
+                       sum(puffs) AS week
+                FROM puff_daily WHERE day > $2 AND day <= $1
+                GROUP BY user_id
+            )
+            SELECT
+                (SELECT count(*) FROM targets),
+                count(*) FILTER (WHERE r.today > 0),
+                coalesce(sum(r.today), 0),
+                count(*),
+                coalesce(sum(r.week), 0),
+                count(*) FILTER (WHERE r.today > 0 AND r.today <= t.target)
+            FROM recent r LEFT JOIN targets t USING (user_id)
+        """
+        params = [day, day - timedelta(days=7)]
+        if self.reports is not None:
+            row = self.reports.query(sql, params)[0]
+            as_of = self.reports.taken_at
+        else:
+            with self.reads.cursor() as cursor:
+                row = cursor.execute(sql, params).fetchone()
+            as_of = datetime.now()
+        setups, active_today, puffs_today, active_week, puffs_week, within_target = row
+        return {
+            "as_of": as_of,
+            "users_with_setup": setups,
+            "active_today": active_today,
+            "puffs_today": int(puffs_today),
+            "active_7d": active_week,
+            "puffs_7d": int(puffs_week),
+            "avg_puffs_today": puffs_today / active_today if active_today else 0.0,
+            "within_target_today": within_target,
+        }
+
+    def snapshot(self, path: str) -> None:
+        """consistent copy of the whole database as parquet under `path`, writes carry on meanwhile"""
+        for _ in self.snapshot_tables(path):
+            pass
+
+    def snapshot_tables(self, path: str) -> Iterator[str]:
+        """snapshot one table at a time, yields each table name once its parquet file is written.
+
+        every table is read in one transaction, so the copy is a single MVCC
+        snapshot however long the caller waits between tables. schema.sql and
+        load.sql are laid out like EXPORT DATABASE's, with file names relative to
+        `path` so the directory can be renamed, restore with IMPORT DATABASE from
+        inside it. the puff archive is already immutable parquet and is not
+        copied again.
+        """
+        os.makedirs(path, exist_ok=True)
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute("BEGIN TRANSACTION")
+            tables = cursor.execute("""
+                SELECT table_name, sql FROM duckdb_tables()
+                WHERE database_name = current_database() AND NOT temporary
+                ORDER BY table_name
+            """).fetchall()
+            # views read the tables, so they are created after them
+            dependents = cursor.execute("""
+                SELECT sql FROM duckdb_indexes()
+                WHERE database_name = current_database() AND sql IS NOT NULL
+                UNION ALL
+                SELECT sql FROM duckdb_views()
+                WHERE database_name = current_database() AND NOT internal AND NOT temporary
+            """).fetchall()
+            with open(os.path.join(path, "schema.sql"), "w") as f:
+                for sql in [sql for _, sql in tables] + [sql for (sql,) in dependents]:
+                    f.write(sql.rstrip().rstrip(";") + ";\n")
+
+            load = []
+            for name, _ in tables:
+                self._copy_table(cursor, name, os.path.join(path, f"{name}.parquet"))
+                load.append(f"COPY \"{name}\" FROM '{name}.parquet' (FORMAT PARQUET);")
+                yield name
+            with open(os.path.join(path, "load.sql"), "w") as f:
+                f.write("\n".join(load) + "\n")
+        finally:
+            # nothing was written, the transaction only pinned the snapshot
+            cursor.execute("ROLLBACK")
+            cursor.close()
+
+    @staticmethod
+    @METRICS.timed("maintenance", "snapshot_table")
+    def _copy_table(cursor: Any, name: str, path: str) -> None:
+        quoted = path.replace("'", "''")
+        cursor.execute(f"COPY \"{name}\" TO '{quoted}' (FORMAT PARQUET, COMPRESSION ZSTD)")
+
+    @METRICS.timed("maintenance")
+    def checkpoint(self) -> None:
+        """write the WAL into the database file and hand back blocks freed by deletes"""
+        cursor = self.conn.cursor()
+        try:
+            for attempt in range(CHECKPOINT_ATTEMPTS):
+                try:
+                    cursor.execute("CHECKPOINT")
+                    return
+                except duckdb.TransactionException:
+                    if attempt == CHECKPOINT_ATTEMPTS - 1:
+                        raise
+                    time.sleep(CHECKPOINT_RETRY_WAIT)
+        finally:
+            cursor.close()
+
+    def drop_detail_before(self, day: date) -> int:
+        """delete raw puff events before `day`, live and archived, returns archive days removed.
+
+        puff_daily and puff_weekly keep the totals for those days, and
+        rebuild_rollups leaves days without detail alone.
+        """
+        self.drop_live_detail_before(day)
+        archived = self.archived_days_before(day)
+        for archived_day in archived:
+            self.drop_archived_day(archived_day)
+        return len(archived)
+
+    @METRICS.timed("maintenance")
+    def drop_live_detail_before(self, day: date) -> None:
+        """the not yet archived part of drop_detail_before"""
+        cutoff = datetime.combine(day, datetime.min.time())
+        self.writer.call(lambda conn: conn.execute("DELETE FROM puff_events WHERE ts < ?", [cutoff])).result()
+
+    def archived_days_before(self, day: date) -> List[date]:
+        """days before `day` that still have an archive partition, oldest first"""
+        if not self.archive_dir:
+            return []
+        days = []
+        # hive partitions, one directory per day=YYYY-MM-DD
+        for partition in glob.glob(os.path.join(self.archive_dir, "day=*")):
+            try:
+                partition_day = date.fromisoformat(os.path.basename(partition)[len("day="):])
+            except ValueError:
+                continue
+            if partition_day < day:
+                days.append(partition_day)
+        return sorted(days)
+
+    @METRICS.timed("maintenance")
+    def drop_archived_day(self, day: date) -> None:
+        """remove one day's archive partition"""
+        def job(conn: Any) -> None:
+            shutil.rmtree(os.path.join(self.archive_dir, f"day={day.isoformat()}"), ignore_errors=True)
+            self._refresh_puff_history(conn)
+        self.writer.call(job).result()
+
+    @METRICS.timed("db")
+    def archive_puffs(self) -> int:
+        """roll cold puff events out to parquet now, returns rows moved"""
+        return self.writer.call(self._archive_puffs).result()
+
+    @classmethod
+    def _append_puff_batches(cls, conn: Any, batches: List[List[PuffEvent]]) -> int:
+        return cls._append_puffs(conn, (e for batch in batches for e in batch))
+
+    @staticmethod
+    def _append_puffs(conn: Any, events: Iterable[PuffEvent]) -> int:
+        """column-wise append, same UNNEST binding as the setup upsert"""
+        rows = list(events)
+        for start in range(0, len(rows), UPSERT_CHUNK_ROWS):
+            chunk = rows[start:start + UPSERT_CHUNK_ROWS]
+            conn.execute("""
+                INSERT INTO puff_events
+                SELECT
+                    UNNEST(?::INTEGER[]),
+                    UNNEST(?::TIMESTAMP[]),
+                    UNNEST(?::INTEGER[])
+            """, [
+                [e.user_id for e in chunk],
+                [e.ts for e in chunk],
+                [e.strength for e in chunk],
+            ])
+        DuckDBManager._bump_rollups(conn, ((e.user_id, e.ts, e.strength, 1) for e in rows))
+        return len(rows)
+
+    @staticmethod
+    def _append_puff_counts(conn: Any, rows: List[Tuple[int, datetime, Optional[int], int]]) -> int:
+        """append (user_id, ts, strength, puffs) rows, each expanded to `puffs` events inside duckdb"""
+        for start in range(0, len(rows), UPSERT_CHUNK_ROWS):
+            chunk = rows[start:start + UPSERT_CHUNK_ROWS]
+            conn.execute("""
+                INSERT INTO puff_events
+                SELECT user_id, ts, strength FROM (
+                    SELECT user_id, ts, strength, UNNEST(range(puffs))
+                    FROM (
+                        SELECT
+                            UNNEST(?::INTEGER[]) AS user_id,
+                            UNNEST(?::TIMESTAMP[]) AS ts,
+                            UNNEST(?::INTEGER[]) AS strength,
+                            UNNEST(?::INTEGER[]) AS puffs
+                    )
+                )
+            """, [[r[0] for r in chunk], [r[1] for r in chunk], [r[2] for r in chunk], [r[3] for r in chunk]])
+        DuckDBManager._bump_rollups(conn, rows)
+        return sum(r[3] for r in rows)
+
+    @staticmethod
+    def _bump_rollups(conn: Any, rows: Iterable[Tuple[int, datetime, Optional[int], int]]) -> None:
+        """fold a batch of (user_id, ts, strength, puffs) into the daily and weekly rollups"""
+        daily: Dict[Tuple[int, date], List[float]] = {}
+        for user_id, ts, strength, puffs in rows:
+            totals = daily.setdefault((user_id, ts.date()), [0, 0.0])
+            totals[0] += puffs
+            totals[1] += (strength or 0) * ML_PER_PUFF * puffs
+
+        weekly: Dict[Tuple[int, date], List[float]] = {}
+        for (user_id, day), (puffs, mg) in daily.items():
+            totals = weekly.setdefault((user_id, week_start(day)), [0, 0.0])
+            totals[0] += puffs
+            totals[1] += mg
+
+        for table, period, totals in (("puff_daily", "day", daily), ("puff_weekly", "week", weekly)):
+            if not totals:
+                continue
+            conn.execute(f"""
+                INSERT INTO {table}
+                SELECT
+                    UNNEST(?::INTEGER[]),
+                    UNNEST(?::DATE[]),
+                    UNNEST(?::INTEGER[]),
+                    UNNEST(?::DOUBLE[])
+                ON CONFLICT (user_id, {period}) DO UPDATE SET
+                    puffs = puffs + EXCLUDED.puffs,
+                    nicotine_mg = nicotine_mg + EXCLUDED.nicotine_mg
+            """, [
+                [k[0] for k in totals],
+                [k[1] for k in totals],
+                [v[0] for v in totals.values()],
+                [v[1] for v in totals.values()],
+            ])
+
+    def _rebuild_rollups(self, conn: Any, user_id: Optional[int]) -> int:
+        where, params = ("WHERE user_id = ?", [user_id]) if user_id is not None else ("", [])
+        # days before the oldest detail row were dropped by retention, their rollups are all that is left
+        horizon = conn.execute("SELECT CAST(min(ts) AS DATE) FROM puff_history").fetchone()[0]
+        if horizon is not None:
+            daily_where = f"{where} {'AND' if where else 'WHERE'} day >= ?"
+            conn.execute(f"DELETE FROM puff_daily {daily_where}", params + [horizon])
+        conn.execute(f"DELETE FROM puff_weekly {where}", params)
+        conn.execute(f"""
+            INSERT INTO puff_daily
+            SELECT user_id, CAST(ts AS DATE), count(*), sum(coalesce(strength, 0)) * {ML_PER_PUFF}
+            FROM puff_history {where}
+            GROUP BY ALL
+        """, params)
+        conn.execute(f"""
+            INSERT INTO puff_weekly
+            SELECT user_id, CAST(date_trunc('week', day) AS DATE), sum(puffs), sum(nicotine_mg)
+            FROM puff_daily {where}
+            GROUP BY ALL
+        """, params)
+        return conn.execute(f"SELECT count(*) FROM puff_daily {where}", params).fetchone()[0]
+
+    def _archive_puffs(self, conn: Any) -> int:
+        """move events older than the retention window into day-partitioned parquet files"""
+        cutoff = datetime.combine(datetime.now().date(), datetime.min.time()) \
+            - timedelta(days=self.archive_after_days)
+        moved = conn.execute("SELECT count(*) FROM puff_events WHERE ts < ?", [cutoff]).fetchone()[0]
+        if not moved:
+            return 0
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        quoted = self.archive_dir.replace("'", "''")
+        # uuid file names so every rollover adds files next to the old ones
+        conn.execute(f"""
+            COPY (
+                SELECT user_id, ts, strength, CAST(ts AS DATE) AS day
+                FROM puff_events WHERE ts < ?
+            ) TO '{quoted}'
+            (FORMAT PARQUET, PARTITION_BY (day), OVERWRITE_OR_IGNORE, FILENAME_PATTERN 'puffs_{{uuid}}')
+        """, [cutoff])
+        conn.execute("DELETE FROM puff_events WHERE ts < ?", [cutoff])
+        self._refresh_puff_history(conn)
+        return moved
+
+    def _refresh_puff_history(self, conn: Any) -> None:
+        """`puff_history` reads live events plus whatever has been archived"""
+        archived = self.archive_dir and glob.glob(os.path.join(self.archive_dir, "**", "*.parquet"), recursive=True)
+        if archived:
+            quoted = self.archive_dir.replace("'", "''")
+            source = f"""
+                SELECT user_id, ts, strength FROM puff_events
+                UNION ALL
+                SELECT user_id, ts, strength
+                FROM read_parquet('{quoted}/**/*.parquet', hive_partitioning = true)
+            """
+        else:
+            source = "SELECT user_id, ts, strength FROM puff_events"
+        conn.execute(f"CREATE OR REPLACE VIEW puff_history AS {source}")
+
+    @staticmethod
+    def _upsert_setups(conn: Any, setups: Iterable[SetupData]) -> int:
+        """column-wise upsert, each chunk is bound as lists and UNNESTed in one statement"""
+        # last write wins when the same user shows up twice, INSERT OR REPLACE
+        # refuses to touch one key twice in a single statement
+        latest = {s.user_id: s for s in setups}
+        rows = list(latest.values())
+
+        for start in range(0, len(rows), UPSERT_CHUNK_ROWS):
+            chunk = rows[start:start + UPSERT_CHUNK_ROWS]
+            conn.execute("""
+                INSERT OR REPLACE INTO user_setups
+                SELECT
+                    UNNEST(?::INTEGER[]),
+                    UNNEST(?::INTEGER[]),
+                    UNNEST(?::INTEGER[]),
+                    UNNEST(?::VARCHAR[]),
+                    UNNEST(?::INTEGER[]),
+                    UNNEST(?::FLOAT[]),
+                    UNNEST(?::TIMESTAMP[]),
+                    UNNEST(?::TIMESTAMP[])
+            """, [
+                [s.user_id for s in chunk],
+                [s.tokes for s in chunk],
+                [s.strength for s in chunk],
+                [s.method for s in chunk],
+                [s.reduce_amount for s in chunk],
+                [s.reduce_percent for s in chunk],
+                [s.created_at for s in chunk],
+                [s.updated_at for s in chunk],
+            ])
+        return len(rows)
+
+    def import_file(
+        self, path: str, kind: str = "auto", user_id: Optional[int] = None, max_puffs: Optional[int] = None
+    ) -> Any:
+        """LogImporter.import_file against this db, returns its ImportResult.
+
+        `max_puffs` defaults to MAX_PUFFS_PER_IMPORT.
+        """
+        # importer builds on this module, so it is imported on use
+        from bot.importer import MAX_PUFFS_PER_IMPORT, LogImporter
+        cap = MAX_PUFFS_PER_IMPORT if max_puffs is None else max_puffs
+        return LogImporter(self).import_file(path, kind=kind, user_id=user_id, max_puffs=cap)
+
+    @property
+    def pending_writes(self) -> int:
+        return self.writer.pending
+
+    async def sync(self) -> None:
+        """wait until every write queued so far has committed"""
+        await self.writer.call_async(lambda conn: None)
+
+    def close(self) -> None:
+        """flush pending writes then close the connection"""
+        if self.reports is not None:
+            self.reports.close()
+        self.writer.close()
+        self.reads.close()
+        self.conn.close()
+
+
+def week_start(day: date) -> date:
+    """monday of the week `day` falls in, matches duckdb's date_trunc('week', ...)"""
+    return day - timedelta(days=day.weekday())
+
+
+def plan_target_sql(steps: str) -> str:
+    """sql for the planned target of setup row `s` after `steps` days of reduction.
+
+    number cuts reduce_amount more each day down to zero, percent cuts
+    reduce_percent of the previous day's target. a setup without a goal keeps
+    its tokes, one without tokes has no target.
+    """
+    return f"""CAST(CASE
+        WHEN s.method = 'number' AND s.reduce_amount > 0 THEN greatest(s.tokes - ({steps}) * s.reduce_amount, 0)
+        WHEN s.method = 'percent' AND s.reduce_percent > 0
+            THEN round(s.tokes * pow(greatest(1 - s.reduce_percent / 100, 0), {steps}))
+        ELSE s.tokes
+    END AS INTEGER)"""
+
+
+def plan_target_on(day: str) -> str:
+    """sql for the planned target of setup row `s` on the date expression `day`.
+
+    the day the setup was last changed is the plan's first day and already has
+    one day of reduction applied, days before it get the first day's target.
+    """
+    start = f"coalesce(CAST(s.updated_at AS DATE), {day})"
+    return plan_target_sql(f"greatest(datediff('day', {start}, {day}), 0) + 1")
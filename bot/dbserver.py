@@ -0,0 +1,222 @@
+import asyncio
+import inspect
+import itertools
+import logging
+import os
+import pickle
+import threading
+from concurrent.futures import Future
+from dataclasses import replace
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from .data_transfer import DuckDBManager
+from .metrics import METRICS
+from .models import DailyProgress, PuffEvent, SetupData
+
+logger = logging.getLogger(__name__)
+
+# request tuples on the shared queue, (op, shard, request_id, name, args)
+SUBMIT = "submit"
+CALL = "call"
+STOP = "stop"
+
+# the DuckDBManager methods workers may call, anything else is refused
+REMOTE_METHODS = frozenset({
+    "load_setup",
+    "today_vs_target",
+    "week_vs_target",
+    "progress_series",
+    "data_version",
+    "export_user",
+    "import_file",
+    "reminders_due",
+    "usage_report",
+    "set_reminder",
+    "sync",
+})
+
+
+class DBServer:
+    """serves one DuckDBManager to worker processes over multiprocessing queues.
+
+    every worker puts requests on the shared `requests` queue and reads answers
+    from its own entry in `responses`. SUBMIT hands a payload to the writer
+    thread, so writes from every shard land in the same batches. CALL
+    runs a whitelisted method on the event loop (async methods) or a thread
+    (sync ones) and sends back (request_id, ok, result).
+    """
+
+    def __init__(self, db: DuckDBManager, requests: Any, responses: List[Any]):
+        self.db = db
+        self.requests = requests
+        self.responses = responses
+
+    def run(self) -> None:
+        """serve until a STOP request arrives"""
+        asyncio.run(self._serve())
+
+    async def _serve(self) -> None:
+        loop = asyncio.get_running_loop()
+        tasks = set()
+        # writes are handed on in arrival order by one task, so a full write
+        # queue holds up later writes but never the reads behind them
+        writes: "asyncio.Queue[Optional[Tuple[int, str, Any]]]" = asyncio.Queue()
+        forwarder = loop.create_task(self._forward_writes(writes))
+        while True:
+            op, shard, request_id, name, args = await asyncio.to_thread(self.requests.get)
+            if op == STOP:
+                break
+            if op == SUBMIT:
+                writes.put_nowait((shard, name, args))
+                continue
+            task = loop.create_task(self._call(shard, request_id, name, args))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        writes.put_nowait(None)
+        await asyncio.gather(forwarder, *tasks, return_exceptions=True)
+
+    async def _forward_writes(self, writes: "asyncio.Queue[Optional[Tuple[int, str, Any]]]") -> None:
+        while True:
+            item = await writes.get()
+            if item is None:
+                return
+            shard, name, args = item
+            try:
+                await self.db.writer.submit_async(name, args)
+            except Exception:
+                logger.exception("Dropped '%s' write from shard %s", name, shard)
+
+    async def _call(self, shard: int, request_id: int, name: str, args: Tuple[Any, ...]) -> None:
+        try:
+            if name not in REMOTE_METHODS:
+                raise AttributeError(f"'{name}' is not available remotely")
+            method = getattr(self.db, name)
+            if inspect.iscoroutinefunction(method):
+                result = await method(*args)
+            else:
+                result = await asyncio.to_thread(method, *args)
+            reply = (request_id, True, result)
+        except Exception as e:
+            reply = (request_id, False, e)
+        try:
+            pickle.dumps(reply[2])
+        except Exception:
+            reply = (request_id, False, RuntimeError(repr(reply[2])))
+        self.responses[shard].put(reply)
+
+
+class RemoteDuckDB:
+    """the DuckDBManager surface handlers use, forwarded to a DBServer.
+
+    fire-and-forget writes are sent as SUBMITs and return once queued, reads
+    and anything with a result are CALLs answered on this shard's response
+    queue. a background thread matches answers to waiting futures.
+    """
+
+    def __init__(self, shard: int, requests: Any, responses: Any):
+        self.shard = shard
+        self.requests = requests
+        self.responses = responses
+        # pid-prefixed, so a restarted worker never mistakes an old answer for its own
+        self._ids = itertools.count(os.getpid() << 32)
+        self._waiting: Dict[int, Future] = {}
+        self._reader = threading.Thread(target=self._read, name="duckdb-client", daemon=True)
+        self._reader.start()
+        # the write queue lives in the db process, this side can only see its own calls
+        METRICS.gauge("queue_depth", "db_calls", lambda: self.pending_calls)
+
+    # writes
+
+    async def enqueue_setup(self, setup: SetupData) -> None:
+        self._submit("setup", replace(setup))
+
+    async def enqueue_puffs(self, user_id: int, count: int = 1, strength: Optional[int] = None) -> None:
+        events = [PuffEvent(user_id=user_id, ts=datetime.now(), strength=strength)] * count
+        self._submit("puffs", events)
+
+    async def mark_reminder_sent(self, user_id: int, day: date) -> None:
+        self._submit("reminder_sent", (user_id, day))
+
+    async def set_reminder(self, user_id: int, minute_utc: Optional[int]) -> Optional[date]:
+        return await self._call_async("set_reminder", user_id, minute_utc)
+
+    async def sync(self) -> None:
+        await self._call_async("sync")
+
+    # reads, these block for a round trip so they must run in a thread (asyncio.to_thread)
+
+    def load_setup(self, user_id: int) -> Optional[SetupData]:
+        return self._result("load_setup", user_id)
+
+    def today_vs_target(self, user_id: int, day: Optional[date] = None) -> Optional[DailyProgress]:
+        return self._result("today_vs_target", user_id, day)
+
+    def week_vs_target(self, user_id: int, day: Optional[date] = None) -> Optional[DailyProgress]:
+        return self._result("week_vs_target", user_id, day)
+
+    def progress_series(self, user_id: int, start: date, end: date) -> List[DailyProgress]:
+        return self._result("progress_series", user_id, start, end)
+
+    def data_version(self, user_id: int) -> int:
+        return self._result("data_version", user_id)
+
+    def export_user(self, user_id: int, path: str, fmt: str = "parquet") -> int:
+        # same host, the db process writes the file where the worker will read it
+        return self._result("export_user", user_id, path, fmt)
+
+    def import_file(
+        self, path: str, kind: str = "auto", user_id: Optional[int] = None, max_puffs: Optional[int] = None
+    ) -> Any:
+        return self._result("import_file", path, kind, user_id, max_puffs)
+
+    def reminders_due(self, day: date) -> List[Tuple[int, int]]:
+        return self._result("reminders_due", day)
+
+    def usage_report(self, day: Optional[date] = None) -> Dict[str, Any]:
+        return self._result("usage_report", day)
+
+    @property
+    def pending_calls(self) -> int:
+        """calls waiting for an answer, writes are fire-and-forget and not counted"""
+        return len(self._waiting)
+
+    def close(self) -> None:
+        """the server owns the connection, only stop waiting on it"""
+        for future in list(self._waiting.values()):
+            future.cancel()
+        self._waiting.clear()
+
+    # plumbing
+
+    def _submit(self, kind: str, payload: Any) -> None:
+        self.requests.put((SUBMIT, self.shard, None, kind, payload))
+
+    def _result(self, name: str, *args: Any) -> Any:
+        """blocking call, refused on an event loop where it would stall the whole shard"""
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return self._call(name, *args).result()
+        raise RuntimeError(f"'{name}' waits on the db process, call it through asyncio.to_thread")
+
+    def _call(self, name: str, *args: Any) -> Future:
+        request_id = next(self._ids)
+        future: Future = Future()
+        self._waiting[request_id] = future
+        self.requests.put((CALL, self.shard, request_id, name, args))
+        return future
+
+    async def _call_async(self, name: str, *args: Any) -> Any:
+        return await asyncio.wrap_future(self._call(name, *args))
+
+    def _read(self) -> None:
+        while True:
+            request_id, ok, value = self.responses.get()
+            future = self._waiting.pop(request_id, None)
+            if future is None or future.done():
+                continue
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
@@ -1,4 +1,3 @@
-from typing import Optional
 from telegram import Update
 from .models import UserProfile, ChatContext, MessageMetadata, SessionData
 
@@ -46,10 +45,6 @@ class TelegramExtractor:
     
     @staticmethod
     def session(up: Update) -> SessionData:
-        """Create complete session from update (Telegram data only)"""
-        return SessionData(
-            user=TelegramExtractor.extract_user(up),
-            chat=TelegramExtractor.extract_chat(up),
-            message=TelegramExtractor.extract_message(up),
-        )
+        """Create a lazy session over the update (Telegram data only)"""
+        return SessionData(up, TelegramExtractor)
     
\ No newline at end of file
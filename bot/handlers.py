@@ -1,8 +1,15 @@
 from .conversation import ConversationFlow
 from .data_transfer import DuckDBManager
 
-def register_handlers(application, db: DuckDBManager):
-    conv = ConversationFlow(db)
-    application.add_handler(conv.setup_build())
+def register_handlers(application, db: DuckDBManager, **flow_options):
+    conv = ConversationFlow(db, **flow_options)
+    application.add_handler(conv.setup_build(persistent=application.persistence is not None))
     application.add_handler(conv.help())
+    application.add_handler(conv.puff())
+    application.add_handler(conv.export())
+    application.add_handler(conv.summary())
+    application.add_handler(conv.progress())
+    application.add_handler(conv.remind())
+    application.add_handler(conv.stats())
+    application.add_handler(conv.import_upload())
     application.add_handler(conv.start()) 
\ No newline at end of file
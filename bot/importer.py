@@ -0,0 +1,223 @@
+import logging
+import os
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from .data_transfer import DuckDBManager
+from .metrics import METRICS
+from .models import DataParser, SetupData
+
+logger = logging.getLogger(__name__)
+
+# rows pulled from the reader per chunk, each chunk is one writer transaction
+IMPORT_CHUNK_ROWS = 50_000
+
+# one row of an events file may stand for several puffs, capped so a typo can't explode
+MAX_PUFFS_PER_ROW = 10_000
+
+# every puff is a puff_events row written by the single writer thread, so the total is capped too
+MAX_PUFFS_PER_IMPORT = 10_000_000
+# a document upload is one user's history, about three years at 300 puffs a day
+MAX_PUFFS_PER_UPLOAD = 300_000
+
+# accepted column names, first match wins
+EVENT_COLUMNS = {
+    "user_id": ("user_id", "uid", "user"),
+    "ts": ("ts", "timestamp", "time", "datetime", "date"),
+    "strength": ("strength", "nicotine", "mg"),
+    "puffs": ("puffs", "count", "amount"),
+}
+SETUP_COLUMNS = {
+    "user_id": ("user_id", "uid", "user"),
+    "tokes": ("tokes", "puffs"),
+    "strength": ("strength", "nicotine", "mg"),
+    "method": ("method",),
+    "reduce_amount": ("reduce_amount",),
+    "reduce_percent": ("reduce_percent",),
+}
+
+
+@dataclass(frozen=True, slots=True)
+class ImportResult:
+    """what an import did and how fast"""
+    path: str
+    kind: str
+    rows_read: int
+    rows_rejected: int
+    rows_written: int
+    seconds: float
+    bytes_read: int
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows_read / self.seconds if self.seconds else 0.0
+
+    @property
+    def mb_per_sec(self) -> float:
+        return self.bytes_read / 1e6 / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        return (
+            f"Imported {self.rows_written:,} {self.kind} from {self.rows_read:,} rows "
+            f"({self.rows_rejected:,} rejected) in {self.seconds:.1f}s, "
+            f"{self.rows_per_sec:,.0f} rows/s, {self.mb_per_sec:.1f} MB/s"
+        )
+
+
+class LogImporter:
+    """streams csv/json history into puff_events or user_setups.
+
+    the file is read by duckdb's own csv/json reader and every column is parsed
+    with the DataParser rules as one sql expression, so validation runs over
+    whole vectors rather than value by value. results are pulled in chunks of
+    `chunk_rows` and each chunk is written as one writer-thread transaction,
+    which keeps memory flat and lets live writes interleave with the import.
+    """
+
+    def __init__(self, db: DuckDBManager, chunk_rows: int = IMPORT_CHUNK_ROWS):
+        self.db = db
+        self.chunk_rows = chunk_rows
+
+    @METRICS.timed("db")
+    def import_file(
+        self,
+        path: str,
+        kind: str = "auto",
+        user_id: Optional[int] = None,
+        max_puffs: int = MAX_PUFFS_PER_IMPORT,
+    ) -> ImportResult:
+        """import one file, `user_id` pins every row to that user (used for uploads).
+
+        an events file whose valid rows add up to more than `max_puffs` puffs is
+        rejected with ValueError before anything is written, which costs one
+        extra pass of duckdb's reader over the file.
+        """
+        start = time.perf_counter()
+        reader = self._reader(path)
+        # held across every chunk's write, so it never takes a pool slot
+        with self.db.reads.detached() as cursor:
+            columns = [row[0].lower() for row in cursor.execute(f"DESCRIBE SELECT * FROM {reader}").fetchall()]
+            if kind == "auto":
+                kind = "setups" if "method" in columns else "events"
+            if kind == "events":
+                query, write = self._events_query(reader, columns, user_id), self._write_events
+            elif kind == "setups":
+                query, write = self._setups_query(reader, columns, user_id), self._write_setups
+            else:
+                raise ValueError(f"Unknown import kind '{kind}'")
+
+            if kind == "events":
+                total = cursor.execute(f"SELECT coalesce(sum(puffs), 0) FROM ({query}) WHERE valid").fetchone()[0]
+                if total > max_puffs:
+                    raise ValueError(f"File has {total:,} puffs, the limit for one import is {max_puffs:,}")
+
+            read = rejected = written = 0
+            cursor.execute(query)
+            while True:
+                rows = cursor.fetchmany(self.chunk_rows)
+                if not rows:
+                    break
+                valid = [row[:-1] for row in rows if row[-1]]
+                read += len(rows)
+                rejected += len(rows) - len(valid)
+                if valid:
+                    written += self.db.writer.call(lambda conn, chunk=valid: write(conn, chunk)).result()
+                    self.db.touch({row[0] for row in valid})
+
+        result = ImportResult(
+            path=path,
+            kind=kind,
+            rows_read=read,
+            rows_rejected=rejected,
+            rows_written=written,
+            seconds=time.perf_counter() - start,
+            bytes_read=os.path.getsize(path),
+        )
+        logger.info(result.summary())
+        return result
+
+    @staticmethod
+    def _reader(path: str) -> str:
+        quoted = "'" + path.replace("'", "''") + "'"
+        ext = os.path.splitext(path)[1].lower()
+        if ext in (".csv", ".tsv", ".txt"):
+            return f"read_csv({quoted}, header = true, all_varchar = true)"
+        if ext in (".json", ".jsonl", ".ndjson"):
+            return f"read_json_auto({quoted})"
+        raise ValueError(f"Unsupported file type '{ext}', expected csv or json")
+
+    @staticmethod
+    def _pick(columns: List[str], aliases: Dict[str, Tuple[str, ...]]) -> Dict[str, Optional[str]]:
+        found = {}
+        for name, candidates in aliases.items():
+            match = next((c for c in candidates if c in columns), None)
+            found[name] = f'"{match}"' if match else None
+        return found
+
+    def _events_query(self, reader: str, columns: List[str], user_id: Optional[int]) -> str:
+        cols = self._pick(columns, EVENT_COLUMNS)
+        if cols["ts"] is None:
+            raise ValueError("Events file needs a timestamp column")
+        if cols["user_id"] is None and user_id is None:
+            raise ValueError("Events file needs a user_id column")
+
+        uid = str(int(user_id)) if user_id is not None else DataParser.sql_rule(int, cols["user_id"])
+        ts = DataParser.sql_rule(datetime, cols["ts"])
+        strength = DataParser.sql_rule(int, cols["strength"]) if cols["strength"] else "NULL"
+        puffs = DataParser.sql_rule(int, cols["puffs"]) if cols["puffs"] else "1"
+        # a value that is present but unparsable rejects the row, a missing one is allowed
+        strength_raw = cols["strength"] or "NULL"
+        return f"""
+            SELECT user_id, ts, strength, puffs,
+                user_id IS NOT NULL AND ts IS NOT NULL AND (strength_raw IS NULL OR strength IS NOT NULL)
+                    AND puffs BETWEEN 1 AND {MAX_PUFFS_PER_ROW} AS valid
+            FROM (
+                SELECT
+                    {uid} AS user_id,
+                    {ts} AS ts,
+                    {strength} AS strength,
+                    {strength_raw} AS strength_raw,
+                    {puffs} AS puffs
+                FROM {reader}
+            )
+        """
+
+    def _setups_query(self, reader: str, columns: List[str], user_id: Optional[int]) -> str:
+        cols = self._pick(columns, SETUP_COLUMNS)
+        if cols["tokes"] is None or cols["method"] is None:
+            raise ValueError("Setups file needs tokes and method columns")
+        if cols["user_id"] is None and user_id is None:
+            raise ValueError("Setups file needs a user_id column")
+
+        rule = lambda t, name: DataParser.sql_rule(t, cols[name]) if cols[name] else "NULL"
+        uid = str(int(user_id)) if user_id is not None else rule(int, "user_id")
+        # fills whichever of amount/percent is missing, like SetupManager._recalculate_metrics
+        return f"""
+            SELECT user_id, tokes, strength, method,
+                coalesce(reduce_amount, CAST(reduce_percent / 100 * tokes AS INTEGER)),
+                coalesce(reduce_percent, round(reduce_amount / tokes * 100, 2)),
+                user_id IS NOT NULL AND tokes > 0 AND method IN ('number', 'percent')
+                    AND coalesce(reduce_amount, reduce_percent) IS NOT NULL AS valid
+            FROM (
+                SELECT
+                    {uid} AS user_id,
+                    {rule(int, "tokes")} AS tokes,
+                    {rule(int, "strength")} AS strength,
+                    lower({rule(str, "method")}) AS method,
+                    {rule(int, "reduce_amount")} AS reduce_amount,
+                    {rule(float, "reduce_percent")} AS reduce_percent
+                FROM {reader}
+            )
+        """
+
+    @staticmethod
+    def _write_events(conn, rows: List[tuple]) -> int:
+        # a row stands for up to MAX_PUFFS_PER_ROW events, they are only ever materialised by duckdb
+        return DuckDBManager._append_puff_counts(conn, rows)
+
+    @staticmethod
+    def _write_setups(conn, rows: List[tuple]) -> int:
+        now = datetime.now()
+        return DuckDBManager._upsert_setups(conn, (SetupData(*row, created_at=now, updated_at=now) for row in rows))
@@ -0,0 +1,217 @@
+import logging
+import os
+import shutil
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Callable, Generator, List, Optional, Tuple
+
+from bot.data_transfer import DuckDBManager
+from bot.metrics import DEFAULT_BUCKETS, METRICS, bucket_quantile
+
+logger = logging.getLogger(__name__)
+
+# snapshot directory names, sortable so the oldest are pruned first
+SNAPSHOT_FORMAT = "%Y%m%dT%H%M%S"
+
+
+class MaintenanceService:
+    """online snapshots, detail retention and checkpoints while the bot keeps serving.
+
+    every `interval` seconds a background thread runs three steps: export the
+    database to `snapshot_dir/<timestamp>` (keeping the newest `keep_snapshots`),
+    drop raw puff events older than `retain_days` (the daily and weekly rollups
+    keep their totals), then CHECKPOINT to reclaim the space. steps run in
+    chunks, one table of the snapshot or one archived day at a time. each step
+    waits until the p99 of the `family` latency histograms over a `probe`
+    second window is within `p99_budget`, and a chunk that pushes p99 over the
+    budget is followed by a pause as long as it took and a fresh wait before
+    the next chunk. after `max_defer` seconds of waiting the work goes ahead
+    anyway, so a busy bot is still backed up.
+    """
+
+    def __init__(
+        self,
+        db: DuckDBManager,
+        snapshot_dir: Optional[str] = "snapshots",
+        keep_snapshots: int = 3,
+        retain_days: Optional[int] = None,
+        interval: float = 6 * 3600.0,
+        p99_budget: float = 0.5,
+        family: str = "handler",
+        probe: float = 5.0,
+        max_defer: float = 3600.0,
+    ):
+        if keep_snapshots < 1:
+            raise ValueError("keep_snapshots must be at least 1")
+        self.db = db
+        self.snapshot_dir = snapshot_dir
+        self.keep_snapshots = keep_snapshots
+        self.retain_days = retain_days
+        self.interval = interval
+        self.p99_budget = p99_budget
+        self.family = family
+        self.probe = probe
+        self.max_defer = max_defer
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.runs = 0
+        self.deferrals = 0
+        self.failures = 0
+        self.last_snapshot: Optional[datetime] = None
+        METRICS.gauge("maintenance", "runs", lambda: self.runs)
+        METRICS.gauge("maintenance", "deferrals", lambda: self.deferrals)
+        METRICS.gauge("maintenance", "failures", lambda: self.failures)
+        METRICS.gauge("maintenance", "snapshot_age_seconds", lambda: (
+            (datetime.now() - self.last_snapshot).total_seconds() if self.last_snapshot else float("nan")
+        ))
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="maintenance", daemon=True)
+            self._thread.start()
+
+    def close(self) -> None:
+        """stop after the step in progress, a running export is not interrupted"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def run_once(self) -> None:
+        """one round of every step, gated on latency headroom before each step and between chunks"""
+        steps: List[Tuple[str, Callable[[], Generator[Any, None, Any]]]] = []
+        if self.snapshot_dir:
+            steps.append(("snapshot", self._snapshot_chunks))
+        if self.retain_days is not None:
+            steps.append(("retention", self._retention_chunks))
+        steps.append(("checkpoint", self._checkpoint_chunks))
+        for name, step in steps:
+            if not self._wait_for_headroom():
+                return
+            try:
+                if not self._run_chunks(name, step()):
+                    return
+            except Exception:
+                self.failures += 1
+                logger.exception("Maintenance step %s failed", name)
+        self.runs += 1
+
+    def snapshot(self) -> str:
+        """export the database to a new timestamped directory in one go, returns its path"""
+        return _drain(self._snapshot_chunks())
+
+    def apply_retention(self) -> int:
+        """drop puff detail older than `retain_days` in one go, returns archive days removed"""
+        return _drain(self._retention_chunks())
+
+    def _run_chunks(self, name: str, chunks: Generator[Any, None, Any]) -> bool:
+        """advance a step one chunk at a time, False if the service stopped part way"""
+        try:
+            done = False
+            while not done:
+                before = METRICS.bucket_counts(self.family)
+                start = time.monotonic()
+                try:
+                    next(chunks)
+                except StopIteration:
+                    done = True
+                elapsed = time.monotonic() - start
+                p99 = self._p99_since(before)
+                if p99 is not None and p99 > self.p99_budget:
+                    logger.info("%s chunk took %.1fs with p99 at %gs, pausing", name, elapsed, p99)
+                    if self._stop.wait(elapsed):
+                        return False
+                    if not done and not self._wait_for_headroom():
+                        return False
+            return True
+        finally:
+            # an abandoned step cleans up after itself
+            chunks.close()
+
+    def _snapshot_chunks(self) -> Generator[str, None, str]:
+        """the snapshot step, yields after each table"""
+        taken_at = datetime.now()
+        name = taken_at.strftime(SNAPSHOT_FORMAT)
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        # exported under a hidden name first, a directory with a timestamp name is always complete
+        partial = os.path.join(self.snapshot_dir, f".{name}")
+        path = os.path.join(self.snapshot_dir, name)
+        shutil.rmtree(partial, ignore_errors=True)
+        try:
+            yield from self.db.snapshot_tables(partial)
+        except BaseException:
+            # GeneratorExit included, a stopped snapshot leaves nothing behind
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        os.rename(partial, path)
+        self.last_snapshot = taken_at
+        logger.info("Snapshot written to %s", path)
+
+        snapshots = sorted(entry for entry in os.listdir(self.snapshot_dir) if _is_snapshot(entry))
+        for old in snapshots[:-self.keep_snapshots]:
+            shutil.rmtree(os.path.join(self.snapshot_dir, old), ignore_errors=True)
+        return path
+
+    def _retention_chunks(self) -> Generator[None, None, int]:
+        """the retention step, live events first, then yields after each archived day"""
+        day = date.today() - timedelta(days=self.retain_days)
+        self.db.drop_live_detail_before(day)
+        yield
+        archived = self.db.archived_days_before(day)
+        for archived_day in archived:
+            self.db.drop_archived_day(archived_day)
+            yield
+        if archived:
+            logger.info("Retention removed %d archived days of puff detail", len(archived))
+        return len(archived)
+
+    def _checkpoint_chunks(self) -> Generator[None, None, None]:
+        # a single statement, there is nothing to split
+        self.db.checkpoint()
+        yield
+
+    def _wait_for_headroom(self) -> bool:
+        """block until a probe window is within budget, False if the service is stopping"""
+        deadline = time.monotonic() + self.max_defer
+        while True:
+            before = METRICS.bucket_counts(self.family)
+            if self._stop.wait(self.probe):
+                return False
+            p99 = self._p99_since(before)
+            if p99 is None or p99 <= self.p99_budget:
+                return True
+            if time.monotonic() >= deadline:
+                logger.warning("p99 has been over %gs for %gs, running maintenance anyway",
+                               self.p99_budget, self.max_defer)
+                return True
+            self.deferrals += 1
+
+    def _p99_since(self, before: List[int]) -> Optional[float]:
+        window = [now - then for now, then in zip(METRICS.bucket_counts(self.family), before)]
+        return bucket_quantile(DEFAULT_BUCKETS, window, 0.99)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.run_once()
+            except Exception:
+                self.failures += 1
+                logger.exception("Maintenance run failed")
+
+
+def _drain(chunks: Generator[Any, None, Any]) -> Any:
+    """run a chunked step to the end, returns its result"""
+    while True:
+        try:
+            next(chunks)
+        except StopIteration as done:
+            return done.value
+
+
+def _is_snapshot(name: str) -> bool:
+    try:
+        datetime.strptime(name, SNAPSHOT_FORMAT)
+    except ValueError:
+        return False
+    return True
@@ -0,0 +1,233 @@
+import asyncio
+import functools
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# seconds, prometheus style upper bounds, +Inf is implied
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """fixed-bucket latency histogram with an error counter.
+
+    observing is a bisect and a few integer adds, nothing is allocated, so it
+    is cheap enough for every handler call and query.
+    """
+    __slots__ = ("buckets", "counts", "count", "errors", "total")
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if error:
+            self.errors += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """upper bound of the bucket holding the q-th observation"""
+        return bucket_quantile(self.buckets, self.counts, q)
+
+
+def bucket_quantile(buckets: Tuple[float, ...], counts: List[int], q: float) -> Optional[float]:
+    """upper bound of the bucket holding the q-th observation, None when there are none"""
+    total = sum(counts)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for bound, n in zip(buckets, counts):
+        seen += n
+        if seen >= rank:
+            return bound
+    return float("inf")
+
+
+class Metrics:
+    """registry of latency histograms and callback gauges, rendered as prometheus text"""
+
+    def __init__(self, prefix: str = "vapebot"):
+        self.prefix = prefix
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._gauges: Dict[Tuple[str, str], Callable[[], float]] = {}
+
+    def histogram(self, family: str, name: str) -> Histogram:
+        key = (family, name)
+        hist = self._histograms.get(key)
+        if hist is None:
+            hist = self._histograms[key] = Histogram()
+        return hist
+
+    def bucket_counts(self, family: str) -> List[int]:
+        """bucket counts summed over a family's histograms, diff two reads for a recent window"""
+        counts = [0] * (len(DEFAULT_BUCKETS) + 1)
+        for (fam, _), h in list(self._histograms.items()):
+            if fam == family and h.buckets == DEFAULT_BUCKETS:
+                counts = [a + b for a, b in zip(counts, h.counts)]
+        return counts
+
+    def count_error(self, family: str, name: str) -> None:
+        """for errors a function handles itself, so the decorator never sees them"""
+        self.histogram(family, name).errors += 1
+
+    def gauge(self, family: str, name: str, read: Callable[[], float]) -> None:
+        """register a value that is read when metrics are rendered"""
+        self._gauges[(family, name)] = read
+
+    def timed(self, family: str, name: Optional[str] = None) -> Callable:
+        """decorator recording latency and errors of a sync or async function"""
+        def decorate(fn: Callable) -> Callable:
+            hist = self.histogram(family, name or fn.__name__)
+
+            if inspect.iscoroutinefunction(fn):
+                @functools.wraps(fn)
+                async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+                    start = time.perf_counter()
+                    try:
+                        result = await fn(*args, **kwargs)
+                    except BaseException:
+                        hist.observe(time.perf_counter() - start, error=True)
+                        raise
+                    hist.observe(time.perf_counter() - start)
+                    return result
+                return async_wrapper
+
+            @functools.wraps(fn)
+            def wrapper(*args: Any, **kwargs: Any) -> Any:
+                start = time.perf_counter()
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException:
+                    hist.observe(time.perf_counter() - start, error=True)
+                    raise
+                hist.observe(time.perf_counter() - start)
+                return result
+            return wrapper
+        return decorate
+
+    def snapshot(self) -> Dict[str, Any]:
+        """plain dict view used by /stats"""
+        latencies = {
+            f"{family}:{name}": {
+                "count": h.count,
+                "errors": h.errors,
+                "p50": h.quantile(0.5),
+                "p99": h.quantile(0.99),
+            }
+            for (family, name), h in sorted(self._histograms.items())
+            if h.count
+        }
+        gauges = {f"{family}:{name}": self._read(read) for (family, name), read in sorted(self._gauges.items())}
+        return {"latency": latencies, "gauges": gauges}
+
+    def render(self) -> str:
+        """prometheus text exposition format"""
+        lines: List[str] = []
+        families = sorted({family for family, _ in self._histograms})
+        for family in families:
+            metric = f"{self.prefix}_{family}_seconds"
+            lines.append(f"# TYPE {metric} histogram")
+            for (fam, name), h in sorted(self._histograms.items()):
+                if fam != family:
+                    continue
+                cumulative = 0
+                for bound, n in zip(h.buckets, h.counts):
+                    cumulative += n
+                    lines.append(f'{metric}_bucket{{name="{name}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{name="{name}",le="+Inf"}} {h.count}')
+                lines.append(f'{metric}_sum{{name="{name}"}} {h.total}')
+                lines.append(f'{metric}_count{{name="{name}"}} {h.count}')
+            errors = f"{self.prefix}_{family}_errors_total"
+            lines.append(f"# TYPE {errors} counter")
+            for (fam, name), h in sorted(self._histograms.items()):
+                if fam == family:
+                    lines.append(f'{errors}{{name="{name}"}} {h.errors}')
+
+        for family in sorted({family for family, _ in self._gauges}):
+            metric = f"{self.prefix}_{family}"
+            lines.append(f"# TYPE {metric} gauge")
+            for (fam, name), read in sorted(self._gauges.items()):
+                if fam == family:
+                    lines.append(f'{metric}{{name="{name}"}} {self._read(read)}')
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _read(read: Callable[[], float]) -> float:
+        try:
+            return read()
+        except Exception:
+            return float("nan")
+
+
+# process wide registry, modules decorate against this
+METRICS = Metrics()
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that times every outbound bot api call (reply_text is sendMessage)"""
+
+    async def do_request(self, url: str, method: str, *args: Any, **kwargs: Any) -> Tuple[int, bytes]:
+        hist = METRICS.histogram("telegram", url.rsplit("/", 1)[-1])
+        start = time.perf_counter()
+        try:
+            status, body = await super().do_request(url, method, *args, **kwargs)
+        except BaseException:
+            hist.observe(time.perf_counter() - start, error=True)
+            raise
+        hist.observe(time.perf_counter() - start, error=status >= 400)
+        return status, body
+
+
+class MetricsServer:
+    """serves GET /metrics in prometheus text format"""
+
+    def __init__(self, metrics: Metrics = METRICS, listen: str = "0.0.0.0", port: int = 9100):
+        self.metrics = metrics
+        self.listen = listen
+        self.port = port
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.listen, self.port)
+        logger.info("Metrics on http://%s:%d/metrics", self.listen, self.port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5.0)
+            while (await asyncio.wait_for(reader.readline(), 5.0)) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                body = self.metrics.render().encode()
+                status = "200 OK"
+            else:
+                body, status = b"", "404 Not Found"
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                f"Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                f"Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
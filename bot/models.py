@@ -1,11 +1,14 @@
-from dataclasses import dataclass, field, asdict
-from typing import Callable, Optional, List, Dict, Any, TypeVar
-from datetime import datetime
+import asyncio
+from dataclasses import dataclass, field, asdict, fields, replace
+from types import MappingProxyType
+from typing import Callable, Mapping, Optional, Dict, Any, Tuple, TypeVar
+from datetime import date, datetime
 from telegram import MessageEntity
 import re
+from .cache import LRUCache
 
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class UserProfile:
     """Pure data representation of a user"""
     user_id: int
@@ -15,7 +18,7 @@ class UserProfile:
     username: Optional[str] = None
     language_code: Optional[str] = None
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class ChatContext:
     """Pure data representation of chat context"""
     chat_id: int
@@ -25,57 +28,136 @@ class ChatContext:
     chat_first_name: Optional[str] = None
     chat_is_forum: Optional[bool] = None
 
-@dataclass
+@dataclass(frozen=True, slots=True)
 class MessageMetadata:
     """Pure data representation of message metadata"""
     message_id: Optional[int] = None
     reply: Optional[str] = None
     timestamp: Optional[datetime] = None
-    entities: Optional[List[MessageEntity]] = None
+    entities: Optional[Tuple[MessageEntity, ...]] = None
     is_reply: Optional[bool] = None
     reply_to_message_id: Optional[int] = None
 
-@dataclass
 class SessionData:
-    """telegram session data, this likely needs"""
-    user: UserProfile
-    chat: ChatContext
-    message: MessageMetadata
-    created_at: datetime = field(default_factory=datetime.now)
-    
+    """telegram session data, read lazily from the update.
+
+    the profile, chat and message views are only built the first time they are
+    used, and uid/cid/uname go straight to the update without building them.
+    `extractor` is the TelegramExtractor that knows how to build each view.
+    """
+    __slots__ = ("update", "created_at", "_extractor", "_user", "_chat", "_message")
+
+    def __init__(self, update: Any, extractor: Any) -> None:
+        self.update = update
+        self.created_at = datetime.now()
+        self._extractor = extractor
+        self._user: Optional[UserProfile] = None
+        self._chat: Optional[ChatContext] = None
+        self._message: Optional[MessageMetadata] = None
+
+    @property
+    def user(self) -> UserProfile:
+        if self._user is None:
+            self._user = self._extractor.extract_user(self.update)
+        return self._user
+
+    @property
+    def chat(self) -> ChatContext:
+        if self._chat is None:
+            self._chat = self._extractor.extract_chat(self.update)
+        return self._chat
+
+    @property
+    def message(self) -> MessageMetadata:
+        if self._message is None:
+            self._message = self._extractor.extract_message(self.update)
+        return self._message
+
     @property
     def uid(self) -> int:
-        return self.user.user_id
+        return self.update.effective_user.id
     
     @property
     def cid(self) -> int:
-        return self.chat.chat_id
+        return self.update.effective_chat.id
     
     @property
     def uname(self) -> str:
-        return self.user.username if self.user.username else self.user.first_name
+        user = self.update.effective_user
+        return user.username if user.username else user.first_name
     
     @property
     def reply_text(self) -> Optional[str]:
         return self.message.reply
+
+    @property
+    def log_context(self) -> Dict[str, Any]:
+        """ids for `logger.x(..., extra=session.log_context)`, safe on partial updates"""
+        up = self.update
+        return {
+            "user_id": up.effective_user.id if up.effective_user else None,
+            "chat_id": up.effective_chat.id if up.effective_chat else None,
+            "update_id": up.update_id,
+        }
     
+    # defined last, the name shadows the datetime class inside this class body
     @property
     def datetime(self) -> Optional[datetime]:
         return self.message.timestamp
     
-@dataclass
+@dataclass(slots=True)
 class SetupData:
     user_id: int
     tokes: Optional[int] = None
-    strength: Optional[str] = None
+    strength: Optional[int] = None
     method: Optional[str] = None
     reduce_amount: Optional[int] = None
     reduce_percent: Optional[float] = None
     created_at: datetime = field(default_factory=datetime.now)
     updated_at: datetime = field(default_factory=datetime.now)
 
+@dataclass(frozen=True, slots=True)
+class PuffEvent:
+    """a single logged puff"""
+    user_id: int
+    ts: datetime = field(default_factory=datetime.now)
+    strength: Optional[int] = None
+
+@dataclass(frozen=True, slots=True)
+class DailyProgress:
+    """puffs logged in a day or week against the target for that period"""
+    user_id: int
+    period: date
+    puffs: int = 0
+    nicotine_mg: float = 0.0
+    target: Optional[int] = None
+
+    @property
+    def remaining(self) -> Optional[int]:
+        return None if self.target is None else self.target - self.puffs
+
+    @property
+    def percent_of_target(self) -> Optional[float]:
+        if not self.target:
+            return None
+        return round(self.puffs / self.target * 100, 2)
+
 class DataParser:
-    """utility class for parsing and validating dtypes."""
+    """utility class for parsing and validating dtypes.
+
+    patterns are compiled once and field types dispatch through TYPE_PARSERS.
+    an instance compiles the parser of every field of `model` up front, so
+    parsing a field is one dict lookup and one call.
+    """
+    INT_PATTERN = r'-?\d+'  # allow negative numbers
+    FLOAT_PATTERN = r'-?\d+(\.\d+)?'
+    INT_RE = re.compile(INT_PATTERN)
+    FLOAT_RE = re.compile(FLOAT_PATTERN)
+
+    def __init__(self, model: type = SetupData):
+        self.model = model
+        self.fields = self.compile(model)
+
     @staticmethod
     def to_int(value: Any) -> int:
         """parse integers from strings, floats, or other types."""
@@ -86,7 +168,10 @@ class DataParser:
         if isinstance(value, float):
             return int(round(value))
         if isinstance(value, str):
-            match = re.search(r'-?\d+', value)  # allow negative numbers
+            # plain digits skip the regex, same result
+            if value.isdecimal():
+                return int(value)
+            match = DataParser.INT_RE.search(value)
             if match:
                 return int(match.group())
             raise ValueError(f"No integer found in string '{value}'")
@@ -102,7 +187,8 @@ class DataParser:
         if isinstance(value, int):
             return float(value)
         if isinstance(value, str):
-            match = re.search(r'-?\d+(\.\d+)?', value.replace(',', ''))
+            text = value.replace(',', '') if ',' in value else value
+            match = DataParser.FLOAT_RE.search(text)
             if match:
                 return float(match.group())
             raise ValueError(f"No float found in string '{value}'")
@@ -126,23 +212,82 @@ class DataParser:
             except ValueError:
                 raise ValueError(f"Cannot parse datetime from string '{value}'")
         raise ValueError(f"Cannot convert {type(value)} to datetime")
-    
+
+    # field type -> parser, types not listed pass values through. the plain
+    # functions, not the staticmethod wrappers, so a call skips the descriptor
+    TYPE_PARSERS: Dict[Any, Callable[[Any], Any]] = {
+        int: to_int.__func__,
+        Optional[int]: to_int.__func__,
+        float: to_float.__func__,
+        Optional[float]: to_float.__func__,
+        str: to_str.__func__,
+        Optional[str]: to_str.__func__,
+        datetime: to_datetime.__func__,
+        Optional[datetime]: to_datetime.__func__,
+    }
+
+    # field type -> the same rule as its TYPE_PARSERS entry as a duckdb expression over {column}, NULL when invalid.
+    # text is searched like the str branch, numbers are cast like the int/float branches, so
+    # 2.7 from a json file rounds to 3 (half to even, as python's round) where "2.7" reads as 2
+    SQL_RULES: Dict[Any, str] = {
+        int: (
+            f"CASE WHEN typeof({{column}}) = 'VARCHAR'"
+            f" THEN TRY_CAST(NULLIF(regexp_extract(CAST({{column}} AS VARCHAR), '{INT_PATTERN}'), '') AS INTEGER)"
+            f" ELSE TRY_CAST(round_even(TRY_CAST({{column}} AS DOUBLE), 0) AS INTEGER) END"
+        ),
+        float: (
+            f"CASE WHEN typeof({{column}}) = 'VARCHAR'"
+            f" THEN TRY_CAST(NULLIF(regexp_extract(replace(CAST({{column}} AS VARCHAR), ',', ''),"
+            f" '{FLOAT_PATTERN}'), '') AS DOUBLE)"
+            f" ELSE TRY_CAST({{column}} AS DOUBLE) END"
+        ),
+        str: "trim(CAST({column} AS VARCHAR))",
+        datetime: "TRY_CAST({column} AS TIMESTAMP)",
+    }
+    SQL_RULES.update({Optional[t]: rule for t, rule in SQL_RULES.items()})
+
+    # model class -> its compiled field parsers, models are few and never change
+    _compiled: Dict[type, Mapping[str, Callable[[Any], Any]]] = {}
+
+    @classmethod
+    def compile(cls, model: type) -> Mapping[str, Callable[[Any], Any]]:
+        """parser for every typed field of a dataclass, built on first use and shared"""
+        compiled = cls._compiled.get(model)
+        if compiled is None:
+            compiled = cls._compiled[model] = MappingProxyType({
+                f.name: cls.TYPE_PARSERS[f.type] for f in fields(model) if f.type in cls.TYPE_PARSERS
+            })
+        return compiled
+
+    def parse(self, field_name: str, value: Any) -> Any:
+        """parse one value for a field of the model"""
+        parser = self.fields.get(field_name)
+        if parser is None:
+            return value
+        try:
+            return parser(value)
+        except ValueError as e:
+            raise ValueError(f"Error parsing {field_name}: {str(e)}")
+
     @classmethod
     def enforce_type(cls, field_type: type, value: Any, field_name: str) -> Any:
         """Dispatch to correct type parser"""
-        try:
-            if field_type in (int, Optional[int]):
-                return cls.to_int(value)
-            if field_type in (float, Optional[float]):
-                return cls.to_float(value)
-            if field_type in (str, Optional[str]):
-                return cls.to_str(value)
-            if field_type in (datetime, Optional[datetime]):
-                return cls.to_datetime(value)
+        parser = cls.TYPE_PARSERS.get(field_type)
+        if parser is None:
             return value
+        try:
+            return parser(value)
         except ValueError as e:
             raise ValueError(f"Error parsing {field_name}: {str(e)}")
 
+    @classmethod
+    def sql_rule(cls, field_type: type, column: str) -> str:
+        """the same rule as enforce_type as a duckdb expression over a whole column, NULL when invalid"""
+        rule = cls.SQL_RULES.get(field_type)
+        if rule is None:
+            return column
+        return rule.format(column=column)
+
 class ModelManager:
     """base class for model management operations"""
 
@@ -156,11 +301,11 @@ class ModelManager:
         post_update_hook: Callable[[T], None] = None
     ) -> T:
         """generic field updater for any model instance"""
-        parser = field_parsers.get(field, lambda x: x)
+        parser = field_parsers.get(field)
         
         try:
-            # parse and set value
-            parsed_value = parser(value)
+            # parse and set value, fields without a parser take the value as is
+            parsed_value = parser(value) if parser is not None else value
             setattr(model_instance, field, parsed_value)
 
             # update timestamp
@@ -177,22 +322,23 @@ class ModelManager:
             raise ValueError(f"Error updating field '{field}': {e}")
 
 class SetupManager:
-    def __init__(self):
-        self.setups: Dict[int, SetupData] = {}
-        self.parser = DataParser()
+    def __init__(
+        self,
+        load: Optional[Callable[[int], Optional[SetupData]]] = None,
+        max_entries: int = 10_000,
+        ttl: Optional[float] = 3600.0,
+    ):
+        # bounded cache of saved setups only, "no setup" included. /setup edits a
+        # draft and nothing reaches user_setups until it finishes, so there is no write-back
+        self.setups: LRUCache[int, SetupData] = LRUCache(max_entries, ttl)
+        self._load = load
+        self.parser = DataParser(SetupData)
         self.goal_field_map = {
             "number": "reduce_amount",
             "percent": "reduce_percent"
         }
-        self.field_parsers = {
-            "tokes": self.parser.to_int,
-            "strength": self.parser.to_int,
-            "method": self.parser.to_str,
-            "reduce_amount": self.parser.to_int,
-            "reduce_percent": self.parser.to_float,
-            'created_at': lambda v: v if isinstance(v, datetime) else datetime.fromisoformat(v),
-            'updated_at': lambda v: v if isinstance(v, datetime) else datetime.fromisoformat(v)
-        }
+        # compiled once per model from SetupData's field types, shared by every manager
+        self.field_parsers = self.parser.fields
 
     def __calc_metric__(self, numerator: float, denominator: float, to_amount: bool = False) -> Optional[float]:
         """calculate either percentage or absolute amount"""
@@ -208,35 +354,57 @@ class SetupManager:
             elif setup.method == "percent" and setup.reduce_percent is not None:
                 setup.reduce_amount = int(self.__calc_metric__(setup.reduce_percent, setup.tokes, to_amount=True))
 
-    def get_setup(self, user_id: int) -> SetupData:
-        if user_id not in self.setups:
-            self.setups[user_id] = SetupData(user_id=user_id)
-        return self.setups[user_id]
+    async def get_setup(self, user_id: int) -> Optional[SetupData]:
+        """the user's saved setup, None when they have not finished /setup yet.
+
+        a miss is read in a thread so the event loop never waits on the db
+        """
+        found, setup = self.setups.lookup(user_id)
+        if found or self._load is None:
+            return setup
+        setup = await asyncio.to_thread(self._load, user_id)
+        if user_id in self.setups:
+            # saved while we were reading, that one is newer
+            return self.setups.get(user_id)
+        self.setups.put(user_id, setup)
+        return setup
+
+    async def draft(self, user_id: int) -> SetupData:
+        """a private copy of the saved setup (or a blank one) for /setup to fill in"""
+        saved = await self.get_setup(user_id)
+        return replace(saved) if saved is not None else SetupData(user_id=user_id)
+
+    def saved(self, setup: SetupData) -> None:
+        """a finished draft has been queued for the db, it is the user's setup from now on"""
+        self.setups.put(setup.user_id, setup)
+
+    @property
+    def cache_stats(self) -> Dict[str, int]:
+        return self.setups.stats
+
+    def update_setup_field(self, setup: SetupData, field: str, value: Any) -> SetupData:
+        """update a field of a draft using ModelManager"""
 
-    def update_setup_field(self, user_id: int, field: str, value: Any) -> SetupData:
-        """update a setup field using ModelManager"""
-        setup = self.get_setup(user_id)
-        
         # handle goal mapping
         if field == "goal":
             if not setup.method:
                 raise ValueError("Method must be set before setting a goal.")
             field = self.goal_field_map[setup.method]
         
-        return ModelManager.update_model_field(
+        updated = ModelManager.update_model_field(
             model_instance=setup,
             field=field,
             value=value,
             field_parsers=self.field_parsers,
             post_update_hook=self._recalculate_metrics
         )
+        return updated
 
-    def to_dict(self, user_id: int) -> dict:
-        return asdict(self.get_setup(user_id))
+    def to_dict(self, setup: SetupData) -> dict:
+        return asdict(setup)
 
-    def summary(self, user_id: int) -> str:
+    def summary(self, setup: SetupData) -> str:
         """format a summary for user confirmation with units"""
-        setup = self.get_setup(user_id)
         return (
             f"Tokes: {setup.tokes if setup.tokes is not None else 'Not set'} puffs\n"
             f"Strength: {str(setup.strength) + 'mg' if setup.strength is not None else 'Not set'}\n"
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Dict, Optional
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """runs updates from different users concurrently, each user's strictly in order.
+
+    the per-user lock is taken before a worker slot, so a user with a backlog
+    waits without holding one of the `max_concurrent_updates` slots. once a user
+    has `max_pending_per_user` updates waiting, further ones are dropped.
+    """
+
+    def __init__(self, max_concurrent_updates: int = 32, max_pending_per_user: int = 20):
+        super().__init__(max_concurrent_updates)
+        self.max_pending_per_user = max_pending_per_user
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._pending: Dict[int, int] = {}
+        self.dropped = 0
+
+    @staticmethod
+    def _key(update: object) -> Optional[int]:
+        if not isinstance(update, Update):
+            return None
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        return None
+
+    @property
+    def pending(self) -> int:
+        return sum(self._pending.values())
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._key(update)
+        if key is None:
+            await super().process_update(update, coroutine)
+            return
+
+        if self._pending.get(key, 0) >= self.max_pending_per_user:
+            self.dropped += 1
+            coroutine.close()
+            logger.warning("Dropped update for user %s, %d already waiting", key, self.max_pending_per_user)
+            return
+
+        self._pending[key] = self._pending.get(key, 0) + 1
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        finally:
+            # forget idle users so the maps only hold users with work in flight
+            self._pending[key] -= 1
+            if not self._pending[key]:
+                del self._pending[key]
+                del self._locks[key]
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
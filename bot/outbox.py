@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter
+
+from .metrics import METRICS
+from .ratelimit import TokenBucket, retry_after_seconds
+
+logger = logging.getLogger(__name__)
+
+# telegram's limits: about 30 messages a second overall, 1 a second per chat
+DEFAULT_RATE = 25.0
+DEFAULT_CHAT_RATE = 1.0
+
+# longest text a single sendMessage accepts
+MAX_MESSAGE_LENGTH = 4096
+
+
+@dataclass(slots=True)
+class _Outgoing:
+    chat_id: int
+    text: str
+    options: Dict[str, Any]
+    futures: List["asyncio.Future[Any]"]
+    queued_at: float = field(default_factory=time.perf_counter)
+    attempts: int = 0
+    # sends something other than text (a photo, a document), called once per attempt
+    call: Optional[Callable[[], Awaitable[Any]]] = None
+
+    def absorb(self, other: "_Outgoing") -> bool:
+        """merge a later message into this one when telegram would show the same thing"""
+        if self.call is not None or other.call is not None:
+            return False
+        # a keyboard, or its removal, belongs to the text it was sent with
+        if "reply_markup" in self.options or "reply_markup" in other.options:
+            return False
+        if len(self.text) + 2 + len(other.text) > MAX_MESSAGE_LENGTH:
+            return False
+        if self.options != other.options:
+            return False
+        self.text = f"{self.text}\n\n{other.text}"
+        self.futures.extend(other.futures)
+        self.queued_at = min(self.queued_at, other.queued_at)
+        self.attempts = max(self.attempts, other.attempts)
+        return True
+
+
+class Outbox:
+    """queued outbound text messages, rate limited per chat and overall.
+
+    `send` returns straight away with a future for the sent Message, handlers
+    can await it or leave it. each chat has its own pending deque and token
+    bucket, and consecutive pending messages to a chat go out as one send
+    (joined by a blank line) when their options allow it. a 429 pauses the
+    shared bucket for retry_after and puts the messages back at the head of
+    their chat, so handlers never sit through the wait.
+    """
+
+    def __init__(
+        self,
+        send: Callable[..., Awaitable[Any]],
+        rate: float = DEFAULT_RATE,
+        chat_rate: float = DEFAULT_CHAT_RATE,
+        chat_burst: float = 3.0,
+        workers: int = 8,
+        max_attempts: int = 5,
+        backoff: float = 0.5,
+    ):
+        self._send = send
+        self.bucket = TokenBucket(rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._pending: Dict[int, Deque[_Outgoing]] = {}
+        self._chat_buckets: Dict[int, TokenBucket] = {}
+        # chats that are queued on _ready, waiting on a timer or being sent to right now
+        self._scheduled: Set[int] = set()
+        self._ready: "asyncio.Queue[int]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self.queued = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.failed = 0
+        METRICS.gauge("queue_depth", "outbox", lambda: self.queued)
+        METRICS.gauge("outbox", "coalesced", lambda: self.coalesced)
+        METRICS.gauge("outbox", "failed", lambda: self.failed)
+
+    def send(self, chat_id: int, text: str, **options: Any) -> "asyncio.Future[Any]":
+        """queue a text message, the future resolves to the sent Message"""
+        return self._queue(_Outgoing(chat_id, text, options, []))
+
+    def submit(self, chat_id: int, call: Callable[[], Awaitable[Any]]) -> "asyncio.Future[Any]":
+        """queue any other bot call for the chat, it goes out after the chat's pending messages.
+
+        `call` runs once per attempt, so it has to build its upload afresh each time.
+        """
+        return self._queue(_Outgoing(chat_id, "", {}, [], call=call))
+
+    def _queue(self, message: _Outgoing) -> "asyncio.Future[Any]":
+        future = asyncio.get_running_loop().create_future()
+        message.futures.append(future)
+        chat_id = message.chat_id
+        self._pending.setdefault(chat_id, deque()).append(message)
+        self.queued += 1
+        if chat_id not in self._scheduled:
+            self._scheduled.add(chat_id)
+            self._ready.put_nowait(chat_id)
+        return future
+
+    async def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """give queued messages up to `timeout` seconds to go out, then stop the workers"""
+        deadline = time.monotonic() + timeout
+        while self.queued and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self.queued:
+            logger.warning("Outbox stopped with %d messages unsent", self.queued)
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            chat_id = await self._ready.get()
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            if not bucket.try_acquire():
+                # come back when the chat may send again, the worker moves on meanwhile
+                loop.call_later(bucket.delay(), self._ready.put_nowait, chat_id)
+                continue
+
+            await self.bucket.acquire()
+            message = self._take(chat_id)
+            retry_in = await self._deliver(message)
+            if retry_in is not None:
+                self._pending.setdefault(chat_id, deque()).appendleft(message)
+                loop.call_later(retry_in, self._ready.put_nowait, chat_id)
+            elif self._pending.get(chat_id):
+                self._ready.put_nowait(chat_id)
+            else:
+                self._pending.pop(chat_id, None)
+                self._scheduled.discard(chat_id)
+                loop.call_later(self.chat_burst / self.chat_rate, self._prune, chat_id)
+
+    def _take(self, chat_id: int) -> _Outgoing:
+        """the head message with every following message that can ride along"""
+        pending = self._pending[chat_id]
+        message = pending.popleft()
+        while pending and message.absorb(pending[0]):
+            pending.popleft()
+            self.coalesced += 1
+        return message
+
+    async def _deliver(self, message: _Outgoing) -> Any:
+        """send once, returns seconds until a retry or None when the message is done with"""
+        count = len(message.futures)
+        try:
+            if message.call is not None:
+                result = await message.call()
+            else:
+                result = await self._send(message.chat_id, message.text, **message.options)
+        except RetryAfter as e:
+            # telegram throttles the bot as a whole, so every chat waits
+            wait = retry_after_seconds(e)
+            self.bucket.pause(wait)
+            return self._retry(message, e, wait)
+        except (Forbidden, BadRequest) as e:
+            self._fail(message, e)
+            return None
+        except NetworkError as e:
+            return self._retry(message, e, self.backoff * 2 ** message.attempts * (1 + random.random()))
+        except Exception as e:
+            self._fail(message, e)
+            return None
+
+        self.queued -= count
+        self.sent += 1
+        METRICS.histogram("outbox", "delivery").observe(time.perf_counter() - message.queued_at)
+        for future in message.futures:
+            if not future.done():
+                future.set_result(result)
+        return None
+
+    def _retry(self, message: _Outgoing, error: Exception, wait: float) -> Any:
+        message.attempts += 1
+        if message.attempts >= self.max_attempts:
+            self._fail(message, error)
+            return None
+        return wait
+
+    def _fail(self, message: _Outgoing, error: Exception) -> None:
+        self.queued -= len(message.futures)
+        self.failed += 1
+        METRICS.count_error("outbox", "delivery")
+        logger.warning("Dropped message to chat %s after %d attempts: %s", message.chat_id, message.attempts + 1,
+                       error, extra={"chat_id": message.chat_id})
+        for future in message.futures:
+            if not future.done():
+                future.set_exception(error)
+                # already logged, callers that never await it should not get a second warning
+                future.exception()
+
+    def _prune(self, chat_id: int) -> None:
+        """forget the bucket of a chat that went quiet"""
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is not None and chat_id not in self._scheduled and bucket.idle():
+            del self._chat_buckets[chat_id]
@@ -0,0 +1,176 @@
+import asyncio
+import json
+import pickle
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from .cache import LRUCache
+from .data_transfer import DuckDBManager
+
+
+class DuckDBPersistence(BasePersistence[Dict[Any, Any], Dict[Any, Any], Dict[Any, Any]]):
+    """python-telegram-bot persistence on top of DuckDBManager.
+
+    updates from the application only mark entries dirty (last value wins per
+    key, pickled on the spot so later mutation can't leak in). the writer thread
+    flushes all dirty entries in one transaction every `flush_interval` seconds
+    and on `flush()` at shutdown. when that transaction fails the entries are
+    put back, under anything marked dirty since, and go out with the next flush.
+
+    conversations are loaded at startup, only users in the middle of one have a
+    row. user_data and chat_data start empty and are read per user/chat the
+    first time an update from them arrives (refresh_user_data/refresh_chat_data).
+    the last `max_loaded` users and chats are remembered as loaded, one that
+    drops out is read again on its next update, in-memory values still winning.
+    """
+
+    def __init__(
+        self,
+        db: DuckDBManager,
+        flush_interval: float = 5.0,
+        update_interval: float = 1.0,
+        max_loaded: int = 100_000,
+    ):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=True, chat_data=True, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.db = db
+        self._lock = threading.Lock()
+        self._dirty_users: Dict[int, Optional[bytes]] = {}
+        self._dirty_chats: Dict[int, Optional[bytes]] = {}
+        self._dirty_conversations: Dict[Tuple[str, str], Optional[bytes]] = {}
+        self._dirty_bot: Optional[bytes] = None
+        # what the last flush took out of the dirty entries, put back by _restore if it is rolled back
+        self._flushing: Tuple[Dict, Dict, Dict, Optional[bytes]] = ({}, {}, {}, None)
+        self._loaded_users: LRUCache[int, bool] = LRUCache(max_loaded, ttl=None)
+        self._loaded_chats: LRUCache[int, bool] = LRUCache(max_loaded, ttl=None)
+        db.writer.every(flush_interval, self._flush, on_failure=self._restore)
+
+    # loading
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        rows = await asyncio.to_thread(self._fetch, "SELECT data FROM ptb_bot_data WHERE id = 1", [])
+        return pickle.loads(rows[0][0]) if rows else {}
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[int, ...], object]:
+        rows = await asyncio.to_thread(self._fetch, "SELECT key, state FROM ptb_conversations WHERE name = ?", [name])
+        return {tuple(json.loads(key)): pickle.loads(state) for key, state in rows}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        if self._loaded_users.lookup(user_id)[0] or self._pending(user_id, 0):
+            return
+        self._loaded_users.put(user_id, True)
+        rows = await asyncio.to_thread(self._fetch, "SELECT data FROM ptb_user_data WHERE user_id = ?", [user_id])
+        if rows:
+            # anything set before the load finished wins over the stored copy
+            user_data.update({**pickle.loads(rows[0][0]), **user_data})
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        if self._loaded_chats.lookup(chat_id)[0] or self._pending(chat_id, 1):
+            return
+        self._loaded_chats.put(chat_id, True)
+        rows = await asyncio.to_thread(self._fetch, "SELECT data FROM ptb_chat_data WHERE chat_id = ?", [chat_id])
+        if rows:
+            chat_data.update({**pickle.loads(rows[0][0]), **chat_data})
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    def _pending(self, key: int, table: int) -> bool:
+        """an unwritten copy exists, so memory is newer than the row and must not be merged with it"""
+        with self._lock:
+            return key in (self._dirty_users, self._dirty_chats)[table] or key in self._flushing[table]
+
+    # marking dirty
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        with self._lock:
+            self._dirty_users[user_id] = pickle.dumps(data)
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        with self._lock:
+            self._dirty_chats[chat_id] = pickle.dumps(data)
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        with self._lock:
+            self._dirty_bot = pickle.dumps(data)
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+    async def update_conversation(self, name: str, key: Tuple[int, ...], new_state: Optional[object]) -> None:
+        # a finished conversation is deleted rather than stored, so the table only holds live ones
+        with self._lock:
+            self._dirty_conversations[(name, json.dumps(list(key)))] = (
+                None if new_state is None else pickle.dumps(new_state)
+            )
+
+    async def drop_user_data(self, user_id: int) -> None:
+        with self._lock:
+            self._dirty_users[user_id] = None
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        with self._lock:
+            self._dirty_chats[chat_id] = None
+
+    async def flush(self) -> None:
+        await self.db.writer.call_async(self._flush, on_failure=self._restore)
+
+    # writing, runs on the writer thread
+
+    def _flush(self, conn: Any) -> int:
+        with self._lock:
+            users, self._dirty_users = self._dirty_users, {}
+            chats, self._dirty_chats = self._dirty_chats, {}
+            conversations, self._dirty_conversations = self._dirty_conversations, {}
+            bot, self._dirty_bot = self._dirty_bot, None
+            self._flushing = (users, chats, conversations, bot)
+
+        self._write(conn, "ptb_user_data", "user_id", users)
+        self._write(conn, "ptb_chat_data", "chat_id", chats)
+        if bot is not None:
+            conn.execute("INSERT OR REPLACE INTO ptb_bot_data VALUES (1, ?)", [bot])
+
+        stale = [list(k) for k, v in conversations.items() if v is None]
+        fresh = [(name, key, state) for (name, key), state in conversations.items() if state is not None]
+        if stale:
+            conn.executemany("DELETE FROM ptb_conversations WHERE name = ? AND key = ?", stale)
+        if fresh:
+            conn.executemany("INSERT OR REPLACE INTO ptb_conversations VALUES (?, ?, ?)", fresh)
+        return len(users) + len(chats) + len(conversations) + (bot is not None)
+
+    def _restore(self) -> None:
+        """the flush was rolled back, its entries are dirty again unless marked dirty since"""
+        users, chats, conversations, bot = self._flushing
+        with self._lock:
+            self._dirty_users = {**users, **self._dirty_users}
+            self._dirty_chats = {**chats, **self._dirty_chats}
+            self._dirty_conversations = {**conversations, **self._dirty_conversations}
+            if self._dirty_bot is None:
+                self._dirty_bot = bot
+            self._flushing = ({}, {}, {}, None)
+
+    @staticmethod
+    def _write(conn: Any, table: str, key: str, dirty: Dict[int, Optional[bytes]]) -> None:
+        dropped = [[k] for k, v in dirty.items() if v is None]
+        kept = [(k, v) for k, v in dirty.items() if v is not None]
+        if dropped:
+            conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", dropped)
+        if kept:
+            conn.executemany(f"INSERT OR REPLACE INTO {table} VALUES (?, ?)", kept)
+
+    def _fetch(self, sql: str, params: list) -> List[tuple]:
+        with self.db.reads.cursor() as cursor:
+            return cursor.execute(sql, params).fetchall()
@@ -0,0 +1,63 @@
+import asyncio
+import time
+from datetime import timedelta
+from typing import Any, Optional
+
+
+class TokenBucket:
+    """async token bucket, `rate` tokens a second with bursts up to `capacity`.
+
+    `pause` blocks every caller until the given time has passed, used to honour
+    telegram's retry_after across all senders sharing the bucket.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+        self._blocked_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+    def try_acquire(self) -> bool:
+        """take a token if one is free right now"""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return False
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    def delay(self) -> float:
+        """seconds until a token could be taken"""
+        now = time.monotonic()
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        self._refill(now)
+        return 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+
+    async def acquire(self) -> None:
+        while not self.try_acquire():
+            await asyncio.sleep(self.delay())
+
+    def pause(self, seconds: float) -> None:
+        self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+    def idle(self) -> bool:
+        """refilled to capacity, dropping the bucket would change nothing"""
+        now = time.monotonic()
+        self._refill(now)
+        return now >= self._blocked_until and self._tokens >= self.capacity
+
+
+def retry_after_seconds(error: Any) -> float:
+    """RetryAfter.retry_after is an int on older python-telegram-bot and a timedelta on newer"""
+    value = error.retry_after
+    return value.total_seconds() if isinstance(value, timedelta) else float(value)
@@ -0,0 +1,234 @@
+import asyncio
+import heapq
+import logging
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from telegram.error import Forbidden
+
+from .data_transfer import DuckDBManager
+from .metrics import METRICS
+from .ratelimit import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# telegram allows roughly 30 messages a second per bot, keep some headroom
+DEFAULT_SEND_RATE = 25.0
+
+# a reminder `send` gave up on goes back on the heap this much later, within the same day
+RETRY_DELAY = timedelta(minutes=10)
+# sends per reminder per day, the first one included
+MAX_ATTEMPTS = 3
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _local_day(moment: datetime) -> date:
+    """the server-local date of an aware datetime, the day puff rollups file it under"""
+    return moment.astimezone().date()
+
+
+def _local_midnight(day: date) -> datetime:
+    return datetime.combine(day, time()).astimezone(timezone.utc)
+
+
+class ReminderScheduler:
+    """sends each user their daily target and progress at the minute they picked.
+
+    today's unsent reminders sit in a heap ordered by due time, loaded from the
+    reminders table at start and again at every local midnight. days are the
+    server-local dates the puff rollups use, so a reminder reports the day its
+    puffs are counted under and last_sent is on the same basis. due users go onto
+    a bounded queue drained by `workers` senders that share one token bucket, so
+    a minute where 100k users are due is spread out at `rate` per second rather
+    than bursting into 429s. `send` owns retries (the Outbox retries 429s and
+    network errors). a reminder it gives up on is put back on the heap
+    `retry_delay` later, up to `attempts` sends in all. one that still fails,
+    or whose retry would fall after midnight, is counted as failed and dropped
+    for the day. a successful send is recorded as last_sent through the writer
+    thread, and a restart reloads only users not yet sent today.
+    """
+
+    def __init__(
+        self,
+        db: DuckDBManager,
+        send: Callable[[int, str], Awaitable[object]],
+        rate: float = DEFAULT_SEND_RATE,
+        workers: int = 8,
+        now: Callable[[], datetime] = _utcnow,
+        owns: Optional[Callable[[int], bool]] = None,
+        retry_delay: timedelta = RETRY_DELAY,
+        attempts: int = MAX_ATTEMPTS,
+    ):
+        self.db = db
+        self.send = send
+        self.bucket = TokenBucket(rate)
+        self.workers = workers
+        self.now = now
+        self.owns = owns
+        self.retry_delay = retry_delay
+        self.attempts = attempts
+        self._heap: List[Tuple[datetime, int]] = []
+        self._minutes: Dict[int, int] = {}
+        self._sent: Set[int] = set()
+        # today's failed sends per user, and when a failed reminder is due again
+        self._failures: Dict[int, int] = {}
+        self._retry_at: Dict[int, datetime] = {}
+        self._day: Optional[date] = None
+        self._queue: "asyncio.Queue[int]" = asyncio.Queue(maxsize=workers * 64)
+        self._changed = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        METRICS.gauge("queue_depth", "reminders_waiting", lambda: len(self._heap))
+        METRICS.gauge("queue_depth", "reminders_sending", lambda: self._queue.qsize())
+
+    async def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._schedule())]
+        self._tasks += [asyncio.create_task(self._sender()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10.0) -> None:
+        """stop scheduling, give reminders already handed to senders `timeout` seconds to finish"""
+        if self._tasks:
+            self._tasks[0].cancel()
+            # a sender cancelled mid-send could deliver without recording last_sent
+            try:
+                await asyncio.wait_for(self._queue.join(), timeout)
+            except asyncio.TimeoutError:
+                logger.warning("Reminder senders stopped with %d reminders queued", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        # wait until every last_sent queued so far is committed
+        await self.db.sync()
+
+    def reschedule(self, user_id: int, minute_utc: Optional[int], last_sent: Optional[date] = None) -> None:
+        """reflect a changed (or removed) reminder in today's heap"""
+        if minute_utc is None:
+            self._minutes.pop(user_id, None)
+            return
+        self._minutes[user_id] = minute_utc
+        # the new time replaces a pending retry
+        self._retry_at.pop(user_id, None)
+        if last_sent is not None and last_sent == self._day:
+            self._sent.add(user_id)
+        if self._day is not None and user_id not in self._sent:
+            # moving a reminder into the past skips it until tomorrow
+            due = self._due(self._day, minute_utc)
+            if due > self.now():
+                heapq.heappush(self._heap, (due, user_id))
+                self._changed.set()
+
+    @staticmethod
+    def _due(day: date, minute_utc: int) -> datetime:
+        """the moment within local `day` when the utc clock reads minute_utc"""
+        start = _local_midnight(day)
+        due = datetime.combine(start.date(), time(minute_utc // 60, minute_utc % 60), timezone.utc)
+        return due if due >= start else due + timedelta(days=1)
+
+    async def _load(self, day: date) -> None:
+        rows = await asyncio.to_thread(self.db.reminders_due, day)
+        if self.owns is not None:
+            rows = [row for row in rows if self.owns(row[0])]
+        self._day = day
+        self._minutes = dict(rows)
+        self._sent = set()
+        self._failures = {}
+        self._retry_at = {}
+        self._heap = [(self._due(day, minute), user_id) for user_id, minute in rows]
+        heapq.heapify(self._heap)
+        logger.info("Loaded %d reminders for %s", len(self._heap), day)
+
+    async def _schedule(self) -> None:
+        await self._load(_local_day(self.now()))
+        while True:
+            now = self.now()
+            if _local_day(now) != self._day:
+                await self._load(_local_day(now))
+                continue
+
+            if self._heap and self._heap[0][0] <= now:
+                due, user_id = heapq.heappop(self._heap)
+                if self._is_current(user_id, due):
+                    await self._queue.put(user_id)
+                continue
+
+            midnight = _local_midnight(self._day + timedelta(days=1))
+            wake = min(self._heap[0][0], midnight) if self._heap else midnight
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), (wake - now).total_seconds())
+            except asyncio.TimeoutError:
+                pass
+
+    def _is_current(self, user_id: int, due: datetime) -> bool:
+        """False for entries left behind when the user moved or removed their reminder or was sent"""
+        minute = self._minutes.get(user_id)
+        if minute is None or user_id in self._sent:
+            return False
+        if user_id in self._retry_at:
+            return self._retry_at[user_id] == due
+        return self._due(self._day, minute) == due
+
+    def _retry(self, user_id: int, day: date) -> bool:
+        """put a failed reminder back on today's heap, False when it is dropped for the day"""
+        if day != self._day or user_id not in self._minutes:
+            return False
+        failures = self._failures[user_id] = self._failures.get(user_id, 0) + 1
+        due = self.now() + self.retry_delay
+        if failures >= self.attempts or _local_day(due) != day:
+            return False
+        self._retry_at[user_id] = due
+        heapq.heappush(self._heap, (due, user_id))
+        self._changed.set()
+        return True
+
+    async def _sender(self) -> None:
+        while True:
+            user_id = await self._queue.get()
+            try:
+                await self._deliver(user_id)
+            except Exception:
+                logger.exception("Reminder for %s failed", user_id, extra={"user_id": user_id})
+            finally:
+                self._queue.task_done()
+
+    async def _deliver(self, user_id: int) -> None:
+        day = self._day
+        text = await asyncio.to_thread(self._message, user_id, day)
+        await self.bucket.acquire()
+        try:
+            await self.send(user_id, text)
+        except Forbidden:
+            # the user blocked the bot, stop trying tomorrow too
+            logger.info("Reminder for %s forbidden, removing it", user_id, extra={"user_id": user_id})
+            await self.db.set_reminder(user_id, None)
+            self._minutes.pop(user_id, None)
+            return
+        except Exception as e:
+            # the sender has already retried what was worth retrying right away
+            if self._retry(user_id, day):
+                self.retried += 1
+                logger.warning("Reminder for %s failed, trying again later: %s", user_id, e, extra={"user_id": user_id})
+            else:
+                self.failed += 1
+                logger.warning("Gave up on reminder for %s today: %s", user_id, e, extra={"user_id": user_id})
+            return
+        self.sent += 1
+        self._sent.add(user_id)
+        await self.db.mark_reminder_sent(user_id, day)
+
+    def _message(self, user_id: int, day: date) -> str:
+        progress = self.db.today_vs_target(user_id, day)
+        if progress is None or progress.target is None:
+            return "Daily check in! Log puffs with /puff and run /setup to set a target."
+        return (
+            f"Daily check in!\n"
+            f"Today: {progress.puffs} of {progress.target} puffs "
+            f"({max(progress.remaining, 0)} left)\n"
+            f"Nicotine: {progress.nicotine_mg:.1f}mg"
+        )
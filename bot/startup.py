@@ -0,0 +1,56 @@
+"""--profile-startup: where cold start time goes before the first poll
+
+imports are timed one group at a time in dependency order, so each line is the
+extra cost of that group on top of everything above it. for a per-module tree
+run `python -X importtime run.py --profile-startup`.
+"""
+import importlib
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, List, Tuple
+
+IMPORT_GROUPS = [
+    ("dotenv", ["dotenv"]),
+    ("duckdb", ["duckdb"]),
+    ("telegram", ["telegram"]),
+    ("telegram.ext", ["telegram.ext"]),
+    ("bot", ["bot.app"]),
+]
+
+
+def _timed(fn: Callable[[], object]) -> float:
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def profile_startup(budget: float) -> int:
+    """print the breakdown, returns a non-zero exit code when over `budget` seconds"""
+    rows: List[Tuple[str, float]] = []
+    for label, modules in IMPORT_GROUPS:
+        rows.append((f"import {label}", _timed(lambda: [importlib.import_module(m) for m in modules])))
+
+    from bot.data_transfer import DuckDBManager
+    from telegram.ext import Application
+
+    # pandas should stay out of the startup path, checked before anything else can pull it in
+    pandas_loaded = "pandas" in sys.modules
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "profile.db")
+        open_db = lambda: DuckDBManager(db_path=path, archive_dir=None).close()
+        rows.append(("open db, fresh schema", _timed(open_db)))
+        rows.append(("open db, schema current", _timed(open_db)))
+
+    rows.append(("build application", _timed(lambda: Application.builder().token("0:profile").build())))
+
+    # the fresh-schema run is for comparison, a normal boot pays the current one
+    total = sum(seconds for label, seconds in rows if label != "open db, fresh schema")
+    width = max(len(label) for label, _ in rows)
+    for label, seconds in rows:
+        print(f"{label:<{width}} {seconds * 1000:>9.1f} ms")
+    print(f"{'total':<{width}} {total * 1000:>9.1f} ms (budget {budget * 1000:.0f} ms)")
+    print(f"pandas imported: {'yes' if pandas_loaded else 'no'}")
+    return 0 if total <= budget else 1
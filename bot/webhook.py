@@ -0,0 +1,139 @@
+import asyncio
+import hmac
+import json
+import logging
+from typing import Dict, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "x-telegram-bot-api-secret-token"
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    503: "Service Unavailable",
+}
+
+
+class WebhookServer:
+    """minimal asyncio http server that feeds telegram webhook posts into the application.
+
+    updates are validated and put on `application.update_queue`, the response
+    goes back as soon as the update is queued so telegram never waits on a
+    handler. `max_connections` caps how many requests are parsed at once.
+    """
+
+    def __init__(
+        self,
+        application: Application,
+        listen: str = "0.0.0.0",
+        port: int = 8443,
+        url_path: str = "/webhook",
+        secret_token: Optional[str] = None,
+        max_connections: int = 100,
+        max_body: int = 1 << 20,
+        read_timeout: float = 10.0,
+    ):
+        self.application = application
+        self.listen = listen
+        self.port = port
+        self.url_path = "/" + url_path.lstrip("/")
+        self.secret_token = secret_token
+        self.max_body = max_body
+        self.read_timeout = read_timeout
+        self._slots = asyncio.Semaphore(max_connections)
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    @property
+    def bound_port(self) -> int:
+        """the real port, useful when started with port 0"""
+        return self._server.sockets[0].getsockname()[1]
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.listen, self.port)
+        logger.info("Webhook listening on %s:%d%s", self.listen, self.bound_port, self.url_path)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """one connection, kept alive for as many requests as the client sends"""
+        try:
+            while True:
+                request = await asyncio.wait_for(self._read_request(reader), self.read_timeout)
+                if request is None:
+                    break
+                async with self._slots:
+                    status = await self._handle(*request)
+                keep_alive = request[2].get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                    f"Content-Length: 0\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode()
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(
+        self, reader: asyncio.StreamReader
+    ) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        method, path, _ = line.decode("latin-1").split(" ", 2)
+
+        headers: Dict[str, str] = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0))
+        if length > self.max_body:
+            return method, path, headers, b""
+        body = await reader.readexactly(length) if length else b""
+        return method, path, headers, body
+
+    async def _handle(self, method: str, path: str, headers: Dict[str, str], body: bytes) -> int:
+        if path.split("?", 1)[0] != self.url_path:
+            return 404
+        if method != "POST":
+            return 405
+        if self.secret_token is not None and not hmac.compare_digest(
+            headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            return 403
+        if int(headers.get("content-length", 0)) > self.max_body:
+            return 413
+
+        try:
+            update = Update.de_json(json.loads(body), self.application.bot)
+        except Exception:
+            logger.warning("Rejected malformed update body")
+            return 400
+        if update is None:
+            return 400
+
+        try:
+            # a full queue is backpressure, telegram retries on 5xx
+            self.application.update_queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return 503
+        return 200
@@ -0,0 +1,256 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from bot.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+_WAKE = object()
+_CALL = "__call__"
+
+
+class WriteBehindQueue:
+    """drains queued writes on a dedicated thread in batched transactions.
+
+    handlers enqueue (kind, payload) pairs and return straight away, the writer
+    thread groups whatever has arrived into one transaction per flush. a flush
+    happens once `batch_size` items are waiting or `flush_interval` seconds have
+    passed since the first item of the batch arrived.
+
+    one-off jobs (`call`) and periodic jobs (`every`) also run on the writer
+    thread, so everything that writes to the db is serialised through here.
+    """
+
+    def __init__(
+        self,
+        connect: Callable[[], Any],
+        flush_interval: float = 0.25,
+        batch_size: int = 500,
+        max_queue: int = 10_000,
+        put_timeout: float = 5.0,
+    ):
+        self._connect = connect
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.put_timeout = put_timeout
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=max_queue)
+        self._handlers: Dict[str, Callable[[Any, List[Any]], None]] = {}
+        self._on_commit: Dict[str, Callable[[List[Any]], None]] = {}
+        self._periodic: List[List[Any]] = []
+        self._thread: Optional[threading.Thread] = None
+
+    def register(
+        self,
+        kind: str,
+        handler: Callable[[Any, List[Any]], None],
+        on_commit: Optional[Callable[[List[Any]], None]] = None,
+    ) -> None:
+        """register the function that writes a batch of payloads of one kind.
+
+        `on_commit` gets the same payloads once the transaction holding them has
+        committed, on the writer thread.
+        """
+        self._handlers[kind] = handler
+        if on_commit is not None:
+            self._on_commit[kind] = on_commit
+
+    def every(
+        self,
+        interval: float,
+        job: Callable[[Any], None],
+        on_failure: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """run `job(conn)` in its own transaction every `interval` seconds.
+
+        `on_failure` is called on the writer thread when the job or its commit
+        raised and the transaction was rolled back.
+        """
+        self._periodic.append([interval, job, time.monotonic() + interval, on_failure])
+        if self._thread is not None:
+            # the writer may be blocked without a timeout, make it pick up the new schedule
+            self._queue.put(_WAKE)
+
+    @property
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="duckdb-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, kind: str, payload: Any) -> None:
+        """enqueue a write, blocking for up to `put_timeout` when the queue is full"""
+        if kind not in self._handlers:
+            raise ValueError(f"No writer registered for '{kind}'")
+        try:
+            self._queue.put((kind, payload), timeout=self.put_timeout)
+        except queue.Full:
+            raise RuntimeError(f"Write queue full, dropped '{kind}' write") from None
+
+    async def submit_async(self, kind: str, payload: Any) -> None:
+        """enqueue without blocking the event loop, waits off-loop under backpressure"""
+        if kind not in self._handlers:
+            raise ValueError(f"No writer registered for '{kind}'")
+        try:
+            self._queue.put_nowait((kind, payload))
+        except queue.Full:
+            await asyncio.to_thread(self.submit, kind, payload)
+
+    def call(self, job: Callable[[Any], Any], on_failure: Optional[Callable[[], None]] = None) -> Future:
+        """run `job(conn)` in its own transaction on the writer thread, `on_failure` as for `every`"""
+        future: Future = Future()
+        try:
+            self._queue.put((_CALL, (job, future, on_failure)), timeout=self.put_timeout)
+        except queue.Full:
+            raise RuntimeError("Write queue full, dropped job") from None
+        return future
+
+    async def call_async(self, job: Callable[[Any], Any], on_failure: Optional[Callable[[], None]] = None) -> Any:
+        """await the result of a writer-thread job"""
+        future = await asyncio.to_thread(self.call, job, on_failure)
+        return await asyncio.wrap_future(future)
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """flush everything still queued and stop the writer thread"""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _run(self) -> None:
+        conn = self._connect()
+        try:
+            while True:
+                batch, stop = self._next_batch()
+                if batch:
+                    self._flush(conn, batch)
+                if stop:
+                    break
+                self._run_periodic(conn)
+        finally:
+            conn.close()
+
+    def _next_batch(self) -> Tuple[List[Tuple[str, Any]], bool]:
+        """block for the first item then collect more until the batch is full or the interval ends"""
+        try:
+            item = self._queue.get(timeout=self._until_periodic())
+        except queue.Empty:
+            return [], False
+        if item is _STOP:
+            return [], True
+        if item is _WAKE:
+            return [], False
+
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            if item is not _WAKE:
+                batch.append(item)
+        return batch, False
+
+    def _until_periodic(self) -> Optional[float]:
+        if not self._periodic:
+            return None
+        return max(0.0, min(entry[2] for entry in self._periodic) - time.monotonic())
+
+    def _run_periodic(self, conn: Any) -> None:
+        now = time.monotonic()
+        for entry in self._periodic:
+            interval, job, due, on_failure = entry
+            if due > now:
+                continue
+            entry[2] = now + interval
+            try:
+                self._run_job(conn, job, on_failure)
+            except Exception:
+                logger.exception("Periodic writer job %r failed", job)
+
+    @staticmethod
+    def _run_job(conn: Any, job: Callable[[Any], Any], on_failure: Optional[Callable[[], None]] = None) -> Any:
+        conn.begin()
+        try:
+            result = job(conn)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            if on_failure is not None:
+                on_failure()
+            raise
+
+    def _flush(self, conn: Any, batch: List[Tuple[str, Any]]) -> None:
+        """write queued payloads in one transaction, jobs run on their own in arrival order"""
+        writes: List[Tuple[str, Any]] = []
+        for kind, payload in batch:
+            if kind != _CALL:
+                writes.append((kind, payload))
+                continue
+            self._flush_writes(conn, writes)
+            writes = []
+            job, future, on_failure = payload
+            try:
+                future.set_result(self._run_job(conn, job, on_failure))
+            except Exception as e:
+                future.set_exception(e)
+        self._flush_writes(conn, writes)
+
+    def _flush_writes(self, conn: Any, batch: List[Tuple[str, Any]]) -> None:
+        if not batch:
+            return
+        grouped: Dict[str, List[Any]] = {}
+        for kind, payload in batch:
+            grouped.setdefault(kind, []).append(payload)
+
+        start = time.perf_counter()
+        try:
+            conn.begin()
+            for kind, payloads in grouped.items():
+                self._handlers[kind](conn, payloads)
+            conn.commit()
+            METRICS.histogram("write", "batch").observe(time.perf_counter() - start)
+        except Exception:
+            conn.rollback()
+            METRICS.histogram("write", "batch").observe(time.perf_counter() - start, error=True)
+            logger.exception("Batched write of %d items failed, retrying one at a time", len(batch))
+            self._flush_each(conn, batch)
+            return
+        for kind, payloads in grouped.items():
+            self._committed(kind, payloads)
+
+    def _flush_each(self, conn: Any, batch: List[Tuple[str, Any]]) -> None:
+        """fallback so a single bad row does not take the rest of the batch with it"""
+        for kind, payload in batch:
+            try:
+                conn.begin()
+                self._handlers[kind](conn, [payload])
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                METRICS.count_error("write", kind)
+                logger.exception("Dropped '%s' write: %r", kind, payload)
+                continue
+            self._committed(kind, [payload])
+
+    def _committed(self, kind: str, payloads: List[Any]) -> None:
+        hook = self._on_commit.get(kind)
+        if hook is None:
+            return
+        try:
+            hook(payloads)
+        except Exception:
+            logger.exception("on_commit hook for '%s' failed", kind)
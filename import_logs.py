@@ -0,0 +1,31 @@
+"""bulk import historical vaping logs into vape_tracking.db
+
+    python import_logs.py history.csv more.jsonl
+    python import_logs.py setups.csv --kind setups
+
+the db file is opened directly, so stop the bot first (or send the file to the
+bot as a document instead).
+"""
+import argparse
+
+from bot.data_transfer import DuckDBManager
+from bot.importer import IMPORT_CHUNK_ROWS, LogImporter
+from bot.logs import setup_logging
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="csv or json/jsonl files")
+    parser.add_argument("--kind", choices=("auto", "events", "setups"), default="auto")
+    parser.add_argument("--user-id", type=int, help="assign every row to this user")
+    parser.add_argument("--chunk-rows", type=int, default=IMPORT_CHUNK_ROWS)
+    parser.add_argument("--db", default="vape_tracking.db")
+    args = parser.parse_args()
+
+    setup_logging(fmt="text")
+    db = DuckDBManager(db_path=args.db)
+    try:
+        importer = LogImporter(db, chunk_rows=args.chunk_rows)
+        for path in args.paths:
+            print(importer.import_file(path, kind=args.kind, user_id=args.user_id).summary())
+    finally:
+        db.close()
@@ -1,10 +0,0 @@
-import logging
-
-def get_logger(name: str):
-    logger = logging.getLogger(name)
-    logger.setLevel(logging.DEBUG)
-    handler = logging.StreamHandler()
-    fmt = logging.Formatter("[%(asctime)s] %(levelname)s - %(name)s: %(message)s")
-    handler.setFormatter(fmt)
-    logger.addHandler(handler)
-    return logger
@@ -1,4 +1,35 @@
-from bot.app import VapeBot
+import argparse
+import os
+import sys
 
 if __name__ == "__main__":
-    VapeBot().run()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rebuild-rollups", action="store_true",
+                        help="recompute daily/weekly rollups from raw puff events and exit")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="report import and init time before the first poll, exit 1 if over STARTUP_BUDGET")
+    parser.add_argument("--shards", type=int, default=int(os.getenv("SHARDS", "1")),
+                        help="worker processes, users are split between them by id (default SHARDS or 1)")
+    args = parser.parse_args()
+
+    # each mode imports only what it needs
+    if args.profile_startup:
+        from bot.startup import profile_startup
+        sys.exit(profile_startup(float(os.getenv("STARTUP_BUDGET", "2.0"))))
+    elif args.rebuild_rollups:
+        from dotenv import load_dotenv
+        from bot.app import db_from_env
+
+        # same .env, archive dir and settings as the bot, so archived days are rebuilt too
+        load_dotenv()
+        db = db_from_env()
+        try:
+            print(f"Rebuilt {db.rebuild_rollups()} daily rollup rows")
+        finally:
+            db.close()
+    elif args.shards > 1:
+        from bot.cluster import Cluster
+        Cluster(args.shards).run()
+    else:
+        from bot.app import VapeBot
+        VapeBot().run()
@@ -0,0 +1,49 @@
+"""per-user result caching and change tracking"""
+import pytest
+
+from bot.cache import ResultCache
+
+
+def test_result_from_before_an_invalidation_is_not_stored():
+    cache = ResultCache()
+
+    def load():
+        # the user's write commits while their query is running
+        cache.invalidate([1])
+        return "stale"
+
+    assert cache.get(1, "today", (), load) == "stale"
+    assert cache.get(1, "today", (), lambda: "fresh") == "fresh"
+    assert cache.get(1, "today", (), lambda: "unused") == "fresh"
+
+
+def test_generations_are_dropped_once_no_query_is_running():
+    cache = ResultCache(max_entries=10)
+
+    for user_id in range(1_000):
+        cache.get(user_id, "today", (), lambda: user_id)
+        cache.invalidate([user_id])
+
+    assert cache._generations == {} and cache._loading == {}
+    assert len(cache) == 0
+
+
+def test_versions_stay_bounded_and_never_go_back():
+    pytest.importorskip("duckdb")
+    pytest.importorskip("telegram")
+    from bot.data_transfer import DuckDBManager
+
+    db = DuckDBManager(db_path=":memory:", archive_dir=None, tracked_versions=3)
+    try:
+        db.touch([1])
+        before = db.data_version(1)
+        db.touch([2])
+        db.touch([3, 4, 5])
+
+        assert list(db._versions) == [3, 4, 5]
+        # dropped users read the newest dropped version, not 0
+        assert db.data_version(1) == db.data_version(2) >= before
+        db.touch([1])
+        assert db.data_version(1) > max(db.data_version(u) for u in (2, 3, 4, 5))
+    finally:
+        db.close()
@@ -0,0 +1,69 @@
+"""handlers end to end on the stub bot api, replies going through an Outbox"""
+import asyncio
+from datetime import datetime
+
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("telegram")
+pytest.importorskip("matplotlib")
+
+from telegram import Update
+
+from benchmarks.stub_telegram import StubRequest, build_application, message_update
+from bot.charts import ProgressCharts
+from bot.data_transfer import DuckDBManager
+from bot.handlers import register_handlers
+from bot.models import SetupData
+from bot.outbox import Outbox
+
+USER = 1001
+
+
+async def converse(db: DuckDBManager, texts, tmp_path) -> StubRequest:
+    request = StubRequest()
+    app = build_application(request)
+    # one message a second per chat, so text queued by one update is still waiting during the next
+    outbox = Outbox(
+        lambda chat_id, text, **options: app.bot.send_message(chat_id, text, **options),
+        chat_rate=1.0,
+        chat_burst=1.0,
+    )
+    charts = ProgressCharts(db, cache_dir=str(tmp_path / "charts"), workers=1)
+    register_handlers(app, db, outbox=outbox, charts=charts)
+    await app.initialize()
+    await outbox.start()
+    try:
+        for n, text in enumerate(texts, start=1):
+            await app.process_update(Update.de_json(message_update(n, USER, text), app.bot))
+            # a person types slower than the writer flushes
+            await db.sync()
+        await outbox.stop()
+    finally:
+        await app.shutdown()
+        charts.close()
+    return request
+
+
+@pytest.fixture
+def db():
+    db = DuckDBManager(db_path=":memory:", archive_dir=None)
+    now = datetime.now()
+    db.upsert_setups([SetupData(
+        user_id=USER, tokes=100, strength=6, method="number", reduce_amount=10, reduce_percent=10.0,
+        created_at=now, updated_at=now,
+    )])
+    yield db
+    db.close()
+
+
+def test_progress_chart_follows_the_text_queued_before_it(db, tmp_path):
+    request = asyncio.run(converse(db, ["/puff 3", "/puff 2", "/progress 7"], tmp_path))
+
+    assert request.sent == [("sendMessage", USER), ("sendMessage", USER), ("sendPhoto", USER)]
+
+
+def test_export_document_follows_the_text_queued_before_it(db, tmp_path):
+    request = asyncio.run(converse(db, ["/puff 3", "/puff 2", "/export csv"], tmp_path))
+
+    assert request.sent == [("sendMessage", USER), ("sendMessage", USER), ("sendDocument", USER)]
@@ -0,0 +1,63 @@
+"""csv/json history imports through LogImporter"""
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("telegram")
+
+from bot.data_transfer import DuckDBManager
+from bot.importer import LogImporter
+
+
+@pytest.fixture
+def db():
+    db = DuckDBManager(db_path=":memory:", archive_dir=None)
+    yield db
+    db.close()
+
+
+def events_file(tmp_path, rows) -> str:
+    path = tmp_path / "history.csv"
+    path.write_text("user_id,ts,puffs\n" + "".join(f"{uid},2026-01-0{day} 12:00:00,{puffs}\n" for uid, day, puffs in rows))
+    return str(path)
+
+
+def puff_count(db: DuckDBManager) -> int:
+    with db.reads.cursor() as cursor:
+        return cursor.execute("SELECT count(*) FROM puff_events").fetchone()[0]
+
+
+def test_rows_expand_to_their_puff_count(db, tmp_path):
+    path = events_file(tmp_path, [(1, 1, 3), (2, 2, 4), (1, 3, 0)])
+
+    result = LogImporter(db).import_file(path)
+
+    assert (result.rows_read, result.rows_rejected, result.rows_written) == (3, 1, 7)
+    assert puff_count(db) == 7
+
+
+def test_file_over_the_total_cap_writes_nothing(db, tmp_path):
+    # every row is under MAX_PUFFS_PER_ROW, the sum is not
+    path = events_file(tmp_path, [(1, day, 9_000) for day in range(1, 4)])
+
+    with pytest.raises(ValueError, match="27,000 puffs"):
+        LogImporter(db).import_file(path, max_puffs=20_000)
+
+    assert puff_count(db) == 0
+
+
+def test_upload_cap_counts_only_the_pinned_users_valid_rows(db, tmp_path):
+    path = events_file(tmp_path, [(7, 1, 600), (8, 2, 500), (9, 3, -5)])
+
+    result = db.import_file(path, user_id=1, max_puffs=1_100)
+
+    assert result.rows_written == 1_100
+    assert puff_count(db) == 1_100
+
+
+def test_json_numbers_round_like_the_python_parser(db, tmp_path):
+    path = tmp_path / "history.jsonl"
+    path.write_text('{"user_id": 1, "ts": "2026-01-01 12:00:00", "puffs": 2.6}\n')
+
+    result = LogImporter(db).import_file(str(path))
+
+    assert result.rows_written == 3
@@ -0,0 +1,95 @@
+"""snapshot, retention and checkpoint on a live manager"""
+import os
+from datetime import date, datetime, timedelta
+
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+pytest.importorskip("telegram")
+
+from bot.data_transfer import DuckDBManager
+from bot.maintenance import MaintenanceService
+from bot.models import PuffEvent, SetupData
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = DuckDBManager(db_path=str(tmp_path / "bot.db"), archive_dir=str(tmp_path / "archive"))
+    db.upsert_setups([SetupData(user_id=1, tokes=100, method="number", reduce_amount=5, updated_at=datetime.now())])
+    yield db
+    db.close()
+
+
+def service(db: DuckDBManager, tmp_path, **options) -> MaintenanceService:
+    return MaintenanceService(db, snapshot_dir=str(tmp_path / "snapshots"), probe=0.01, **options)
+
+
+def test_checkpoint_after_a_read_and_an_archive_rollover(db, tmp_path):
+    # a point read leaves its pool cursor behind, the archive replaces the puff_history view
+    assert db.today_vs_target(1).target == 95
+    db.append_puffs([PuffEvent(user_id=1, ts=datetime.now() - timedelta(days=30), strength=3)] * 10)
+    assert db.archive_puffs() == 10
+
+    maintenance = service(db, tmp_path)
+    maintenance.run_once()
+
+    assert (maintenance.runs, maintenance.failures) == (1, 0)
+
+
+def test_retention_drops_archived_days_and_keeps_rollups(db, tmp_path):
+    old = datetime.combine(date.today() - timedelta(days=40), datetime.min.time())
+    db.append_puffs([PuffEvent(user_id=1, ts=old + timedelta(days=k), strength=3) for k in range(3)])
+    db.archive_puffs()
+
+    maintenance = service(db, tmp_path, retain_days=39)
+    maintenance.run_once()
+
+    assert maintenance.failures == 0
+    assert db.archived_days_before(date.today()) == [old.date() + timedelta(days=1), old.date() + timedelta(days=2)]
+    series = db.progress_series(1, old.date(), old.date() + timedelta(days=2))
+    assert [p.puffs for p in series] == [1, 1, 1]
+
+
+def test_snapshot_restores_with_import_database(db, tmp_path):
+    db.append_puffs([PuffEvent(user_id=1, ts=datetime.now(), strength=3)] * 4)
+
+    path = service(db, tmp_path).snapshot()
+
+    assert {"schema.sql", "load.sql", "user_setups.parquet", "puff_events.parquet"} <= set(os.listdir(path))
+    restored = duckdb.connect()
+    cwd = os.getcwd()
+    os.chdir(path)
+    try:
+        restored.execute("IMPORT DATABASE '.'")
+    finally:
+        os.chdir(cwd)
+    assert restored.execute("SELECT count(*) FROM puff_events").fetchone()[0] == 4
+    assert restored.execute("SELECT tokes FROM user_setups WHERE user_id = 1").fetchone()[0] == 100
+
+
+def test_reopening_points_puff_history_at_the_current_archive(tmp_path):
+    path = str(tmp_path / "bot.db")
+    db = DuckDBManager(db_path=path, archive_dir=str(tmp_path / "archive"))
+    db.append_puffs([PuffEvent(user_id=1, ts=datetime.now() - timedelta(days=30), strength=3)] * 2)
+    db.archive_puffs()
+    db.close()
+
+    # reopened without an archive, the stored view still read the old parquet files
+    db = DuckDBManager(db_path=path, archive_dir=None)
+    try:
+        with db.reads.cursor() as cursor:
+            assert cursor.execute("SELECT count(*) FROM puff_history").fetchone()[0] == 0
+    finally:
+        db.close()
+
+
+def test_archive_dir_with_a_quote(tmp_path):
+    db = DuckDBManager(db_path=":memory:", archive_dir=str(tmp_path / "o'brien archive"))
+    try:
+        db.append_puffs([PuffEvent(user_id=1, ts=datetime.now() - timedelta(days=30), strength=3)] * 3)
+
+        assert db.archive_puffs() == 3
+        with db.reads.cursor() as cursor:
+            assert cursor.execute("SELECT count(*) FROM puff_history").fetchone()[0] == 3
+    finally:
+        db.close()
@@ -0,0 +1,44 @@
+"""DataParser's sql rules against its python parsers"""
+from typing import Any, Optional
+
+import pytest
+
+duckdb = pytest.importorskip("duckdb")
+
+from bot.models import DataParser
+
+# (duckdb type the value arrives as, value), csv columns are read as text and json numbers as numbers
+INPUTS = [
+    ("VARCHAR", "200"),
+    ("VARCHAR", "200 puffs"),
+    ("VARCHAR", "-3"),
+    ("VARCHAR", "2.7"),
+    ("VARCHAR", "12.5%"),
+    ("VARCHAR", "1,234.5"),
+    ("VARCHAR", "none"),
+    ("BIGINT", 20),
+    ("BIGINT", -4),
+    ("DOUBLE", 2.7),
+    ("DOUBLE", 3.6),
+    ("DOUBLE", 2.5),
+    ("DOUBLE", 3.5),
+    ("DOUBLE", -1.5),
+    ("DECIMAL(4,1)", 3.6),
+]
+
+
+def python_rule(field_type: type, value: Any) -> Optional[Any]:
+    try:
+        return DataParser.enforce_type(field_type, value, "v")
+    except ValueError:
+        return None
+
+
+@pytest.mark.parametrize("field_type", [int, float])
+@pytest.mark.parametrize("sql_type, value", INPUTS)
+def test_sql_rule_matches_python(field_type, sql_type, value):
+    rule = DataParser.sql_rule(field_type, '"v"')
+
+    (parsed,) = duckdb.execute(f'SELECT {rule} FROM (SELECT ?::{sql_type} AS "v")', [value]).fetchone()
+
+    assert parsed == python_rule(field_type, value)
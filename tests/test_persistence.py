@@ -0,0 +1,65 @@
+"""DuckDBPersistence flushing through the writer thread"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("telegram")
+
+from bot.data_transfer import DuckDBManager
+from bot.persistence import DuckDBPersistence
+
+
+@pytest.fixture
+def db():
+    db = DuckDBManager(db_path=":memory:", archive_dir=None)
+    yield db
+    db.close()
+
+
+def stored_users(db: DuckDBManager) -> dict:
+    with db.reads.cursor() as cursor:
+        return dict(cursor.execute("SELECT user_id, data FROM ptb_user_data").fetchall())
+
+
+def test_failed_flush_keeps_its_entries_for_the_next_one(db, monkeypatch):
+    persistence = DuckDBPersistence(db, flush_interval=3600)
+    write = DuckDBPersistence._write
+
+    def failing(conn, table, key, dirty):
+        write(conn, table, key, dirty)
+        raise OSError("disk full")
+
+    async def run():
+        await persistence.update_user_data(1, {"draft": "old"})
+        await persistence.update_conversation("setup", (1, 1), 2)
+        monkeypatch.setattr(DuckDBPersistence, "_write", staticmethod(failing))
+        with pytest.raises(OSError):
+            await persistence.flush()
+        # marked again while the entries were out, the newer copy wins
+        await persistence.update_user_data(1, {"draft": "new"})
+        monkeypatch.setattr(DuckDBPersistence, "_write", staticmethod(write))
+        await persistence.flush()
+        return await persistence.get_conversations("setup")
+
+    assert asyncio.run(run()) == {(1, 1): 2}
+    assert list(stored_users(db)) == [1]
+    assert persistence._dirty_users == {}
+
+
+def test_users_dropped_from_the_loaded_set_are_read_again(db):
+    persistence = DuckDBPersistence(db, flush_interval=3600, max_loaded=2)
+
+    async def run():
+        await persistence.update_user_data(1, {"goal": 10})
+        await persistence.flush()
+        await persistence.update_user_data(9, {})
+        await persistence.flush()
+        for user_id in (1, 2, 3):
+            await persistence.refresh_user_data(user_id, {})
+        data = {"draft": True}
+        await persistence.refresh_user_data(1, data)
+        return data
+
+    assert asyncio.run(run()) == {"goal": 10, "draft": True}
+    assert len(persistence._loaded_users) == 2
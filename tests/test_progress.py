@@ -0,0 +1,70 @@
+"""progress reads against the planned target"""
+from datetime import date, datetime, time, timedelta
+
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("telegram")
+
+from bot.data_transfer import DuckDBManager, week_start
+from bot.models import PuffEvent, SetupData
+
+
+@pytest.fixture
+def db():
+    db = DuckDBManager(db_path=":memory:", archive_dir=None)
+    yield db
+    db.close()
+
+
+def setup_on(db: DuckDBManager, day: date, **fields) -> SetupData:
+    changed = datetime.combine(day, time(9))
+    setup = SetupData(user_id=1, tokes=100, strength=6, created_at=changed, updated_at=changed, **fields)
+    db.upsert_setups([setup])
+    return setup
+
+
+def test_series_follows_the_number_taper(db):
+    start = date.today() - timedelta(days=2)
+    setup_on(db, start, method="number", reduce_amount=10, reduce_percent=10.0)
+    db.append_puffs([PuffEvent(user_id=1, ts=datetime.combine(start, time(12)), strength=6)] * 5)
+
+    series = db.progress_series(1, start - timedelta(days=1), start + timedelta(days=2))
+
+    assert [p.period for p in series] == [start + timedelta(days=k) for k in range(-1, 3)]
+    # the day before the setup gets the first day's target
+    assert [p.target for p in series] == [90, 90, 80, 70]
+    assert [p.puffs for p in series] == [0, 5, 0, 0]
+    assert series[1].nicotine_mg == pytest.approx(5 * 6 * 0.01)
+
+
+def test_series_follows_the_percent_taper(db):
+    start = date.today()
+    setup_on(db, start, method="percent", reduce_amount=50, reduce_percent=50.0)
+
+    series = db.progress_series(1, start, start + timedelta(days=2))
+
+    assert [p.target for p in series] == [50, 25, 13]
+
+
+def test_series_without_a_setup_has_no_target(db):
+    series = db.progress_series(2, date.today() - timedelta(days=1), date.today())
+
+    assert [p.target for p in series] == [None, None]
+    assert [p.puffs for p in series] == [0, 0]
+
+
+def test_reads_agree_with_the_plan(db):
+    start = date.today() - timedelta(days=3)
+    setup_on(db, start, method="number", reduce_amount=10, reduce_percent=10.0)
+    db.build_plans()
+
+    plan = dict(db.plan_for(1))
+    today = db.today_vs_target(1)
+    week = db.week_vs_target(1)
+    days = [week_start(date.today()) + timedelta(days=k) for k in range(7)]
+    series = db.progress_series(1, days[0], days[-1])
+
+    assert today.target == plan[date.today()] == 60
+    assert {p.period: p.target for p in series if p.period in plan} == {d: plan[d] for d in days if d in plan}
+    assert week.target == sum(p.target for p in series)
@@ -0,0 +1,145 @@
+"""daily reminder fan-out against a stubbed bot api.
+
+kept at a few thousand users so the suite stays quick, the 100k run is
+`python -m benchmarks.bench_reminders --users 100000`.
+"""
+import asyncio
+import random
+import time as clock
+from collections import Counter
+from datetime import date, datetime, time, timedelta, timezone
+
+import pytest
+
+pytest.importorskip("duckdb")
+pytest.importorskip("telegram")
+
+from telegram.error import Forbidden, NetworkError, RetryAfter
+
+from bot.data_transfer import DuckDBManager
+from bot.outbox import Outbox
+from bot.reminders import ReminderScheduler
+
+USERS = 5_000
+
+
+class StubSend:
+    """stands in for bot.send_message, throws the errors telegram would at a steady rate"""
+
+    def __init__(self, blocked=frozenset()):
+        self.blocked = blocked
+        self.delivered: Counter = Counter()
+        self.refused = set()
+        self.calls = 0
+
+    async def __call__(self, chat_id: int, text: str, **options) -> None:
+        self.calls += 1
+        if chat_id in self.blocked:
+            self.refused.add(chat_id)
+            raise Forbidden("bot was blocked by the user")
+        if self.calls % 2_000 == 0:
+            raise RetryAfter(1)
+        if self.calls % 797 == 0:
+            raise NetworkError("connection reset")
+        self.delivered[chat_id] += 1
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = DuckDBManager(db_path=":memory:", archive_dir=None)
+    ids = list(range(1, USERS + 1))
+    minutes = [random.randrange(0, 24 * 60) for _ in ids]
+    db.writer.call(lambda conn: conn.execute(
+        "INSERT INTO reminders SELECT UNNEST(?::BIGINT[]), UNNEST(?::SMALLINT[]), NULL", [ids, minutes]
+    )).result()
+    # the message text is not under test, skip 100k progress queries
+    monkeypatch.setattr(db, "today_vs_target", lambda user_id, day=None: None)
+    yield db
+    db.close()
+
+
+def end_of_today() -> datetime:
+    """the last second of the server-local day, when every reminder of the day is due"""
+    tomorrow = date.today() + timedelta(days=1)
+    return datetime.combine(tomorrow, time()).astimezone(timezone.utc) - timedelta(seconds=1)
+
+
+async def fan_out(db: DuckDBManager, send: StubSend, restart_after: int) -> ReminderScheduler:
+    outbox = Outbox(send, rate=1e6, workers=64, backoff=0.01)
+    await outbox.start()
+    now = end_of_today()
+
+    def scheduler() -> ReminderScheduler:
+        return ReminderScheduler(db, outbox.send, rate=1e6, workers=32, now=lambda: now)
+
+    async def run(until: int) -> ReminderScheduler:
+        reminders = scheduler()
+        await reminders.start()
+        while len(send.delivered) + len(send.refused) < until:
+            await asyncio.sleep(0.01)
+        await reminders.stop()
+        return reminders
+
+    try:
+        await asyncio.wait_for(run(restart_after), 60)
+        return await asyncio.wait_for(run(USERS), 60)
+    finally:
+        await outbox.stop()
+
+
+def test_every_user_reminded_once_across_a_restart(db):
+    send = StubSend()
+    asyncio.run(fan_out(db, send, restart_after=USERS // 2))
+
+    assert len(send.delivered) == USERS
+    assert max(send.delivered.values()) == 1
+    assert db.reminders_due(date.today()) == []
+
+
+def test_blocked_users_lose_their_reminder(db):
+    blocked = frozenset(range(1, USERS + 1, 100))
+    send = StubSend(blocked)
+    reminders = asyncio.run(fan_out(db, send, restart_after=USERS // 2))
+
+    assert len(send.delivered) == USERS - len(blocked)
+    assert max(send.delivered.values()) == 1
+    assert reminders.failed == 0
+    tomorrow = {user_id for user_id, _ in db.reminders_due(date.today() + timedelta(days=1))}
+    assert len(tomorrow) == USERS - len(blocked)
+    assert not tomorrow & blocked
+
+
+def test_reminder_the_outbox_gave_up_on_is_retried_the_same_day(db):
+    # ten users due a minute before local noon, on a clock that starts at noon and runs
+    noon = datetime.combine(date.today(), time(12)).astimezone(timezone.utc)
+    minute = (noon.hour * 60 + noon.minute - 1) % (24 * 60)
+    db.writer.call(lambda conn: conn.execute(
+        "DELETE FROM reminders WHERE user_id > 10; UPDATE reminders SET minute_utc = ?", [minute]
+    )).result()
+    started = clock.monotonic()
+    failing = {3: 1, 4: 5}
+    delivered = []
+
+    async def send(chat_id: int, text: str) -> None:
+        if failing.get(chat_id, 0):
+            failing[chat_id] -= 1
+            raise NetworkError("retries used up")
+        delivered.append(chat_id)
+
+    async def run() -> ReminderScheduler:
+        reminders = ReminderScheduler(
+            db, send, rate=1e6, now=lambda: noon + timedelta(seconds=clock.monotonic() - started),
+            retry_delay=timedelta(milliseconds=20), attempts=3,
+        )
+        await reminders.start()
+        while len(delivered) < 9 or reminders.failed < 1:
+            await asyncio.sleep(0.01)
+        await reminders.stop()
+        return reminders
+
+    reminders = asyncio.run(asyncio.wait_for(run(), 60))
+
+    assert sorted(delivered) == [1, 2, 3, 5, 6, 7, 8, 9, 10]
+    # 3 went out on its second try, 4 failed all three sends and waits for tomorrow
+    assert (reminders.retried, reminders.failed) == (3, 1)
+    assert db.reminders_due(date.today()) == [(4, minute)]